@@ -0,0 +1,251 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+Adaptive probe point selection for a leveling check: probe only as many points as the requested
+accuracy of the mount point corrections needs, instead of a full grid.
+
+The planar_fit model z = ax + by + c is linear, so the variance of any correction it predicts is
+sigma^2 j^T (X^T X)^-1 j, where X holds a row (x, y, 1) per probe and j = (x - x_high, y - y_high, 0)
+for a mount at (x, y) and the highest mount at (x_high, y_high).  It depends on where the probes are,
+not on what they measure, so the effect of each candidate next point can be predicted before probing it.
+After each probe, AdaptiveSampler picks, from a grid of candidates within the LFTMOST_X, RGTMOST_X,
+FRNTMOST_Y, BACKMOST_Y area, the point that leaves the largest correction variance smallest (G-optimal),
+or the one that most increases det(X^T X) (D-optimal).  All the candidates are scored at once, with a
+Sherman-Morrison update of (X^T X)^-1.  Until 3 probes define a plane, D-optimal is used.  Each
+candidate is probed at most once, so the probes spread around the corners rather than repeating them,
+which keeps some check on the planar model.
+
+Sampling stops once every correction's predicted standard error is within tolerance_mm.  With few
+probes the fit's residual standard deviation, on count - 3 degrees of freedom, can come out far too
+small by chance, so until it has min_dof of them the larger of it and the assumed noise_std_mm is used.
+
+    python adaptive_survey.py [<tolerance mm> [<noise mm>]]        simulated leveling check
+"""
+
+import numpy as np
+import sys
+
+from planar_fit import BACKMOST_Y, FRNTMOST_Y, IncrementalPlaneFit, LFTMOST_X, NOISE_STD_MM, RGTMOST_X, \
+    level_table, table_mount_points
+
+
+GRID_MM = 10.0
+
+
+class AdaptiveSampler(object):
+    """
+    Chooses the next probe point of a leveling check.  Call next_point(), probe there, add() the result,
+    and repeat until next_point() returns None.
+    """
+    def __init__(self, tolerance_mm, mount_points=None, criterion_str="G", grid_mm=GRID_MM,
+                 noise_std_mm=NOISE_STD_MM, min_count=6, max_count=100, min_dof=10):
+        """
+        :param tolerance_mm:    largest acceptable standard error of a mount point correction
+        :param mount_points:    planar_fit.MountPoints, default planar_fit.table_mount_points()
+        :param criterion_str:   "G" to minimize the largest correction variance, "D" to maximize det(X^T X)
+        :param grid_mm:         candidate point spacing
+        :param noise_std_mm:    probe repeatability to assume, the least standard deviation used before min_dof
+        :param min_count:       fewest probes before stopping
+        :param max_count:       most probes, whether or not tolerance_mm is met
+        :param min_dof:         residual degrees of freedom (probes - 3) to trust the fit's standard deviation alone
+        """
+        assert isinstance(tolerance_mm, float) and 0.0 < tolerance_mm
+        assert criterion_str in ("G", "D")
+        assert isinstance(grid_mm, float) and 0.0 < grid_mm
+        assert isinstance(min_count, int) and 4 <= min_count <= max_count
+        assert isinstance(min_dof, int) and 1 <= min_dof
+
+        self.__tolerance_mm = tolerance_mm
+        self.__mount_points = table_mount_points() if mount_points is None else mount_points
+        self.__criterion_str = criterion_str
+        self.__noise_std_mm = noise_std_mm
+        self.__min_count = min_count
+        self.__max_count = max_count
+        self.__min_dof = min_dof
+        self.__plane_fit = IncrementalPlaneFit()
+
+        # Coordinates relative to the area's middle keep X^T X well conditioned
+        self.__center = np.array(((LFTMOST_X + RGTMOST_X) / 2.0, (FRNTMOST_Y + BACKMOST_Y) / 2.0))
+        x_count = 1 + int(round((RGTMOST_X - LFTMOST_X) / grid_mm))
+        y_count = 1 + int(round((BACKMOST_Y - FRNTMOST_Y) / grid_mm))
+        x_grid, y_grid = np.meshgrid(np.linspace(LFTMOST_X, RGTMOST_X, x_count),
+                                     np.linspace(FRNTMOST_Y, BACKMOST_Y, y_count))
+        self.__candidates = np.column_stack((x_grid.ravel(), y_grid.ravel()))
+        self.__grid_mm = grid_mm
+        self.__information = np.zeros((3, 3))   # X^T X
+
+    @property
+    def plane_fit(self):        # the IncrementalPlaneFit of the probes so far
+        return self.__plane_fit
+
+    @property
+    def count(self):
+        return self.__plane_fit.count
+
+    def add(self, x, y, z):
+        """
+        Add a probe's result.
+
+        :param x:   x value
+        :param y:   y value
+        :param z:   measured height z
+
+        :return:    nothing
+        """
+        self.__plane_fit.add(x, y, z)
+        row = self.__design_rows(np.array([[x, y]]))[0]
+        self.__information += np.outer(row, row)
+        distance_squared = ((self.__candidates - (x, y))**2).sum(axis=1)
+        self.__candidates = self.__candidates[(self.__grid_mm / 2.0)**2 <= distance_squared]
+
+    def predicted_correction_std(self):
+        """
+        :return:    predicted standard error of each mount point's correction, or None before 3 probes
+        """
+        variances = self.__correction_variances(self.__inverse_information())
+        if variances is None:
+            return None
+        return self.__sigma() * np.sqrt(variances)
+
+    @property
+    def is_done(self):
+        """
+        :return:    True once tolerance_mm is met, or max_count probes are in, or there is nowhere left to probe
+        """
+        if self.__max_count <= self.count or 0 == len(self.__candidates):
+            return True
+        if self.count < self.__min_count:
+            return False
+        correction_std = self.predicted_correction_std()
+        return correction_std is not None and correction_std.max() <= self.__tolerance_mm
+
+    def next_point(self):
+        """
+        :return:    (x, y) to probe next, or None when done
+        """
+        if self.is_done:
+            return None
+
+        inverse_information = self.__inverse_information()
+        rows = self.__design_rows(self.__candidates)
+        if inverse_information is None:
+            # D-optimal with a slight ridge, to choose the first probes
+            inverse_information = np.linalg.inv(self.__information + 1e-6 * np.eye(3))
+            score = -np.einsum("ij,jk,ik->i", rows, inverse_information, rows)
+        elif "D" == self.__criterion_str:
+            score = -np.einsum("ij,jk,ik->i", rows, inverse_information, rows)     # det ratio is 1 + this
+        else:
+            # Correction variances after adding each candidate, by Sherman-Morrison: V - (J Minv d)^2 / (1 + d Minv d)
+            jacobian = self.__correction_jacobian()
+            projections = jacobian.dot(inverse_information).dot(rows.T)
+            denominators = 1.0 + np.einsum("ij,jk,ik->i", rows, inverse_information, rows)
+            variances = self.__correction_variances(inverse_information)
+            score = (variances[:, np.newaxis] - projections**2 / denominators).max(axis=0)
+
+        x, y = self.__candidates[int(np.argmin(score))]
+        return float(x), float(y)
+
+    def __design_rows(self, xy_array):
+        return np.column_stack((xy_array - self.__center, np.ones(len(xy_array))))
+
+    def __inverse_information(self):
+        if self.count < 3 or np.linalg.matrix_rank(self.__information) < 3:
+            return None
+        return np.linalg.inv(self.__information)
+
+    def __correction_jacobian(self):
+        coeffs = self.__plane_fit.coeffs
+        if coeffs is None:
+            return None
+        highest = int(np.argmax(level_table(coeffs, self.__mount_points).mount_z))
+        x = self.__mount_points.x
+        y = self.__mount_points.y
+        return np.column_stack((x - x[highest], y - y[highest], np.zeros(len(x))))
+
+    def __correction_variances(self, inverse_information):
+        jacobian = self.__correction_jacobian()
+        if inverse_information is None or jacobian is None:
+            return None
+        return np.einsum("ij,jk,ik->i", jacobian, inverse_information, jacobian)
+
+    def __sigma(self):
+        residual_std_mm = self.__plane_fit.residual_std_mm
+        if residual_std_mm is None:
+            return self.__noise_std_mm
+        if self.count - 3 < self.__min_dof:
+            return max(self.__noise_std_mm, residual_std_mm)
+        return residual_std_mm
+
+
+def adaptive_probe_survey(session, tolerance_mm, max_depth_mm, safe_z=0.0, sampler=None):
+    """
+    A leveling check: probe the surface where an AdaptiveSampler says, until its tolerance is met.
+
+    :param session:         shapeoko_commands.ShapeokoSession, connected and homed
+    :param tolerance_mm:    largest acceptable standard error of a mount point correction
+    :param max_depth_mm:    how far below safe_z to search for the surface
+    :param safe_z:          height for traverses between points
+    :param sampler:         AdaptiveSampler, default one for tolerance_mm and the table's mount points
+
+    :return:    (list of (x, y, z) contact points, the AdaptiveSampler)
+    """
+    sampler = AdaptiveSampler(tolerance_mm) if sampler is None else sampler
+    sample_list = []
+    assert session.goto_z(safe_z), "{0}: adaptive_probe_survey() failed to raise the tool".format(session.name_str)
+    xy = sampler.next_point()
+    while xy is not None:
+        x, y = xy
+        assert session.goto_xy(x, y), "{0}: adaptive_probe_survey() failed to reach ({1}, {2})".format(
+            session.name_str, x, y)
+        contact_position = session.probe_z(max_depth_mm)
+        assert contact_position is not None, "{0}: adaptive_probe_survey() no contact at ({1}, {2})".format(
+            session.name_str, x, y)
+        sample_list.append((x, y, contact_position.z))
+        sampler.add(x, y, contact_position.z)
+        xy = sampler.next_point()
+    return sample_list, sampler
+
+
+if "__main__" == __name__:
+    tolerance_mm = float(sys.argv[1]) if 1 < len(sys.argv) else 0.01
+    noise_std_mm = float(sys.argv[2]) if 2 < len(sys.argv) else NOISE_STD_MM
+
+    # A tilted table, probed with noise
+    random_state = np.random.RandomState(0)
+    true_coeffs = (0.0004, -0.0007, -60.0)
+
+    for criterion_str in ("G", "D"):
+        sampler = AdaptiveSampler(tolerance_mm, criterion_str=criterion_str, noise_std_mm=noise_std_mm)
+        xy = sampler.next_point()
+        while xy is not None:
+            x, y = xy
+            sampler.add(x, y, true_coeffs[0] * x + true_coeffs[1] * y + true_coeffs[2] +
+                        random_state.normal(0.0, noise_std_mm))
+            xy = sampler.next_point()
+
+        correction_error = np.abs(level_table(sampler.plane_fit.coeffs).adjustments -
+                                  level_table(true_coeffs).adjustments)
+        print
+        print "{0}-optimal: {1} probes, predicted correction std <= {2:.4f} mm, actual error <= {3:.4f} mm".format(
+            criterion_str, sampler.count, sampler.predicted_correction_std().max(), correction_error.max())
+    print
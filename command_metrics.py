@@ -0,0 +1,314 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import collections
+import math
+import threading
+import time
+
+
+SERIAL_BYTES_PER_S = 115200 / 10.0      # 8N1 at 115200 baud
+HISTOGRAM_MIN_S = 1e-5                  # latencies are binned logarithmically from here...
+HISTOGRAM_MAX_S = 1e3                   # ...to here
+HISTOGRAM_BINS_PER_DECADE = 20
+PERCENTILE_LIST = [50.0, 90.0, 99.0]
+
+
+def command_type(cmd_str):
+    """
+    :param cmd_str: Shapeoko command string, e.g. "G01 X-10.000 F1000.000"
+
+    :return:    its first word, e.g. "G01", "$H", "G38.2"
+    """
+    word_list = cmd_str.split()
+    return word_list[0].upper() if word_list else "(blank)"
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies in logarithmically spaced bins, with exact count, sum, minimum and maximum.
+    Percentiles are estimated from the bins, to within one bin width (about 12%).
+    """
+    def __init__(self):
+        self.__bin_count = int(round(math.log10(HISTOGRAM_MAX_S / HISTOGRAM_MIN_S) * HISTOGRAM_BINS_PER_DECADE))
+        self.__bin_list = [0] * (self.__bin_count + 2)     # plus underflow and overflow bins
+        self.__count = 0
+        self.__sum_s = 0.0
+        self.__min_s = None
+        self.__max_s = None
+
+    @property
+    def count(self):
+        return self.__count
+
+    @property
+    def mean_s(self):
+        return self.__sum_s / self.__count if 0 < self.__count else None
+
+    @property
+    def min_s(self):
+        return self.__min_s
+
+    @property
+    def max_s(self):
+        return self.__max_s
+
+    @property
+    def bin_list(self):         # [underflow, bin 0, ..., bin N - 1, overflow]
+        return list(self.__bin_list)
+
+    def bin_upper_edge_s(self, i):
+        """
+        :param i:   index into bin_list
+
+        :return:    the latency at the top of that bin
+        """
+        return HISTOGRAM_MIN_S * 10.0 ** (float(i) / HISTOGRAM_BINS_PER_DECADE)
+
+    def add(self, latency_s):
+        if latency_s < HISTOGRAM_MIN_S:
+            i = 0
+        else:
+            i = 1 + int(math.log10(latency_s / HISTOGRAM_MIN_S) * HISTOGRAM_BINS_PER_DECADE)
+            i = min(i, self.__bin_count + 1)
+        self.__bin_list[i] += 1
+        self.__count += 1
+        self.__sum_s += latency_s
+        self.__min_s = latency_s if self.__min_s is None else min(self.__min_s, latency_s)
+        self.__max_s = latency_s if self.__max_s is None else max(self.__max_s, latency_s)
+
+    def percentile_s(self, percent):
+        """
+        :param percent: e.g. 99.0
+
+        :return:    estimated latency below which percent of the samples fall, or None if no samples
+        """
+        assert 0.0 <= percent <= 100.0
+        if 0 == self.__count:
+            return None
+        rank = percent / 100.0 * self.__count
+        cumulative = 0
+        for i, n in enumerate(self.__bin_list):
+            cumulative += n
+            if cumulative >= rank and 0 < n:
+                return min(max(self.bin_upper_edge_s(i), self.__min_s), self.__max_s)
+        return self.__max_s
+
+
+class CommandTypeMetrics(object):
+    """
+    Counters for one command type.
+    """
+    def __init__(self, type_str):
+        self.__type_str = type_str
+        self.__sent_count = 0
+        self.__ok_count = 0
+        self.__failure_count = 0
+        self.__bytes_sent = 0
+        self.__latency_histogram = LatencyHistogram()
+
+    @property
+    def type_str(self):
+        return self.__type_str
+
+    @property
+    def sent_count(self):
+        return self.__sent_count
+
+    @property
+    def ok_count(self):
+        return self.__ok_count
+
+    @property
+    def failure_count(self):    # error:N responses, and commands lost to alarms, resets and timeouts
+        return self.__failure_count
+
+    @property
+    def bytes_sent(self):
+        return self.__bytes_sent
+
+    @property
+    def latency_histogram(self):    # send to response, for every command answered
+        return self.__latency_histogram
+
+    def add_send(self, byte_count):
+        self.__sent_count += 1
+        self.__bytes_sent += byte_count
+
+    def add_response(self, is_ok, latency_s):
+        if is_ok:
+            self.__ok_count += 1
+        else:
+            self.__failure_count += 1
+        if latency_s is not None:
+            self.__latency_histogram.add(latency_s)
+
+
+class CommandMetrics(object):
+    """
+    Per command type send counts, bytes on the wire, failures and send-to-response latency.
+
+    GRBL answers commands in order, so each response is matched to the oldest command not yet answered.
+    Besides the per type figures, the time during which at least one command was awaiting its
+    response is accumulated.  Together these show what limits a run:
+
+        link busy a small fraction of the time     host-bound: the program is slow to send
+        bytes per second near SERIAL_BYTES_PER_S   serial-bound
+        long latencies with the link always busy   motion-bound: GRBL's planner is full
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__type_dict = collections.OrderedDict()
+        self.__pending = collections.deque()    # (CommandTypeMetrics, send time)
+        self.__start_time = time.time()
+        self.__busy_since = None
+        self.__busy_s = 0.0
+        self.__unmatched_count = 0
+
+    @property
+    def type_dict(self):        # command type, e.g. "G01", to its CommandTypeMetrics
+        return self.__type_dict
+
+    @property
+    def unmatched_count(self):  # responses received with no command awaiting one
+        return self.__unmatched_count
+
+    def record_send(self, cmd_str, timestamp=None):
+        """
+        Record a command written to the Shapeoko (not real-time characters, which get no response).
+
+        :param cmd_str:     Shapeoko command string, without its "\\n"
+        :param timestamp:   time.time() when sent, None -> now
+
+        :return:    nothing
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        type_str = command_type(cmd_str)
+        with self.__lock:
+            type_metrics = self.__type_dict.get(type_str)
+            if type_metrics is None:
+                type_metrics = CommandTypeMetrics(type_str)
+                self.__type_dict[type_str] = type_metrics
+            type_metrics.add_send(len(cmd_str) + 1)
+            if 0 == len(self.__pending):
+                self.__busy_since = timestamp
+            self.__pending.append((type_metrics, timestamp))
+
+    def record_response(self, response_str, timestamp=None):
+        """
+        Record the response to the oldest command awaiting one.
+
+        :param response_str:    "ok", "error:N", or "" for a timeout
+        :param timestamp:       time.time() when received, None -> now
+
+        :return:    nothing
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.__lock:
+            if 0 == len(self.__pending):
+                self.__unmatched_count += 1
+                return
+            type_metrics, send_time = self.__pending.popleft()
+            type_metrics.add_response("ok" == response_str, timestamp - send_time if "" != response_str else None)
+            if 0 == len(self.__pending):
+                self.__busy_s += timestamp - self.__busy_since
+
+    def record_lost(self, timestamp=None):
+        """
+        Record that every command awaiting a response will never get one (alarm, reset or abandoned).
+
+        :param timestamp:   time.time() when discovered, None -> now
+
+        :return:    nothing
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.__lock:
+            for type_metrics, send_time in self.__pending:
+                type_metrics.add_response(False, None)
+            if 0 < len(self.__pending):
+                self.__busy_s += timestamp - self.__busy_since
+            self.__pending.clear()
+
+    def summary(self):
+        """
+        :return:    dict of overall figures: elapsed_s, link_busy_s, sent_count, failure_count, bytes_sent,
+                    commands_per_s, bytes_per_s
+        """
+        with self.__lock:
+            now = time.time()
+            elapsed_s = now - self.__start_time
+            busy_s = self.__busy_s + (now - self.__busy_since if 0 < len(self.__pending) else 0.0)
+            sent_count = sum([m.sent_count for m in self.__type_dict.values()])
+            failure_count = sum([m.failure_count for m in self.__type_dict.values()])
+            bytes_sent = sum([m.bytes_sent for m in self.__type_dict.values()])
+
+        return {"elapsed_s": elapsed_s,
+                "link_busy_s": busy_s,
+                "sent_count": sent_count,
+                "failure_count": failure_count,
+                "bytes_sent": bytes_sent,
+                "commands_per_s": sent_count / elapsed_s if 0.0 < elapsed_s else 0.0,
+                "bytes_per_s": bytes_sent / elapsed_s if 0.0 < elapsed_s else 0.0}
+
+    def report_str(self):
+        """
+        :return:    multi-line table of the metrics, for printing at the end of a session
+        """
+        summary_dict = self.summary()
+        line_list = ["{0:8s} {1:>7s} {2:>6s} {3:>9s} {4:>9s} {5:>9s} {6:>9s} {7:>9s} {8:>9s}".format(
+            "TYPE", "SENT", "FAILED", "BYTES", "MEAN_MS", "P50_MS", "P90_MS", "P99_MS", "MAX_MS")]
+
+        def ms_str(value_s):
+            return "{0:9.3f}".format(1000.0 * value_s) if value_s is not None else "{0:>9s}".format("-")
+
+        with self.__lock:
+            for type_metrics in self.__type_dict.values():
+                histogram = type_metrics.latency_histogram
+                percentile_str = " ".join([ms_str(histogram.percentile_s(p)) for p in PERCENTILE_LIST])
+                line_list.append("{0:8s} {1:7d} {2:6d} {3:9d} {4} {5} {6}".format(
+                    type_metrics.type_str, type_metrics.sent_count, type_metrics.failure_count,
+                    type_metrics.bytes_sent, ms_str(histogram.mean_s), percentile_str, ms_str(histogram.max_s)))
+
+        elapsed_s = summary_dict["elapsed_s"]
+        line_list.append("")
+        line_list.append("{0} commands, {1} failed, {2} bytes in {3:.3f} s: {4:.1f} commands/s, {5:.1f} bytes/s "
+                         "({6:.1f}% of the serial link)".format(
+                             summary_dict["sent_count"], summary_dict["failure_count"], summary_dict["bytes_sent"],
+                             elapsed_s, summary_dict["commands_per_s"], summary_dict["bytes_per_s"],
+                             100.0 * summary_dict["bytes_per_s"] / SERIAL_BYTES_PER_S))
+        line_list.append("Awaiting responses {0:.1f}% of the time".format(
+            100.0 * summary_dict["link_busy_s"] / elapsed_s if 0.0 < elapsed_s else 0.0))
+
+        return "\n".join(line_list)
+
+    def dump(self, filename_str=None):
+        """
+        Print the report, or write it to filename_str.
+
+        :return:    nothing
+        """
+        if filename_str is None:
+            print self.report_str()
+        else:
+            file_report = open(filename_str, "w")
+            file_report.write(self.report_str() + "\n")
+            file_report.close()
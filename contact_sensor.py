@@ -0,0 +1,284 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+The depth gauge contact sensor, as edge events rather than a polled level.
+
+The depth gauge touches the aluminum table, which is wired to 3.3 V, pulling Raspberry Pi pin 13
+(WiringPi pin 2) high through R1; R2 pulls it low otherwise (Pictures/ShapeokoCircuit.png).
+A ContactSensor takes timestamped edges from a backend, debounces them, and offers both a blocking
+API (wait_for_contact()) and listeners called on each debounced edge.
+
+Backends:
+    GpioContactBackend       the circuit above, with RPi.GPIO edge interrupts; needs a Raspberry Pi
+    SimulatedContactBackend  the tool tip touching a grbl_simulator.GrblSimulator's TableSurface
+
+    python contact_sensor.py        times probing the simulated table through the sensor
+"""
+
+import threading
+import time
+
+
+DEBOUNCE_S = 0.002              # contact chatter on the aluminum table settles within this
+RPI_CONTACT_PIN = 13            # physical (BOARD) pin numbering
+
+
+class GpioContactBackend(object):
+    """
+    Edge interrupts from the contact circuit on a Raspberry Pi GPIO pin.  RPi.GPIO is only imported here,
+    so the rest of the module works on any machine.
+    """
+    def __init__(self, pin=RPI_CONTACT_PIN, active_high=True):
+        import RPi.GPIO as GPIO
+        self.__gpio = GPIO
+        self.__pin = pin
+        self.__active_high = active_high
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN if active_high else GPIO.PUD_UP)
+
+    def read(self):
+        """
+        :return:    True if the depth gauge is touching the table now
+        """
+        return bool(self.__gpio.input(self.__pin)) == self.__active_high
+
+    def start(self, edge_callback):
+        """
+        :param edge_callback:   called as edge_callback(is_touching, timestamp) from the GPIO thread on every edge
+
+        :return:    nothing
+        """
+        self.__gpio.add_event_detect(self.__pin, self.__gpio.BOTH,
+                                     callback=lambda channel: edge_callback(self.read(), time.time()))
+
+    def stop(self):
+        self.__gpio.remove_event_detect(self.__pin)
+        self.__gpio.cleanup(self.__pin)
+
+
+class SimulatedContactBackend(object):
+    """
+    Contact edges from a GrblSimulator, which computes when the moving tool tip crosses its TableSurface.
+    Optionally adds contact bounce, as a real depth gauge on the table shows.
+    """
+    def __init__(self, simulator, bounce_count=0, bounce_interval_s=0.0002):
+        assert isinstance(bounce_count, int) and 0 <= bounce_count
+        assert isinstance(bounce_interval_s, float) and 0.0 < bounce_interval_s
+        self.__simulator = simulator
+        self.__bounce_count = bounce_count
+        self.__bounce_interval_s = bounce_interval_s
+        self.__edge_callback = None
+
+    def read(self):
+        return self.__simulator.is_touching
+
+    def start(self, edge_callback):
+        self.__edge_callback = edge_callback
+        self.__simulator.add_contact_listener(self.__on_contact)
+
+    def stop(self):
+        self.__edge_callback = None
+
+    def __on_contact(self, is_touching, timestamp):
+        edge_callback = self.__edge_callback
+        if edge_callback is None:
+            return
+        for i in range(self.__bounce_count):
+            edge_callback(is_touching if 0 == i % 2 else not is_touching, timestamp + i * self.__bounce_interval_s)
+        edge_callback(is_touching, timestamp + self.__bounce_count * self.__bounce_interval_s)
+
+
+class ContactSensor(object):
+    """
+    Debounced contact state and edges.  The first edge of a change is reported at once with its own
+    timestamp, so the time of contact is not delayed by debouncing; edges for the next debounce_s are
+    chatter, and ignored, after which the level is read again in case the chatter ended the other way.
+
+    Listeners are called as listener(is_touching, timestamp), from the backend's thread.
+    """
+    def __init__(self, backend, debounce_s=DEBOUNCE_S):
+        assert isinstance(debounce_s, float) and 0.0 <= debounce_s
+        self.__backend = backend
+        self.__debounce_s = debounce_s
+        self.__is_touching = False
+        self.__edge_time = None
+        self.__edge_count = 0
+        self.__bounce_count = 0
+        self.__settle_timer = None
+        self.__listener_list = []
+        self.__cond = threading.Condition()
+        self.__running = False
+
+    @property
+    def is_touching(self):      # debounced state
+        return self.__is_touching
+
+    @property
+    def edge_time(self):        # timestamp of the latest debounced edge, or None
+        return self.__edge_time
+
+    @property
+    def edge_count(self):       # debounced edges so far
+        return self.__edge_count
+
+    @property
+    def bounce_count(self):     # edges ignored as chatter
+        return self.__bounce_count
+
+    def add_listener(self, listener):
+        self.__listener_list.append(listener)
+
+    def start(self):
+        assert not self.__running
+        self.__running = True
+        with self.__cond:
+            self.__is_touching = self.__backend.read()
+        self.__backend.start(self.__on_edge)
+
+    def stop(self):
+        assert self.__running
+        self.__running = False
+        self.__backend.stop()
+        with self.__cond:
+            if self.__settle_timer is not None:
+                self.__settle_timer.cancel()
+                self.__settle_timer = None
+            self.__cond.notify_all()
+
+    def wait_for_edge(self, timeout=None):
+        """
+        Block until the next debounced edge.
+
+        :param timeout: seconds, or None to wait indefinitely
+
+        :return:    (is_touching, timestamp) of the edge, or None if timed out
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__cond:
+            edge_count = self.__edge_count
+            while edge_count == self.__edge_count and self.__running:
+                if not self.__wait(deadline):
+                    return None
+            if edge_count == self.__edge_count:
+                return None
+            return self.__is_touching, self.__edge_time
+
+    def wait_for_contact(self, is_touching=True, timeout=None):
+        """
+        Block until the debounced state is is_touching, e.g. while the tool descends toward the table.
+
+        :param is_touching: True to wait for contact, False to wait for release
+        :param timeout:     seconds, or None to wait indefinitely
+
+        :return:    timestamp of the edge, or of now if already in that state; None if timed out
+        """
+        assert isinstance(is_touching, bool)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__cond:
+            if is_touching == self.__is_touching:
+                return time.time() if self.__edge_time is None else self.__edge_time
+            while is_touching != self.__is_touching and self.__running:
+                if not self.__wait(deadline):
+                    return None
+            return self.__edge_time if is_touching == self.__is_touching else None
+
+    def __wait(self, deadline):
+        if deadline is None:
+            self.__cond.wait(1.0)
+            return True
+        remaining_s = deadline - time.time()
+        if remaining_s <= 0.0:
+            return False
+        self.__cond.wait(remaining_s)
+        return True
+
+    def __on_edge(self, is_touching, timestamp):
+        with self.__cond:
+            if self.__settle_timer is not None or is_touching == self.__is_touching:
+                self.__bounce_count += 1
+                return
+            self.__accept(is_touching, timestamp)
+        self.__notify(is_touching, timestamp)
+
+    def __accept(self, is_touching, timestamp):
+        self.__is_touching = is_touching
+        self.__edge_time = timestamp
+        self.__edge_count += 1
+        self.__cond.notify_all()
+        if 0.0 < self.__debounce_s:
+            self.__settle_timer = threading.Timer(self.__debounce_s, self.__settle)
+            self.__settle_timer.daemon = True
+            self.__settle_timer.start()
+
+    def __settle(self):
+        with self.__cond:
+            self.__settle_timer = None
+            if not self.__running:
+                return
+            is_touching = self.__backend.read()
+            if is_touching == self.__is_touching:
+                return
+            timestamp = time.time()
+            self.__accept(is_touching, timestamp)
+        self.__notify(is_touching, timestamp)
+
+    def __notify(self, is_touching, timestamp):
+        for listener in self.__listener_list:
+            listener(is_touching, timestamp)
+
+
+if "__main__" == __name__:
+    from grbl_simulator import GrblSimulator
+    from grbl_simulator import TableSurface
+    import shapeoko_commands
+
+    simulator = GrblSimulator(surface=TableSurface(0.001, -0.002, -60.0), speedup=10.0)
+    simulator.start()
+    shapeoko_commands.connect_and_synchronize(simulator.port_name)
+    assert shapeoko_commands.home_system()
+    assert shapeoko_commands.define_wcs2_to_current_mcs_in_eprom()
+    assert shapeoko_commands.set_wcs_to_wcs2()
+
+    sensor = ContactSensor(SimulatedContactBackend(simulator, bounce_count=3))
+    sensor.start()
+    delay_list = []
+    sensor.add_listener(lambda is_touching, timestamp: delay_list.append(time.time() - timestamp))
+
+    for x, y in [(-10.0, -10.0), (-210.0, -10.0), (-210.0, -180.0), (-10.0, -180.0)]:
+        assert shapeoko_commands.goto_z(0.0)
+        assert shapeoko_commands.goto_xy(x, y)
+        assert shapeoko_commands.wait_until_idle()
+        start_time = time.time()
+        assert shapeoko_commands.move_z(-70.0, 600.0)     # F600: 10 mm/s
+        contact_time = sensor.wait_for_contact(timeout=60.0)
+        assert contact_time is not None, "no contact at ({0}, {1})".format(x, y)
+        print "({0:8.3f}, {1:8.3f}): contact {2:6.3f} s after the move was sent".format(x, y, contact_time - start_time)
+        assert shapeoko_commands.wait_until_idle()
+
+    assert shapeoko_commands.goto_z(0.0)
+    assert shapeoko_commands.wait_until_idle()
+    sensor.stop()
+    simulator.stop()
+
+    print "{0} edges, {1} bounces ignored, listener delay {2:.6f} s max".format(
+        sensor.edge_count, sensor.bounce_count, max(delay_list))
@@ -0,0 +1,322 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+Fly-by surface scanning: sample the table while the tool keeps moving.
+
+Stopping at each probe point and stepping Z down to the table dominates a survey.  A fly-by scan
+instead sweeps the depth gauge at constant feed along a raster of passes, each a zig-zag in Z just
+above and below the expected table plane, so the gauge touches and leaves the table over and over.
+Every contact edge is a point where the gauge tip is exactly at the table surface.  The tip's position
+at each edge's timestamp is interpolated from the stream of real-time status reports.
+
+The bottom of each zig-zag is commanded below the table, so the gauge needs a compliant, spring-loaded
+tip that retracts as it is pushed down; a rigid probe would be driven into the table.  The raster is
+planned so the commanded depth below the table never exceeds the travel of that tip.
+
+Each sample carries an estimated timing-error bound: the status report latency, plus half the
+interval between the reports either side of it if the tool's velocity changed over that interval
+(a corner of the zig-zag), where linear interpolation is no longer exact.  Its position-error
+bound is the tool speed times that.
+
+The x,y,z samples are written as the CSV that planar_fit.read_data_file() reads, and the error
+bounds as x,y,z,time_error_s,position_error_mm in a second CSV.
+
+    python flyby_scan.py [<CSV file>]      scans the simulated table, writing flyby_data.csv
+"""
+
+from contact_sensor import ContactSensor
+from tool_path import ToolPath
+from tool_path import move_along
+import math
+import numpy as np
+import shapeoko_commands
+import sys
+import threading
+
+
+STATUS_REPORT_BYTES = 70            # typical "<Run|MPos:...|Bf:...|FS:...>" line with its terminator
+REPORT_LATENCY_S = STATUS_REPORT_BYTES / (115200 / 10.0)    # GRBL samples the position, then sends the line
+VELOCITY_CHANGE_TOLERANCE = 0.02    # relative change in velocity across a report interval still "constant"
+
+
+class ScanSample(object):
+    """
+    One point of the table surface found by a fly-by scan.
+    """
+    __slots__ = ("__x", "__y", "__z", "__time_error_s", "__position_error_mm", "__is_touching", "__timestamp")
+
+    def __init__(self, x, y, z, time_error_s, position_error_mm, is_touching, timestamp):
+        self.__x = x
+        self.__y = y
+        self.__z = z
+        self.__time_error_s = time_error_s
+        self.__position_error_mm = position_error_mm
+        self.__is_touching = is_touching
+        self.__timestamp = timestamp
+
+    @property
+    def x(self):
+        return self.__x
+
+    @property
+    def y(self):
+        return self.__y
+
+    @property
+    def z(self):
+        return self.__z
+
+    @property
+    def time_error_s(self):     # estimated bound on the error in the edge's time on the status report timeline
+        return self.__time_error_s
+
+    @property
+    def position_error_mm(self):
+        return self.__position_error_mm
+
+    @property
+    def is_touching(self):      # True for a contact edge, False for a release edge
+        return self.__is_touching
+
+    @property
+    def timestamp(self):
+        return self.__timestamp
+
+
+class FlybyRecorder(object):
+    """
+    Records the status report stream from a StatusPoller and the edges from a ContactSensor,
+    and correlates them into ScanSamples.
+    """
+    def __init__(self, status_poller, contact_sensor, report_latency_s=REPORT_LATENCY_S):
+        assert isinstance(contact_sensor, ContactSensor)
+        assert isinstance(report_latency_s, float) and 0.0 <= report_latency_s
+        self.__report_latency_s = report_latency_s
+        self.__time_list = []
+        self.__position_list = []
+        self.__edge_list = []
+        self.__lock = threading.Lock()
+        self.__recording = False
+        status_poller.add_listener(self.__on_status)
+        contact_sensor.add_listener(self.__on_edge)
+
+    @property
+    def report_count(self):
+        return len(self.__time_list)
+
+    @property
+    def edge_count(self):
+        return len(self.__edge_list)
+
+    def start(self):
+        with self.__lock:
+            self.__time_list = []
+            self.__position_list = []
+            self.__edge_list = []
+            self.__recording = True
+
+    def stop(self):
+        with self.__lock:
+            self.__recording = False
+
+    def samples(self):
+        """
+        :return:    list of ScanSamples, one per edge with status reports on both sides of it
+        """
+        with self.__lock:
+            times = np.array(self.__time_list)
+            positions = np.array(self.__position_list).reshape(-1, 3)
+            edge_list = list(self.__edge_list)
+
+        def interval_velocity(k):   # between reports k - 1 and k
+            return (positions[k] - positions[k - 1]) / (times[k] - times[k - 1])
+
+        sample_list = []
+        for is_touching, timestamp in edge_list:
+            i = int(np.searchsorted(times, timestamp, side="right"))
+            if i < 1 or len(times) <= i or times[i] <= times[i - 1]:
+                continue        # not between two reports
+            gap_s = times[i] - times[i - 1]
+            velocity = interval_velocity(i)
+            x, y, z = positions[i - 1] + (timestamp - times[i - 1]) * velocity
+
+            speed = float(np.linalg.norm(velocity))
+            time_error_s = self.__report_latency_s
+            for k in (i - 1, i + 1):
+                if 1 <= k < len(times) and times[k - 1] < times[k]:
+                    if VELOCITY_CHANGE_TOLERANCE * speed + 1e-6 < np.linalg.norm(interval_velocity(k) - velocity):
+                        time_error_s += 0.5 * gap_s     # e.g. a corner: linear interpolation is not exact
+                        break
+            sample_list.append(ScanSample(float(x), float(y), float(z), time_error_s, speed * time_error_s,
+                                          is_touching, timestamp))
+
+        return sample_list
+
+    def __on_status(self, machine_status):
+        if machine_status.wpos is None:
+            return
+        with self.__lock:
+            if self.__recording:
+                self.__time_list.append(machine_status.timestamp - self.__report_latency_s)
+                self.__position_list.append(machine_status.wpos)
+
+    def __on_edge(self, is_touching, timestamp):
+        with self.__lock:
+            if self.__recording:
+                self.__edge_list.append((is_touching, timestamp))
+
+
+def plan_flyby_raster(expected_coeffs, x_first, x_last, y_list, gauge_travel_mm, amplitude_mm=0.5,
+                      wave_length_mm=10.0):
+    """
+    Plan a raster of passes along X, one per Y in y_list, alternating direction.  Along each pass, Z
+    zig-zags amplitude_mm above and below the expected table plane, so the gauge crosses the table
+    surface twice per wave_length_mm wherever the table is within amplitude_mm of the plane.
+
+    Below the table, the gauge's spring-loaded tip is pushed in by the depth the tool is commanded below
+    the surface: at most 2 * amplitude_mm, where the table is amplitude_mm above the expected plane.
+    That must fit within gauge_travel_mm; where the table is further above the plane, the tip bottoms out.
+
+    :param expected_coeffs: (a, b, c) of the expected table plane a*x + b*y + c = z, e.g. from a coarse survey
+    :param x_first:         X where the first pass starts
+    :param x_last:          X where the first pass ends
+    :param y_list:          Y of each pass
+    :param gauge_travel_mm: how far the gauge tip can be pushed in, from the gauge's specification
+    :param amplitude_mm:    Z swing either side of the expected plane
+    :param wave_length_mm:  X length of one down-and-up of the zig-zag
+
+    :return:    ToolPath of the raster, starting above the plane at (x_first, y_list[0])
+    """
+    assert isinstance(expected_coeffs, tuple) and 3 == len(expected_coeffs)
+    assert isinstance(gauge_travel_mm, float) and 0.0 < gauge_travel_mm
+    assert isinstance(amplitude_mm, float) and 0.0 < amplitude_mm
+    assert 2.0 * amplitude_mm <= gauge_travel_mm, "plan_flyby_raster() amplitude_mm exceeds half the gauge travel"
+    assert isinstance(wave_length_mm, float) and 0.0 < wave_length_mm
+    a, b, c = expected_coeffs
+
+    # An even number of half waves, so each pass starts and ends above the plane, and the straight
+    # step between passes stays above it too
+    wave_count = max(int(math.ceil(abs(x_last - x_first) / wave_length_mm)), 1)
+    pass_x = np.linspace(x_first, x_last, 2 * wave_count + 1)
+    pass_offset = amplitude_mm * np.where(0 == np.arange(2 * wave_count + 1) % 2, 1.0, -1.0)
+
+    point_list = []
+    for i, y in enumerate(y_list):
+        x = pass_x if 0 == i % 2 else pass_x[::-1]
+        point_list.append(np.column_stack((x, np.full(len(x), float(y)), a * x + b * y + c + pass_offset)))
+
+    return ToolPath(np.vstack(point_list))
+
+
+def run_flyby_scan(tool_path, speed_mm_s, flyby_recorder, session=None):
+    """
+    Move the tool along the raster, recording, and wait until it has finished.
+    Needs start_transport() and start_status_poller(), at a high rate, e.g. 50 Hz.
+
+    :param tool_path:       ToolPath, e.g. from plan_flyby_raster()
+    :param speed_mm_s:      feed, as for move_x()
+    :param flyby_recorder:  FlybyRecorder, on the session's StatusPoller
+    :param session:         ShapeokoSession to drive, default that of the shapeoko_commands functions
+
+    :return:    list of ScanSamples
+    """
+    assert isinstance(flyby_recorder, FlybyRecorder)
+    tool_path.validate(session=session)
+    commands = shapeoko_commands if session is None else session
+    z_min = shapeoko_commands.ZMIN if session is None else session.limits[4]
+
+    first_x, first_y, first_z = tool_path.points[0].tolist()
+    assert commands.goto_z(min(first_z + 5.0, z_min))
+    assert commands.goto_xy(first_x, first_y)
+    assert commands.goto_z(first_z)
+    assert commands.wait_until_idle()
+    assert commands.get_machine_status() is not None, "run_flyby_scan() needs start_status_poller()"
+
+    flyby_recorder.start()
+    responded = move_along(tool_path, speed_mm_s, session) and commands.wait_until_idle()
+    flyby_recorder.stop()
+    assert responded, "run_flyby_scan() raster failed"
+
+    return flyby_recorder.samples()
+
+
+def write_scan_files(sample_list, filename_str, bounds_filename_str=None):
+    """
+    :param sample_list:         list of ScanSamples
+    :param filename_str:        x,y,z CSV, as read by planar_fit.read_data_file()
+    :param bounds_filename_str: x,y,z,time_error_s,position_error_mm CSV; default filename_str with "_bounds"
+
+    :return:    nothing
+    """
+    if bounds_filename_str is None:
+        root_str, dot_str, extension_str = filename_str.rpartition(".")
+        bounds_filename_str = "{0}_bounds.{1}".format(root_str, extension_str) if dot_str else filename_str + "_bounds"
+
+    with open(filename_str, "w") as f:
+        for sample in sample_list:
+            f.write("{0:.3f},{1:.3f},{2:.4f}\n".format(sample.x, sample.y, sample.z))
+    with open(bounds_filename_str, "w") as f:
+        for sample in sample_list:
+            f.write("{0:.3f},{1:.3f},{2:.4f},{3:.6f},{4:.4f}\n".format(
+                sample.x, sample.y, sample.z, sample.time_error_s, sample.position_error_mm))
+
+
+if "__main__" == __name__:
+    from contact_sensor import SimulatedContactBackend
+    from grbl_simulator import GrblSimulator
+    from grbl_simulator import TableSurface
+    import planar_fit
+    import time
+
+    filename_str = sys.argv[1] if 1 < len(sys.argv) else "flyby_data.csv"
+    true_coeffs = (0.0005, -0.0008, -60.0)
+
+    simulator = GrblSimulator(surface=TableSurface(*true_coeffs), speedup=5.0)
+    simulator.start()
+    shapeoko_commands.connect_and_synchronize(simulator.port_name)
+    assert shapeoko_commands.home_system()
+    shapeoko_commands.start_transport()
+    status_poller = shapeoko_commands.start_status_poller(50.0)
+    contact_sensor = ContactSensor(SimulatedContactBackend(simulator))
+    contact_sensor.start()
+    flyby_recorder = FlybyRecorder(status_poller, contact_sensor, report_latency_s=0.0)    # a pty has no baud rate
+
+    raster = plan_flyby_raster((0.0, 0.0, -60.0), -10.0, -410.0, [-10.0, -120.0, -240.0, -360.0], 2.0)
+    start_time = time.time()
+    sample_list = run_flyby_scan(raster, 1000.0, flyby_recorder)
+    elapsed_s = time.time() - start_time
+
+    assert shapeoko_commands.goto_z(0.0)
+    shapeoko_commands.stop_transport()
+    contact_sensor.stop()
+    simulator.stop()
+
+    write_scan_files(sample_list, filename_str)
+    x_list, y_list, z_list = planar_fit.get_inputs(planar_fit.read_data_file(filename_str))
+    a, b, c = planar_fit.planar_least_sqauares_fit(x_list, y_list, z_list)
+
+    print "{0} samples from {1} status reports in {2:.1f} s (simulated at 5x)".format(
+        len(sample_list), flyby_recorder.report_count, elapsed_s)
+    print "Worst position-error bound: {0:.4f} mm".format(max([s.position_error_mm for s in sample_list]))
+    print "Fit:  {0:.6f} * x  +  {1:.6f} * y  +  {2:.4f}  =  height (mm)".format(a, b, c)
+    print "True: {0:.6f} * x  +  {1:.6f} * y  +  {2:.4f}  =  height (mm)".format(*true_coeffs)
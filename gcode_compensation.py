@@ -0,0 +1,427 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+Compensate a G-code job for the measured table surface.
+
+The job's Z values assume a flat table.  This rewrites the job so that every Z follows the
+measured surface: each G00/G01 endpoint's Z gets the surface height there, relative to the height
+at the job's origin, and each G01 longer than max_segment_mm is first split into equal pieces
+so that the tool follows the surface between its ends too.  The surface is a HeightMap, or the
+plane (a, b, c) from planar_fit, in the job's coordinate system.
+
+The job is read and written a chunk of lines at a time, in constant memory however large it is.
+The surface heights for all the points of a chunk are looked up in one vectorized get_z() call.
+With processes, chunks are transformed in parallel.  A chunk can start at any line boundary,
+since the modal state entering it (G90/G91, G20/G21, motion mode, position) is tracked by the
+reading process and handed to the worker with it.
+
+Arcs (G02/G03) keep their shape; only their endpoint Z is compensated.  The job is taken to start at
+its origin unless told otherwise.  After G10, G28, G30, G43.1, G53, G92 or a coordinate system change,
+the position is unknown: a G90 move that sets X, Y and Z has its endpoint compensated but is not split,
+and other moves pass through unchanged until X, Y and Z are all set again, with a warning for G91 moves.
+The axis words of G4, G10, G28.1, G30.1 and G43.1 are not a move, so those lines pass through unchanged too.
+
+    python gcode_compensation.py <G-code in> <G-code out> <height map file | a,b,c> [<max segment mm> [<processes>]]
+    python gcode_compensation.py --check        checks which lines are compensated and which pass through
+"""
+
+from height_map import HeightMap
+import collections
+import math
+import multiprocessing
+import numpy as np
+import re
+import sys
+import time
+
+
+MAX_SEGMENT_MM = 5.0
+CHUNK_LINE_COUNT = 20000
+MM_PER_INCH = 25.4
+
+WORD_REGEX = re.compile(r"([A-Za-z])\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))")
+COMMENT_REGEX = re.compile(r"\([^)]*\)|;.*")
+UNKNOWN_POSITION_G_SET = {10.0, 28.0, 30.0, 43.1, 53.0, 92.0, 92.1, 54.0, 55.0, 56.0, 57.0, 58.0, 59.0}
+NON_MOTION_AXIS_G_SET = {4.0, 10.0, 28.1, 30.1, 43.1}     # axis words are data: offsets, stored positions, dwell
+
+# For tracking the modal state across a whole chunk at once; words and comments end at the end of a line
+CHUNK_COMMENT_REGEX = re.compile(r"\([^)\n]*\)|;.*")
+CHUNK_G_REGEX = re.compile(r"[Gg][ \t]*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))")
+CHUNK_LAST_AXIS_REGEX_DICT = dict((letter_str, re.compile(
+    r"(?s).*[{0}{1}][ \t]*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))".format(letter_str, letter_str.lower())))
+    for letter_str in "XYZ")     # greedy, so matches the last such word
+
+# Entering modal state of a chunk: (is_absolute, is_inch, motion_mode, x, y, z), None for an unknown ordinate
+INITIAL_STATE = (True, False, 0.0, None, None, None)
+
+
+class PlaneSurface(object):
+    """
+    The plane ax + by + c = z as a surface, e.g. from planar_fit.planar_least_sqauares_fit().
+    """
+    def __init__(self, coeffs):
+        assert isinstance(coeffs, tuple) and 3 == len(coeffs)
+        self.__coeffs = tuple(float(v) for v in coeffs)
+
+    def get_z(self, x, y):
+        a, b, c = self.__coeffs
+        return a * x + b * y + c
+
+
+def parse_line(line_str, state):
+    """
+    :param line_str:    one line of G-code
+    :param state:       modal state entering the line
+
+    :return:    (state after the line, motion) where motion is None for a line to pass through unchanged,
+                else (word list other than X, Y, Z, comment string, start (x, y, z), end (x, y, z)), with
+                start None if unknown, and end None if unknown (the line is then passed through unchanged)
+    """
+    is_absolute, is_inch, motion_mode, x, y, z = state
+    code_str = COMMENT_REGEX.sub("", line_str)
+    word_list = WORD_REGEX.findall(code_str)
+    if not word_list:
+        return state, None
+
+    axis_dict = {}
+    other_word_list = []
+    position_lost = False
+    is_non_motion = False
+    for letter_str, value_str in word_list:
+        letter_str = letter_str.upper()
+        if letter_str in "XYZ":
+            axis_dict[letter_str] = float(value_str)
+            continue
+        other_word_list.append(letter_str + value_str)
+        if "G" == letter_str:
+            g = float(value_str)
+            if g in (0.0, 1.0, 2.0, 3.0) or 38.0 <= g < 39.0 or 73.0 <= g <= 89.0:
+                motion_mode = g
+            elif 90.0 == g or 91.0 == g:
+                is_absolute = 90.0 == g
+            elif 20.0 == g or 21.0 == g:
+                is_inch = 20.0 == g
+            elif g in UNKNOWN_POSITION_G_SET:
+                position_lost = True
+            if g in NON_MOTION_AXIS_G_SET:
+                is_non_motion = True
+
+    start = (x, y, z)
+    if position_lost:
+        return (is_absolute, is_inch, motion_mode, None, None, None), None
+    if is_non_motion or not axis_dict:
+        return (is_absolute, is_inch, motion_mode, x, y, z), None
+
+    if is_absolute:
+        x, y, z = axis_dict.get("X", x), axis_dict.get("Y", y), axis_dict.get("Z", z)
+    else:
+        x = None if x is None else x + axis_dict.get("X", 0.0)
+        y = None if y is None else y + axis_dict.get("Y", 0.0)
+        z = None if z is None else z + axis_dict.get("Z", 0.0)
+    new_state = (is_absolute, is_inch, motion_mode, x, y, z)
+
+    if motion_mode not in (0.0, 1.0, 2.0, 3.0):     # e.g. a probe or canned cycle, which stops who knows where
+        return (is_absolute, is_inch, motion_mode, None, None, None), None
+    end = None if None in (x, y, z) else (x, y, z)
+    if None in start:
+        start = None
+    if end is None and is_absolute:
+        return new_state, None
+
+    return new_state, (other_word_list, " ".join(COMMENT_REGEX.findall(line_str)), start, end)
+
+
+def advance_state(line_str_list, state):
+    """
+    :return:    the modal state after the lines, without transforming them
+    """
+    fast_state = __advance_absolute_state(line_str_list, state)
+    if fast_state is not None:
+        return fast_state
+
+    for line_str in line_str_list:
+        state = parse_line(line_str, state)[0]
+    return state
+
+
+def __advance_absolute_state(line_str_list, state):
+    """
+    The common case, cheaply: lines in G90 throughout, with no G code that loses the position, holds axis
+    words that are not a move, or is a motion other than G00 to G03.  Then each ordinate is simply its
+    last value in the lines, and the G words are looked at only from the end.
+
+    :return:    the modal state after the lines, or None if they are not the common case
+    """
+    is_absolute, is_inch, motion_mode, x, y, z = state
+    if not is_absolute or motion_mode not in (0.0, 1.0, 2.0, 3.0):
+        return None
+    code_str = "".join(line_str_list)
+    if "(" in code_str or ";" in code_str:
+        code_str = CHUNK_COMMENT_REGEX.sub("", code_str)
+    g_str_list = CHUNK_G_REGEX.findall(code_str)
+    g_dict = dict((g_str, float(g_str)) for g_str in set(g_str_list))
+    for g in g_dict.values():
+        if (91.0 == g or g in UNKNOWN_POSITION_G_SET or g in NON_MOTION_AXIS_G_SET or
+                38.0 <= g < 39.0 or 73.0 <= g <= 89.0):
+            return None
+
+    found_inch = not {20.0, 21.0} & set(g_dict.values())
+    found_motion = False
+    for g_str in reversed(g_str_list):
+        g = g_dict[g_str]
+        if not found_inch and g in (20.0, 21.0):
+            is_inch, found_inch = 20.0 == g, True
+        elif not found_motion and g in (0.0, 1.0, 2.0, 3.0):
+            motion_mode, found_motion = g, True
+        if found_inch and found_motion:
+            break
+    ordinate_list = []
+    for letter_str, ordinate in zip("XYZ", (x, y, z)):
+        match = CHUNK_LAST_AXIS_REGEX_DICT[letter_str].match(code_str)
+        ordinate_list.append(ordinate if match is None else float(match.group(1)))
+
+    return (is_absolute, is_inch, motion_mode) + tuple(ordinate_list)
+
+
+def transform_chunk(line_str_list, state, surface, reference_z, max_segment_mm):
+    """
+    Compensate a chunk of lines.
+
+    :param line_str_list:   lines, with or without line terminators
+    :param state:           modal state entering the chunk
+    :param surface:         object with a vectorized get_z(x, y), in mm
+    :param reference_z:     surface height that needs no compensation
+    :param max_segment_mm:  longest G01 piece
+
+    :return:    (compensated lines, each ending "\\n"; state after the chunk)
+    """
+    item_list = []          # a line to pass through, or (words, comment, is_absolute, is_inch,
+                            #                            index of its start point, piece count)
+    point_list = []         # every compensated point, in mm
+    lost_relative_count = 0
+    for line_str in line_str_list:
+        state, motion = parse_line(line_str, state)
+        if motion is not None and motion[3] is None:
+            lost_relative_count += 1    # a G91 move from an unknown position
+            motion = None
+        if motion is None:
+            item_list.append(line_str.rstrip("\r\n") + "\n")
+            continue
+        other_word_list, comment_str, start, end = motion
+        units_mm = MM_PER_INCH if state[1] else 1.0
+        piece_count = 1
+        if start is None:
+            start = end             # an absolute move, which cannot be split
+        elif 1.0 == state[2]:
+            length_mm = units_mm * math.sqrt(sum([(e - s) ** 2 for s, e in zip(start, end)]))
+            piece_count = max(int(math.ceil(length_mm / max_segment_mm - 1e-9)), 1)
+        item_list.append((other_word_list, comment_str, state[0], state[1], len(point_list), piece_count))
+        point_list.append(start)     # needed for relative moves
+        for k in range(1, piece_count + 1):
+            f = float(k) / piece_count
+            point_list.append(tuple(s + f * (e - s) for s, e in zip(start, end)))
+
+    if point_list:
+        points = np.array(point_list)
+        item_units_mm = np.ones(len(points))
+        for item in item_list:
+            if not isinstance(item, str) and item[3]:
+                item_units_mm[item[4]:item[4] + item[5] + 1] = MM_PER_INCH
+        correction = (np.asarray(surface.get_z(points[:, 0] * item_units_mm, points[:, 1] * item_units_mm),
+                                 dtype=np.float64) - reference_z) / item_units_mm
+        compensated_z = (points[:, 2] + correction).tolist()
+        point_list = points.tolist()
+
+    out_line_str_list = []
+    for item in item_list:
+        if isinstance(item, str):
+            out_line_str_list.append(item)
+            continue
+        other_word_list, comment_str, is_absolute, is_inch, first, piece_count = item
+        format_str = "X{0:.4f} Y{1:.4f} Z{2:.4f}" if is_inch else "X{0:.3f} Y{1:.3f} Z{2:.3f}"
+        for k in range(first + 1, first + piece_count + 1):
+            x, y = point_list[k][0], point_list[k][1]
+            z = compensated_z[k]
+            if not is_absolute:
+                x, y, z = x - point_list[k - 1][0], y - point_list[k - 1][1], z - compensated_z[k - 1]
+            word_str = format_str.format(x, y, z)
+            if first + 1 == k:
+                word_str = " ".join(other_word_list + [word_str] + ([comment_str] if comment_str else []))
+            out_line_str_list.append(word_str + "\n")
+
+    if lost_relative_count:
+        print "transform_chunk() WARNING: {0} G91 moves from an unknown position passed through " \
+              "uncompensated".format(lost_relative_count)
+
+    return out_line_str_list, state
+
+
+def __read_chunks(in_file, chunk_line_count):
+    line_str_list = []
+    for line_str in in_file:
+        line_str_list.append(line_str)
+        if chunk_line_count <= len(line_str_list):
+            yield line_str_list
+            line_str_list = []
+    if line_str_list:
+        yield line_str_list
+
+
+__worker_args = None    # (surface, reference_z, max_segment_mm) in each pool process
+
+
+def __init_worker(surface, reference_z, max_segment_mm):
+    global __worker_args
+    __worker_args = (surface, reference_z, max_segment_mm)
+
+
+def __transform_in_worker(line_str_list, state):
+    surface, reference_z, max_segment_mm = __worker_args
+    return transform_chunk(line_str_list, state, surface, reference_z, max_segment_mm)[0]
+
+
+def compensate_file(in_filename_str, out_filename_str, surface, reference_z=None, max_segment_mm=MAX_SEGMENT_MM,
+                    processes=1, chunk_line_count=CHUNK_LINE_COUNT, start_position=(0.0, 0.0, 0.0)):
+    """
+    Write a compensated copy of a G-code job.
+
+    With processes, the modal state entering each chunk is tracked by this process.  That is cheap for
+    chunks all in G90 without G10, G28, G30, G43.1, G53, G92, coordinate system changes, probes or canned
+    cycles, which are looked at a whole chunk at a time.  Any other chunk is parsed here line by line as
+    well as in a worker, which costs this process up to a third of what transforming the chunk does.
+
+    :param in_filename_str:     G-code job to read
+    :param out_filename_str:    compensated job to write
+    :param surface:             HeightMap, PlaneSurface, or other object with a vectorized get_z(x, y), in mm
+    :param reference_z:         surface height needing no compensation; default that at the job's origin (0, 0),
+                                where its Z zero is usually touched off
+    :param max_segment_mm:      longest G01 piece
+    :param processes:           1 to transform in this process, more for a pool of that many
+    :param chunk_line_count:    lines per chunk
+    :param start_position:      (x, y, z) of the tool when the job starts, in the job's units, or None if unknown;
+                                G91 moves pass through uncompensated until the position is known
+
+    :return:    number of lines written
+    """
+    assert isinstance(max_segment_mm, float) and 0.0 < max_segment_mm
+    assert isinstance(processes, int) and 1 <= processes
+    assert start_position is None or (isinstance(start_position, tuple) and 3 == len(start_position))
+    if reference_z is None:
+        reference_z = float(surface.get_z(0.0, 0.0))
+
+    line_count = 0
+    with open(in_filename_str, "r") as in_file:
+        with open(out_filename_str, "w") as out_file:
+            chunk_iter = __read_chunks(in_file, chunk_line_count)
+            state = INITIAL_STATE if start_position is None else INITIAL_STATE[:3] + tuple(start_position)
+            if 1 == processes:
+                for line_str_list in chunk_iter:
+                    out_line_str_list, state = transform_chunk(line_str_list, state, surface, reference_z,
+                                                               max_segment_mm)
+                    out_file.writelines(out_line_str_list)
+                    line_count += len(out_line_str_list)
+                return line_count
+
+            pool = multiprocessing.Pool(processes, __init_worker, (surface, reference_z, max_segment_mm))
+            try:
+                pending = collections.deque()   # bounded, so memory stays constant
+                for line_str_list in chunk_iter:
+                    pending.append(pool.apply_async(__transform_in_worker, (line_str_list, state)))
+                    state = advance_state(line_str_list, state)
+                    while 2 * processes <= len(pending):
+                        out_line_str_list = pending.popleft().get()
+                        out_file.writelines(out_line_str_list)
+                        line_count += len(out_line_str_list)
+                while pending:
+                    out_line_str_list = pending.popleft().get()
+                    out_file.writelines(out_line_str_list)
+                    line_count += len(out_line_str_list)
+            finally:
+                pool.terminate()
+
+    return line_count
+
+
+def self_check():
+    """
+    Transform a short job, and check which of its lines are compensated and which pass through unchanged.
+
+    :return:    list of the lines handled wrongly, empty if none
+    """
+    case_list = [("G21 G90", False),
+                 ("G91", False),
+                 ("G1 X1 F100", False),                 # the start of the first move is unknown
+                 ("G90", False),
+                 ("G0 X0 Y0 Z5", True),                 # its endpoint is known
+                 ("G1 X10 Y0 Z0 F100", True),
+                 ("G2 X20 Y0 I5 J0", True),
+                 ("G4 P0.5", False),
+                 ("G28.1 X1 Y2 Z3", False),
+                 ("G30.1 X1 Y2 Z3", False),
+                 ("G1 X20 Y10", True),                  # G28.1 and G30.1 store a position, and don't move
+                 ("G43.1 Z2.5", False),
+                 ("G0 Z5", False),                      # the tool length offset changed Z
+                 ("G0 X0 Y0 Z5", True),
+                 ("G1 X5 F100", True),
+                 ("G10 L2 P1 X0 Y0 Z0", False),
+                 ("G0 Z5", False),                      # the coordinate system may have moved
+                 ("G0 X0 Y0 Z5", True),
+                 ("G10 L20 P1 X0 Y0 Z0", False),
+                 ("G0 Z5", False),
+                 ("G91 G1 Y2", False),
+                 ("G90 G92 X0 Y0 Z0", False),
+                 ("G1 X5 Y5 Z-1", True),                # compensated, though not split, after G92
+                 ("G91 G1 X2 Y1", True)]
+    line_str_list = [line_str for line_str, _ in case_list]
+    out_line_str_list = transform_chunk(line_str_list, INITIAL_STATE, PlaneSurface((0.01, 0.02, 0.0)), 0.0,
+                                        1000.0)[0]
+    assert len(out_line_str_list) == len(line_str_list)
+
+    return [line_str for (line_str, is_compensated), out_line_str in zip(case_list, out_line_str_list)
+            if is_compensated == (line_str + "\n" == out_line_str)]
+
+
+if "__main__" == __name__:
+    if 2 == len(sys.argv) and "--check" == sys.argv[1]:
+        failure_list = self_check()
+        for line_str in failure_list:
+            print "HANDLED WRONGLY: {0}".format(line_str)
+        print "{0} failures".format(len(failure_list))
+        exit(1 if failure_list else 0)
+
+    if len(sys.argv) < 4:
+        print "Usage python gcode_compensation.py <G-code in> <G-code out> <height map file | a,b,c> " \
+              "[<max segment mm> [<processes>]]"
+        exit(1)
+
+    if 3 == len(sys.argv[3].split(",")):
+        surface = PlaneSurface(tuple(float(v) for v in sys.argv[3].split(",")))
+    else:
+        surface = HeightMap.load(sys.argv[3])
+    max_segment_mm = float(sys.argv[4]) if 4 < len(sys.argv) else MAX_SEGMENT_MM
+    processes = int(sys.argv[5]) if 5 < len(sys.argv) else 1
+
+    start_time = time.time()
+    line_count = compensate_file(sys.argv[1], sys.argv[2], surface, max_segment_mm=max_segment_mm,
+                                 processes=processes)
+    print "{0} lines written in {1:.1f} s".format(line_count, time.time() - start_time)
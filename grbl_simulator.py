@@ -0,0 +1,885 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+A GRBL 1.1f simulator, exposed over a pseudo-terminal, to stand in for the Shapeoko's /dev/ttyACM0.
+
+Run it, then point connect_and_synchronize() at the printed port name:
+
+    python grbl_simulator.py [speedup]
+
+It models what matters for measuring the host side: the 127 byte serial receive buffer,
+the planner's block buffer (so "ok" is withheld while the planner is full), acceleration-limited
+motion with junction blending between blocks, real-time "?" status reports, soft reset, and a
+table surface whose contact with the tool tip can be sensed, directly or by G38.2-G38.5 probe cycles.
+"""
+
+import math
+import os
+import pty
+import Queue
+import re
+import select
+import sys
+import termios
+import threading
+import time
+import tty
+
+
+GRBL_BANNER_STR = "Grbl 1.1f ['$' for help]"
+GRBL_UNLOCK_MSG_STR = "[MSG:'$H'|'$X' to unlock]"
+
+RX_BUFFER_SIZE = 128            # GRBL's serial receive buffer
+PLANNER_BLOCK_COUNT = 15        # GRBL's BLOCK_BUFFER_SIZE (16) less the one it keeps free
+MAX_RATE_MM_MIN = 5000.0        # $110, $111, $112 on a Shapeoko 3
+ACCELERATION_MM_S2 = 400.0      # $120, $121, $122 on a Shapeoko 3
+JUNCTION_DEVIATION_MM = 0.010   # $11
+OPEN_RESET_DELAY_S = 0.25       # an Arduino-based controller restarts when the host opens the port
+HOME_POSITION = (0.0, 0.0, 0.0)
+POWER_ON_POSITION = (-200.0, -180.0, -20.0)
+
+CTRL_X_CHSTR = chr(0x18)
+REALTIME_CHSTRS = "?!~" + CTRL_X_CHSTR
+
+WCS_NAME_LIST = ["G54", "G55", "G56", "G57", "G58", "G59"]
+WORD_REGEX = re.compile(r"([A-Z])([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))")
+
+
+class TableSurface(object):
+    """
+    The table top, modeled as the plane z = a*x + b*y + c in machine coordinates.
+
+    Any object with a get_z(x, y) method, e.g. a height map, can be given to the simulator instead.
+    """
+    def __init__(self, a=0.0, b=0.0, c=-80.0):
+        assert isinstance(a, float)
+        assert isinstance(b, float)
+        assert isinstance(c, float)
+        self.__a = a
+        self.__b = b
+        self.__c = c
+
+    @property
+    def coeffs(self):
+        return self.__a, self.__b, self.__c
+
+    def get_z(self, x, y):
+        return self.__a * x + self.__b * y + self.__c
+
+
+class MotionBlock(object):
+    """
+    One straight-line move in the planner, in machine coordinates (mm) and mm/s.
+    """
+    def __init__(self, start, end, nominal_speed, acceleration, is_homing=False):
+        self.start = start
+        self.end = end
+        self.delta = tuple(e - s for s, e in zip(start, end))
+        self.length = math.sqrt(sum(d * d for d in self.delta))
+        self.unit = tuple(d / self.length for d in self.delta) if 0.0 < self.length else (0.0, 0.0, 0.0)
+        self.nominal_speed = nominal_speed
+        self.acceleration = acceleration
+        self.is_homing = is_homing
+        self.max_entry_speed = 0.0  # junction speed limit with the previous block, set by the planner
+
+    def position_at(self, s):
+        """
+        :param s:   distance travelled along the block
+
+        :return:    (x, y, z) at that distance
+        """
+        if 0.0 >= self.length:
+            return self.end
+        f = min(max(s / self.length, 0.0), 1.0)
+        return tuple(p + f * d for p, d in zip(self.start, self.delta))
+
+
+class TrapezoidProfile(object):
+    """
+    Speed profile of a block: accelerate from entry_speed, cruise, decelerate to exit_speed.
+    """
+    def __init__(self, length, entry_speed, nominal_speed, exit_speed, acceleration):
+        self.length = length
+        self.entry_speed = entry_speed
+        self.exit_speed = exit_speed
+        self.acceleration = acceleration
+
+        accel_dist = (nominal_speed ** 2 - entry_speed ** 2) / (2.0 * acceleration)
+        decel_dist = (nominal_speed ** 2 - exit_speed ** 2) / (2.0 * acceleration)
+        if accel_dist + decel_dist > length:    # triangle: never reaches nominal_speed
+            peak_speed = math.sqrt((2.0 * acceleration * length + entry_speed ** 2 + exit_speed ** 2) / 2.0)
+            peak_speed = max(peak_speed, entry_speed, exit_speed)
+            accel_dist = max((peak_speed ** 2 - entry_speed ** 2) / (2.0 * acceleration), 0.0)
+            decel_dist = max(length - accel_dist, 0.0)
+        else:
+            peak_speed = nominal_speed
+
+        self.peak_speed = peak_speed
+        self.accel_dist = accel_dist
+        self.cruise_dist = max(length - accel_dist - decel_dist, 0.0)
+        self.accel_time = (peak_speed - entry_speed) / acceleration
+        self.cruise_time = self.cruise_dist / peak_speed if 0.0 < peak_speed else 0.0
+        self.decel_time = (peak_speed - exit_speed) / acceleration
+        self.duration = self.accel_time + self.cruise_time + self.decel_time
+
+    def distance_at(self, t):
+        """
+        :param t:   seconds since the block started
+
+        :return:    distance travelled along the block
+        """
+        a = self.acceleration
+        if t <= 0.0:
+            return 0.0
+        if t < self.accel_time:
+            return self.entry_speed * t + 0.5 * a * t * t
+        t -= self.accel_time
+        if t < self.cruise_time:
+            return self.accel_dist + self.peak_speed * t
+        t -= self.cruise_time
+        if t < self.decel_time:
+            return self.accel_dist + self.cruise_dist + self.peak_speed * t - 0.5 * a * t * t
+        return self.length
+
+    def speed_at(self, t):
+        """
+        :param t:   seconds since the block started
+
+        :return:    speed in mm/s
+        """
+        if t <= 0.0:
+            return self.entry_speed
+        if t < self.accel_time:
+            return self.entry_speed + self.acceleration * t
+        t -= self.accel_time
+        if t < self.cruise_time:
+            return self.peak_speed
+        t -= self.cruise_time
+        if t < self.decel_time:
+            return self.peak_speed - self.acceleration * t
+        return self.exit_speed
+
+    def time_at(self, s):
+        """
+        Inverse of distance_at().
+
+        :param s:   distance travelled along the block
+
+        :return:    seconds since the block started
+        """
+        a = self.acceleration
+        if s <= 0.0:
+            return 0.0
+        if s < self.accel_dist:
+            return (math.sqrt(self.entry_speed ** 2 + 2.0 * a * s) - self.entry_speed) / a
+        s -= self.accel_dist
+        if s < self.cruise_dist:
+            return self.accel_time + s / self.peak_speed
+        s -= self.cruise_dist
+        disc = max(self.peak_speed ** 2 - 2.0 * a * s, 0.0)
+        return min(self.accel_time + self.cruise_time + (self.peak_speed - math.sqrt(disc)) / a, self.duration)
+
+
+class GrblSimulator(object):
+    """
+    GRBL 1.1f on the slave end of a pseudo-terminal.
+
+    Three threads do the work: the reader splits incoming bytes into real-time characters
+    (handled at once) and lines (queued in the modeled receive buffer); the executor parses
+    each line and answers it, waiting for planner room first, just as GRBL withholds "ok";
+    the motion thread runs planner blocks in (scaled) real time.
+
+    A pseudo-terminal has no DTR line, so when reset_on_open is True the host opening the port
+    is detected by its changing the terminal settings, and answered with a reset as an
+    Arduino-based controller would.
+
+    Contact listeners are called as listener(is_touching, timestamp) whenever the tool tip
+    touches or leaves the surface, at the time.time() that it does so.
+    """
+    def __init__(self, surface=None, speedup=1.0, power_on_position=POWER_ON_POSITION,
+                 planner_block_count=PLANNER_BLOCK_COUNT, rx_buffer_size=RX_BUFFER_SIZE, reset_on_open=True):
+        assert isinstance(speedup, float) and 0.0 < speedup
+        assert isinstance(planner_block_count, int) and 1 <= planner_block_count
+        assert isinstance(rx_buffer_size, int) and 1 <= rx_buffer_size
+        self.__surface = TableSurface() if surface is None else surface
+        self.__speedup = speedup
+        self.__planner_block_count = planner_block_count
+        self.__rx_buffer_size = rx_buffer_size
+
+        self.__master_fd, self.__slave_fd = pty.openpty()
+        tty.setraw(self.__slave_fd)     # no echo and no line-ending translation on the host's end
+        self.__port_name = os.ttyname(self.__slave_fd)
+        self.__reset_on_open = reset_on_open
+        self.__port_attr_list = termios.tcgetattr(self.__slave_fd)
+
+        self.__cond = threading.Condition()
+        self.__write_lock = threading.Lock()
+        self.__rx_queue = Queue.Queue()
+        self.__rx_bytes = 0
+        self.__rx_overflow_count = 0
+        self.__line_count = 0
+        self.__generation = 0       # incremented by each reset, aborting whatever was in progress
+
+        self.__machine_position = tuple(power_on_position)     # where the last finished block left the tool
+        self.__planned_position = tuple(power_on_position)     # where the last queued block will leave it
+        self.__planner = []
+        self.__exec_block = None
+        self.__exec_profile = None
+        self.__exec_start = 0.0
+        self.__current_speed = 0.0
+        self.__is_homed = False
+        self.__is_alarm = True
+        self.__is_touching = self.__touching_at(self.__machine_position)
+
+        self.__motion_mode = "G0"
+        self.__is_incremental = False
+        self.__feed_mm_min = 0.0
+        self.__wcs_name = "G54"
+        self.__wcs_offset_dict = dict((name, (0.0, 0.0, 0.0)) for name in WCS_NAME_LIST)
+        self.__probe_position = (0.0, 0.0, 0.0)     # where the last probe stopped, reported by "$#"
+        self.__probe_succeeded = False
+
+        self.__contact_listener_list = []
+        self.__thread_list = []
+        self.__running = False
+
+    @property
+    def port_name(self):        # give this to connect_and_synchronize()
+        return self.__port_name
+
+    @property
+    def surface(self):
+        return self.__surface
+
+    @surface.setter
+    def surface(self, surface):
+        self.__surface = surface
+
+    @property
+    def speedup(self):
+        return self.__speedup
+
+    @property
+    def line_count(self):       # lines received, for measuring command counts
+        return self.__line_count
+
+    @property
+    def rx_overflow_count(self):    # lines lost because the host overran the receive buffer
+        return self.__rx_overflow_count
+
+    @property
+    def planner_blocks_in_use(self):
+        return len(self.__planner)
+
+    @property
+    def position(self):
+        """
+        :return:    the tool tip's machine position (x, y, z) right now
+        """
+        with self.__cond:
+            return self.__position_now()
+
+    @property
+    def is_touching(self):
+        with self.__cond:
+            return self.__touching_at(self.__position_now())
+
+    @property
+    def state_str(self):
+        with self.__cond:
+            return self.__state_str()
+
+    def add_contact_listener(self, listener):
+        self.__contact_listener_list.append(listener)
+
+    def start(self):
+        """
+        Start the simulator threads and send the power-on startup lines.
+
+        :return:    nothing
+        """
+        assert not self.__running
+        self.__running = True
+        for target, name_str in [(self.__read_loop, "reader"), (self.__execute_loop, "executor"),
+                                 (self.__motion_loop, "motion")]:
+            thread = threading.Thread(target=target, name="GrblSimulator " + name_str)
+            thread.daemon = True
+            thread.start()
+            self.__thread_list.append(thread)
+        self.__send_startup_lines()
+
+    def stop(self):
+        """
+        Stop the simulator threads and close the pseudo-terminal.
+
+        :return:    nothing
+        """
+        self.__running = False
+        with self.__cond:
+            self.__cond.notify_all()
+        for thread in self.__thread_list:
+            thread.join()
+        self.__thread_list = []
+        os.close(self.__master_fd)
+        os.close(self.__slave_fd)
+
+    def reset(self):
+        """
+        Soft reset, as for Ctrl-X or the DTR pulse when a real controller's port is opened.
+        Motion in progress is lost, and with it the machine position, so GRBL then needs homing.
+
+        :return:    nothing
+        """
+        with self.__cond:
+            if self.__exec_block is not None or 0 < len(self.__planner):
+                self.__machine_position = self.__position_now()
+                self.__is_homed = False
+                self.__is_alarm = True
+            self.__generation += 1
+            self.__planner = []
+            self.__exec_block = None
+            self.__current_speed = 0.0
+            self.__planned_position = self.__machine_position
+            self.__motion_mode = "G0"
+            self.__is_incremental = False
+            self.__wcs_name = "G54"
+            while not self.__rx_queue.empty():
+                self.__rx_queue.get()
+            self.__rx_bytes = 0
+            self.__cond.notify_all()
+        self.__send_startup_lines()
+
+    def status_report_str(self):
+        """
+        :return:    the GRBL 1.1 real-time status report line, e.g. "<Idle|MPos:...|Bf:15,128|FS:0,0|WCO:...>"
+        """
+        with self.__cond:
+            x, y, z = self.__position_now()
+            wco = self.__wcs_offset_dict[self.__wcs_name]
+            speed = self.__speed_now()
+            report_str = "<{0}|MPos:{1:.3f},{2:.3f},{3:.3f}|Bf:{4},{5}|FS:{6:.0f},0".format(
+                self.__state_str(), x, y, z, self.__planner_block_count - len(self.__planner),
+                self.__rx_buffer_size - self.__rx_bytes, speed * 60.0)
+            if self.__touching_at((x, y, z)):
+                report_str += "|Pn:P"
+            report_str += "|WCO:{0:.3f},{1:.3f},{2:.3f}>".format(*wco)
+        return report_str
+
+    #
+    # Output
+    #
+
+    def __send_line(self, line_str):
+        with self.__write_lock:
+            try:
+                os.write(self.__master_fd, line_str + "\r\n")
+            except OSError:
+                pass    # closed by stop()
+
+    def __send_startup_lines(self):
+        self.__send_line("")
+        self.__send_line(GRBL_BANNER_STR)
+        if self.__is_alarm:
+            self.__send_line(GRBL_UNLOCK_MSG_STR)
+
+    #
+    # Reader thread: real-time characters and the receive buffer
+    #
+
+    def __read_loop(self):
+        partial_str = ""
+        while self.__running:
+            readable_list, _, _ = select.select([self.__master_fd], [], [], 0.1)
+            self.__check_port_opened()
+            if not readable_list:
+                continue
+            try:
+                data_str = os.read(self.__master_fd, 1024)
+            except OSError:
+                break
+            for ch in data_str:
+                if ch in REALTIME_CHSTRS:
+                    self.__handle_realtime(ch)
+                elif "\n" == ch:
+                    self.__receive_line(partial_str)
+                    partial_str = ""
+                elif "\r" != ch:
+                    partial_str += ch
+
+    def __check_port_opened(self):
+        port_attr_list = termios.tcgetattr(self.__slave_fd)
+        if port_attr_list != self.__port_attr_list:
+            self.__port_attr_list = port_attr_list
+            if self.__reset_on_open:
+                timer = threading.Timer(OPEN_RESET_DELAY_S, self.reset)
+                timer.daemon = True
+                timer.start()
+
+    def __handle_realtime(self, ch):
+        if "?" == ch:
+            self.__send_line(self.status_report_str())
+        elif CTRL_X_CHSTR == ch:
+            self.reset()
+        # Feed hold "!" and cycle start "~" are accepted but not modeled
+
+    def __receive_line(self, line_str):
+        byte_count = len(line_str) + 1
+        with self.__cond:
+            if self.__rx_bytes + byte_count > self.__rx_buffer_size:
+                self.__rx_overflow_count += 1   # a real GRBL would silently corrupt the stream
+                print "GrblSimulator: RX BUFFER OVERFLOW, LINE({0}) DROPPED".format(line_str)
+                return
+            self.__rx_bytes += byte_count
+            self.__line_count += 1
+            self.__rx_queue.put((line_str, byte_count, self.__generation))
+
+    #
+    # Executor thread: parse each line and answer it
+    #
+
+    def __execute_loop(self):
+        while self.__running:
+            try:
+                line_str, byte_count, generation = self.__rx_queue.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            with self.__cond:
+                if generation != self.__generation:
+                    continue
+                self.__rx_bytes -= byte_count
+            response_list = self.__execute_line(line_str, generation)
+            if response_list is not None:
+                for response_str in response_list:
+                    self.__send_line(response_str)
+
+    def __execute_line(self, line_str, generation):
+        """
+        :return:    list of lines to send in response, or None if a reset aborted the line
+        """
+        line_str = re.sub(r"\(.*?\)|;.*$|\s", "", line_str).upper()
+        if "" == line_str:
+            return ["ok"]
+        if line_str.startswith("$"):
+            return self.__execute_system_command(line_str, generation)
+
+        word_list = WORD_REGEX.findall(line_str)
+        if "".join(letter + number_str for letter, number_str in word_list) != line_str:
+            return ["error:1"]     # expected command letter
+        if self.__is_alarm:
+            return ["error:9"]     # G-code locked out during alarm or jog state
+
+        word_dict = {}
+        g_list = []
+        for letter, number_str in word_list:
+            if "G" == letter:
+                g_list.append(number_str)
+            else:
+                word_dict[letter] = float(number_str)
+
+        return self.__execute_gcode(g_list, word_dict, generation)
+
+    def __execute_system_command(self, line_str, generation):
+        if "$H" == line_str:
+            if not self.__wait_for_planner_empty(generation):
+                return None
+            with self.__cond:
+                start = self.__machine_position
+                speed = MAX_RATE_MM_MIN / 60.0
+                self.__planner.append(MotionBlock(start, HOME_POSITION, speed, ACCELERATION_MM_S2, is_homing=True))
+                self.__planned_position = HOME_POSITION
+                self.__cond.notify_all()
+            if not self.__wait_for_planner_empty(generation):
+                return None
+            with self.__cond:
+                self.__is_homed = True
+                self.__is_alarm = False
+            return ["ok"]
+        if "$X" == line_str:
+            with self.__cond:
+                self.__is_alarm = False
+            return ["[MSG:Caution: Unlocked]", "ok"]
+        if "$G" == line_str:
+            with self.__cond:
+                gc_str = "[GC:{0} {1} G17 G21 {2} G94 M5 M9 T0 F{3:.0f} S0]".format(
+                    self.__motion_mode, self.__wcs_name, "G91" if self.__is_incremental else "G90",
+                    self.__feed_mm_min)
+            return [gc_str, "ok"]
+        if "$#" == line_str:
+            with self.__cond:
+                response_list = ["[{0}:{1:.3f},{2:.3f},{3:.3f}]".format(name, *self.__wcs_offset_dict[name])
+                                 for name in WCS_NAME_LIST]
+                response_list += ["[G28:0.000,0.000,0.000]", "[G30:0.000,0.000,0.000]", "[G92:0.000,0.000,0.000]",
+                                  "[TLO:0.000]", "[PRB:{0:.3f},{1:.3f},{2:.3f}:{3:d}]".format(
+                                      self.__probe_position[0], self.__probe_position[1],
+                                      self.__probe_position[2], self.__probe_succeeded)]
+            return response_list + ["ok"]
+        if "$$" == line_str:
+            return ["$11={0:.3f}".format(JUNCTION_DEVIATION_MM),
+                    "$110={0:.3f}".format(MAX_RATE_MM_MIN), "$111={0:.3f}".format(MAX_RATE_MM_MIN),
+                    "$112={0:.3f}".format(MAX_RATE_MM_MIN),
+                    "$120={0:.3f}".format(ACCELERATION_MM_S2), "$121={0:.3f}".format(ACCELERATION_MM_S2),
+                    "$122={0:.3f}".format(ACCELERATION_MM_S2), "ok"]
+        return ["error:3"]     # invalid $ statement
+
+    def __execute_gcode(self, g_list, word_dict, generation):
+        motion_mode = None
+        probe_kind = None
+        for g_str in g_list:
+            g = float(g_str)
+            if g in (0.0, 1.0):
+                motion_mode = "G{0:.0f}".format(g)
+            elif g in (38.2, 38.3, 38.4, 38.5):
+                probe_kind = g
+            elif 4.0 == g:
+                if not self.__wait_for_planner_empty(generation):
+                    return None
+                self.__sleep_sim(word_dict.get("P", 0.0), generation)
+            elif 10.0 == g:
+                return self.__set_wcs_offset(word_dict, generation)
+            elif 90.0 == g:
+                self.__is_incremental = False
+            elif 91.0 == g:
+                self.__is_incremental = True
+            elif 54.0 <= g <= 59.0 and g == int(g):
+                self.__wcs_name = "G{0:.0f}".format(g)
+            elif g not in (17.0, 21.0, 94.0):
+                return ["error:20"]    # unsupported or invalid g-code command
+
+        if "F" in word_dict:
+            self.__feed_mm_min = word_dict["F"]
+        if probe_kind is not None:
+            return self.__probe(probe_kind, word_dict, generation)
+        if motion_mode is not None:
+            self.__motion_mode = motion_mode
+        if any(axis in word_dict for axis in "XYZ"):
+            return self.__queue_move(word_dict, generation)
+
+        return ["ok"]
+
+    def __set_wcs_offset(self, word_dict, generation):
+        """
+        G10 L2 Pn sets coordinate system n's offset; G10 L20 Pn sets it so the current position has the given values.
+
+        :return:    list of lines to send in response, or None if a reset aborted the line
+        """
+        l_value = word_dict.get("L")
+        p_value = word_dict.get("P", 0.0)
+        if l_value not in (2.0, 20.0) or not 0.0 <= p_value <= 6.0:
+            return ["error:20"]
+        if not self.__wait_for_planner_empty(generation):
+            return None
+        with self.__cond:
+            name_str = self.__wcs_name if 0.0 == p_value else WCS_NAME_LIST[int(p_value) - 1]
+            offset = list(self.__wcs_offset_dict[name_str])
+            for i, axis in enumerate("XYZ"):
+                if axis in word_dict:
+                    if 2.0 == l_value:
+                        offset[i] = word_dict[axis]
+                    else:
+                        offset[i] = self.__planned_position[i] - word_dict[axis]
+            self.__wcs_offset_dict[name_str] = tuple(offset)
+        return ["ok"]
+
+    def __target_position(self, word_dict):
+        """
+        :return:    machine position commanded by the X, Y, Z words.  Called with the lock held.
+        """
+        offset = self.__wcs_offset_dict[self.__wcs_name]
+        target = list(self.__planned_position)
+        for i, axis in enumerate("XYZ"):
+            if axis in word_dict:
+                if self.__is_incremental:
+                    target[i] += word_dict[axis]
+                else:
+                    target[i] = word_dict[axis] + offset[i]
+        return tuple(target)
+
+    def __probe(self, probe_kind, word_dict, generation):
+        """
+        G38.2/G38.3 move toward the target until the probe (tool tip on the surface) triggers,
+        G38.4/G38.5 until it releases.  G38.2 and G38.4 raise ALARM:5 if that never happens.
+        The tool stops a deceleration distance past the trigger point, like the real machine.
+
+        :return:    list of lines to send in response, or None if a reset or alarm aborted the line
+        """
+        if 0.0 >= self.__feed_mm_min:
+            return ["error:22"]    # undefined feed rate
+        if not any(axis in word_dict for axis in "XYZ"):
+            return ["error:26"]    # no axis words
+        if not self.__wait_for_planner_empty(generation):
+            return None
+
+        toward = probe_kind in (38.2, 38.3)
+        with self.__cond:
+            start = self.__machine_position
+            if self.__touching_at(start) == toward:
+                return self.__raise_alarm(4)   # probe not in the expected initial state
+            speed = min(self.__feed_mm_min, MAX_RATE_MM_MIN) / 60.0
+            path_block = MotionBlock(start, self.__target_position(word_dict), speed, ACCELERATION_MM_S2)
+            crossing_list = self.__crossing_distances(path_block, not toward)
+            if crossing_list:
+                trigger_position = path_block.position_at(crossing_list[0])
+                stop_distance = crossing_list[0] + speed * speed / (2.0 * ACCELERATION_MM_S2)
+                stop_position = path_block.position_at(min(stop_distance, path_block.length))
+            else:
+                trigger_position = None
+                stop_position = path_block.end
+            self.__planner.append(MotionBlock(start, stop_position, speed, ACCELERATION_MM_S2))
+            self.__planned_position = stop_position
+            self.__cond.notify_all()
+
+        if not self.__wait_for_planner_empty(generation):
+            return None
+        with self.__cond:
+            self.__probe_position = stop_position if trigger_position is None else trigger_position
+            self.__probe_succeeded = trigger_position is not None
+        if trigger_position is None:
+            if probe_kind in (38.2, 38.4):
+                return self.__raise_alarm(5)   # probe fail: no contact within the programmed travel
+            return ["[PRB:{0:.3f},{1:.3f},{2:.3f}:0]".format(*stop_position), "ok"]
+        return ["[PRB:{0:.3f},{1:.3f},{2:.3f}:1]".format(*trigger_position), "ok"]
+
+    def __raise_alarm(self, alarm_code):
+        """
+        Enter the alarm state, discarding everything buffered, as GRBL does.
+
+        :return:    None: the line that caused the alarm gets no response
+        """
+        with self.__cond:
+            self.__is_alarm = True
+            self.__generation += 1
+            self.__planner = []
+            self.__planned_position = self.__machine_position
+            while not self.__rx_queue.empty():
+                self.__rx_queue.get()
+            self.__rx_bytes = 0
+            self.__cond.notify_all()
+        self.__send_line("ALARM:{0}".format(alarm_code))
+        return None
+
+    def __queue_move(self, word_dict, generation):
+        """
+        Plan a G0/G1 move, waiting for room in the planner.
+
+        :return:    list of lines to send in response, or None if a reset aborted the line
+        """
+        with self.__cond:
+            target = self.__target_position(word_dict)
+            if "G1" == self.__motion_mode:
+                if 0.0 >= self.__feed_mm_min:
+                    return ["error:22"]    # undefined feed rate
+                speed = self.__feed_mm_min / 60.0
+            else:
+                speed = MAX_RATE_MM_MIN / 60.0
+            block = MotionBlock(self.__planned_position, target, min(speed, MAX_RATE_MM_MIN / 60.0),
+                                ACCELERATION_MM_S2)
+            if 0.0 >= block.length:
+                return ["ok"]
+
+            while len(self.__planner) >= self.__planner_block_count:    # GRBL withholds "ok" here
+                if generation != self.__generation or not self.__running:
+                    return None
+                self.__cond.wait(0.1)
+            if generation != self.__generation:
+                return None
+
+            previous_block = self.__planner[-1] if self.__planner else None
+            block.max_entry_speed = self.__junction_speed(previous_block, block)
+            self.__planner.append(block)
+            self.__planned_position = target
+            self.__cond.notify_all()
+        return ["ok"]
+
+    def __wait_for_planner_empty(self, generation):
+        """
+        :return:    True -> all queued motion finished, False -> reset or stopped while waiting
+        """
+        with self.__cond:
+            while 0 < len(self.__planner):
+                if generation != self.__generation or not self.__running:
+                    return False
+                self.__cond.wait(0.1)
+            return generation == self.__generation
+
+    def __sleep_sim(self, seconds, generation):
+        deadline = time.time() + seconds / self.__speedup
+        with self.__cond:
+            while time.time() < deadline and generation == self.__generation and self.__running:
+                self.__cond.wait(min(deadline - time.time(), 0.1))
+
+    @staticmethod
+    def __junction_speed(previous_block, block):
+        """
+        GRBL's junction deviation limit on the speed through the corner between two blocks.
+        """
+        if previous_block is None:
+            return 0.0
+        cos_theta = -sum(p * c for p, c in zip(previous_block.unit, block.unit))
+        if cos_theta > 0.999999:
+            return 0.0                      # reversal
+        if cos_theta < -0.999999:
+            return block.nominal_speed      # straight through
+        sin_theta_d2 = math.sqrt(0.5 * (1.0 - cos_theta))
+        return math.sqrt(block.acceleration * JUNCTION_DEVIATION_MM * sin_theta_d2 / (1.0 - sin_theta_d2))
+
+    #
+    # Motion thread
+    #
+
+    def __motion_loop(self):
+        while self.__running:
+            with self.__cond:
+                while self.__running and 0 == len(self.__planner):
+                    self.__cond.wait(0.1)
+                if not self.__running:
+                    return
+                block = self.__planner[0]
+                exit_speed = self.__plan_exit_speed()
+                entry_speed = min(self.__current_speed, block.nominal_speed)
+                profile = TrapezoidProfile(block.length, entry_speed, block.nominal_speed, exit_speed,
+                                           block.acceleration)
+                generation = self.__generation
+                self.__exec_block = block
+                self.__exec_profile = profile
+                self.__exec_start = time.time()
+                start_touching = self.__is_touching
+
+            edge_list = self.__contact_edges(block, profile, start_touching)
+            end_time = self.__exec_start + profile.duration / self.__speedup
+            for edge_time, is_touching in edge_list + [(end_time, None)]:
+                with self.__cond:
+                    while self.__running and generation == self.__generation and time.time() < edge_time:
+                        self.__cond.wait(min(edge_time - time.time(), 0.1))
+                    if generation != self.__generation or not self.__running:
+                        break
+                    if is_touching is not None:
+                        self.__is_touching = is_touching
+                if is_touching is not None:
+                    for listener in self.__contact_listener_list:
+                        listener(is_touching, edge_time)
+
+            with self.__cond:
+                if generation != self.__generation:
+                    self.__is_touching = self.__touching_at(self.__machine_position)
+                    continue
+                self.__machine_position = block.end
+                self.__current_speed = profile.exit_speed
+                self.__exec_block = None
+                self.__planner.pop(0)
+                self.__cond.notify_all()
+
+    def __plan_exit_speed(self):
+        """
+        Exit speed for the head of the planner: the fastest it can leave while every following block
+        can still stop by the end of the queue.  Called with the lock held.
+        """
+        next_entry_speed = 0.0
+        for i in range(len(self.__planner) - 1, 0, -1):
+            block = self.__planner[i]
+            next_entry_speed = min(block.max_entry_speed, block.nominal_speed,
+                                   math.sqrt(next_entry_speed ** 2 + 2.0 * block.acceleration * block.length))
+        head = self.__planner[0]
+        reachable_speed = math.sqrt(self.__current_speed ** 2 + 2.0 * head.acceleration * head.length)
+        return min(next_entry_speed, reachable_speed, head.nominal_speed)
+
+    def __contact_edges(self, block, profile, start_touching):
+        """
+        :return:    list of (time.time(), is_touching) at which the tool tip touches or leaves the surface
+        """
+        edge_list = []
+        is_touching = start_touching
+        for s in self.__crossing_distances(block, start_touching):
+            is_touching = not is_touching
+            edge_list.append((self.__exec_start + profile.time_at(s) / self.__speedup, is_touching))
+        return edge_list
+
+    def __crossing_distances(self, block, start_touching):
+        """
+        :return:    list of distances along the block at which the tool tip touches or leaves the surface
+        """
+        distance_list = []
+        if 0.0 >= block.length:
+            return distance_list
+        sample_count = max(int(block.length / 0.05), 1)
+        was_touching = start_touching
+        s_lo = 0.0
+        for i in range(1, sample_count + 1):
+            s_hi = block.length * i / sample_count
+            if self.__touching_at(block.position_at(s_hi)) != was_touching:
+                lo, hi = s_lo, s_hi
+                for _ in range(30):     # bisect to well under a step
+                    mid = 0.5 * (lo + hi)
+                    if self.__touching_at(block.position_at(mid)) == was_touching:
+                        lo = mid
+                    else:
+                        hi = mid
+                was_touching = not was_touching
+                distance_list.append(hi)
+            s_lo = s_hi
+        return distance_list
+
+    #
+    # State, called with the lock held
+    #
+
+    def __touching_at(self, position):
+        x, y, z = position
+        return z <= self.__surface.get_z(x, y)
+
+    def __position_now(self):
+        if self.__exec_block is None:
+            return self.__machine_position
+        elapsed = (time.time() - self.__exec_start) * self.__speedup
+        return self.__exec_block.position_at(self.__exec_profile.distance_at(elapsed))
+
+    def __speed_now(self):
+        if self.__exec_block is None:
+            return 0.0
+        elapsed = (time.time() - self.__exec_start) * self.__speedup
+        return self.__exec_profile.speed_at(elapsed)
+
+    def __state_str(self):
+        if self.__exec_block is not None and self.__exec_block.is_homing:
+            return "Home"
+        if self.__is_alarm:
+            return "Alarm"
+        if self.__exec_block is not None or 0 < len(self.__planner):
+            return "Run"
+        return "Idle"
+
+
+if "__main__" == __name__:
+    speedup = float(sys.argv[1]) if 1 < len(sys.argv) else 1.0
+
+    simulator = GrblSimulator(speedup=speedup)
+    simulator.start()
+    print "GRBL 1.1f simulator on {0} (speedup {1:.1f}x), Ctrl-C to quit".format(simulator.port_name, speedup)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    simulator.stop()
+    print "{0} lines received".format(simulator.line_count)
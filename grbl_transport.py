@@ -0,0 +1,362 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import collections
+import threading
+import time
+
+
+GRBL_RX_BUFFER_SIZE = 127       # Bytes in GRBL's serial receive buffer, less the one it reserves
+
+
+class CommandFuture(object):
+    """
+    The eventual GRBL response to one command sent through a GrblTransport.
+
+    The response is "ok", "error:N", or, if the command was lost to a reset or alarm, the
+    ALARM or startup line that reported it.  Any [...] feedback lines (e.g. [PRB:...], [GC:...])
+    received while this command was the oldest one pending are kept in message_list.
+    """
+    def __init__(self, cmd_str):
+        assert isinstance(cmd_str, str)
+        self.__cmd_str = cmd_str
+        self.__response_str = None
+        self.__message_list = []
+        self.__callback_list = []
+        self.__event = threading.Event()
+        self.__lock = threading.Lock()
+
+    @property
+    def cmd_str(self):
+        return self.__cmd_str
+
+    @property
+    def response_str(self):     # None until done()
+        return self.__response_str
+
+    @property
+    def message_list(self):
+        return self.__message_list
+
+    @property
+    def ok(self):
+        return "ok" == self.__response_str
+
+    def done(self):
+        """
+        :return:    True if the response has been received
+        """
+        return self.__event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for and return the response string.
+
+        :param timeout: seconds to wait, None -> forever
+
+        :return:    the response string, or None if the wait timed out
+        """
+        self.__event.wait(timeout)
+        return self.__response_str
+
+    def add_done_callback(self, callback):
+        """
+        Arrange for callback(future) to be called when the response is received.
+        If it already has been, callback is called immediately.
+
+        Callbacks run on the transport's reader thread, so they should be quick.
+
+        :param callback:    function of one argument, this CommandFuture
+
+        :return:    nothing
+        """
+        with self.__lock:
+            if not self.__event.is_set():
+                self.__callback_list.append(callback)
+                return
+        callback(self)
+
+    def add_message(self, message_str):
+        """
+        Record a [...] feedback line belonging to this command.  Called by GrblTransport.
+        """
+        self.__message_list.append(message_str)
+
+    def resolve(self, response_str):
+        """
+        Record the response and run the done callbacks.  Called by GrblTransport.
+
+        :param response_str:    "ok", "error:N", or the line reporting the command lost
+
+        :return:    nothing
+        """
+        assert isinstance(response_str, str)
+        with self.__lock:
+            self.__response_str = response_str
+            self.__event.set()
+            callback_list = self.__callback_list
+            self.__callback_list = []
+        for callback in callback_list:
+            callback(self)
+
+
+class GrblTransport(object):
+    """
+    Full-duplex command transport to GRBL over an open serial port.
+
+    send() writes a command as soon as GRBL's receive buffer has room for it (character counting)
+    and returns a CommandFuture.  A background reader thread reads every line GRBL sends and
+    demultiplexes it:
+
+        "ok", "error:N"         resolve the oldest pending CommandFuture
+        "<...>"                 real-time status reports, passed to the status listeners
+        "ALARM:N"               passed to the alarm listeners; pending commands are lost
+        "[...]"                 feedback, attached to the oldest pending CommandFuture and
+                                passed to the message listeners
+        "Grbl ..."              startup banner after a reset, passed to the alarm listeners;
+                                pending commands are lost
+
+    Listeners are called as listener(line_str, timestamp) on the reader thread.
+
+    The port may be anything with pyserial's readline() and write(); its read timeout bounds
+    how long stop() takes.
+    """
+    def __init__(self, port, rx_buffer_size=GRBL_RX_BUFFER_SIZE, command_metrics=None):
+        assert port is not None
+        assert isinstance(rx_buffer_size, int) and 0 < rx_buffer_size
+        self.__port = port
+        self.__command_metrics = command_metrics    # optional command_metrics.CommandMetrics
+        self.__rx_buffer_size = rx_buffer_size
+        self.__pending = collections.deque()    # (CommandFuture, byte_count), oldest first
+        self.__bytes_outstanding = 0
+        self.__failures_since_drain = 0
+        self.__condition = threading.Condition()
+        self.__write_lock = threading.Lock()
+        self.__listener_lock = threading.Lock()     # status listeners come and go on other threads
+        self.__status_listener_list = []
+        self.__alarm_listener_list = []
+        self.__message_listener_list = []
+        self.__reader_thread = None
+        self.__running = False
+
+    @property
+    def port(self):
+        return self.__port
+
+    @property
+    def pending_count(self):
+        return len(self.__pending)
+
+    @property
+    def bytes_outstanding(self):
+        return self.__bytes_outstanding
+
+    def add_status_listener(self, listener):
+        with self.__listener_lock:
+            self.__status_listener_list.append(listener)
+
+    def remove_status_listener(self, listener):
+        with self.__listener_lock:
+            self.__status_listener_list.remove(listener)
+
+    def add_alarm_listener(self, listener):
+        self.__alarm_listener_list.append(listener)
+
+    def add_message_listener(self, listener):
+        self.__message_listener_list.append(listener)
+
+    def start(self):
+        """
+        Start the background reader thread.
+
+        :return:    nothing
+        """
+        assert self.__reader_thread is None
+        self.__running = True
+        self.__reader_thread = threading.Thread(target=self.__read_loop, name="GrblTransport reader")
+        self.__reader_thread.daemon = True
+        self.__reader_thread.start()
+
+    def stop(self):
+        """
+        Stop the reader thread.  Commands still pending are left unresolved.
+
+        :return:    nothing
+        """
+        self.__running = False
+        if self.__reader_thread is not None:
+            self.__reader_thread.join()
+            self.__reader_thread = None
+        with self.__condition:
+            self.__condition.notify_all()
+
+    def send(self, cmd_str):
+        """
+        Send a command line, waiting only until GRBL's receive buffer has room for it.
+
+        :param cmd_str: Shapeoko command string, without its line terminator
+
+        :return:    CommandFuture for the command's response
+        """
+        assert isinstance(cmd_str, str)
+        byte_count = len(cmd_str) + 1   # the "\n" is buffered too
+        assert byte_count <= self.__rx_buffer_size
+        assert self.__running, "GrblTransport.send() called before start()"
+
+        future = CommandFuture(cmd_str)
+        with self.__condition:
+            while self.__running and self.__bytes_outstanding + byte_count > self.__rx_buffer_size:
+                self.__condition.wait(0.1)
+            self.__pending.append((future, byte_count))
+            self.__bytes_outstanding += byte_count
+            if self.__command_metrics is not None:
+                self.__command_metrics.record_send(cmd_str)
+            self.__write("{0}\n".format(cmd_str))
+
+        return future
+
+    def send_realtime(self, ch_str):
+        """
+        Send a real-time command character (e.g. "?", "!", "~", Ctrl-X).  GRBL acts on these
+        as they arrive without buffering them, so they are not counted and get no "ok".
+
+        :param ch_str:  single character string
+
+        :return:    nothing
+        """
+        assert isinstance(ch_str, str) and 1 == len(ch_str)
+        self.__write(ch_str)
+
+    def query_status(self, timeout=None):
+        """
+        Request a real-time status report and wait for it.
+
+        :param timeout: seconds to wait, None -> forever
+
+        :return:    the status report line, e.g. "<Idle|MPos:0.000,0.000,0.000|FS:0,0>", or None on timeout
+        """
+        report_list = []
+        event = threading.Event()
+
+        def on_status(line_str, timestamp):
+            if not event.is_set():
+                report_list.append(line_str)
+                event.set()
+
+        self.add_status_listener(on_status)
+        try:
+            self.send_realtime("?")
+            event.wait(timeout)
+        finally:
+            self.remove_status_listener(on_status)
+
+        return report_list[0] if report_list else None
+
+    def drain(self, timeout=None):
+        """
+        Wait until every command sent has been answered.
+
+        :param timeout: seconds to wait without any response arriving, None -> forever
+
+        :return:    True -> all answered and every response since the last drain() was "ok",
+                    False -> failure or timeout
+        """
+        with self.__condition:
+            pending_count = len(self.__pending)
+            deadline = None if timeout is None else time.time() + timeout
+            while 0 < len(self.__pending):
+                if not self.__running:
+                    return False
+                if len(self.__pending) < pending_count:    # progress, restart the timeout
+                    pending_count = len(self.__pending)
+                    deadline = None if timeout is None else time.time() + timeout
+                if deadline is not None and deadline <= time.time():
+                    return False
+                self.__condition.wait(0.1)
+            all_ok = 0 == self.__failures_since_drain
+            self.__failures_since_drain = 0
+
+        return all_ok
+
+    def __write(self, data_str):
+        with self.__write_lock:
+            self.__port.write(data_str)
+
+    def __read_loop(self):
+        while self.__running:
+            line_str = self.__port.readline().strip()
+            if "" == line_str:
+                continue
+            self.dispatch_line(line_str, time.time())
+
+    def dispatch_line(self, line_str, timestamp):
+        """
+        Route one line received from GRBL.  Called by the reader thread.
+
+        :param line_str:    stripped line
+        :param timestamp:   time.time() when the line was read
+
+        :return:    nothing
+        """
+        if "ok" == line_str or line_str.startswith("error"):
+            self.__resolve_oldest(line_str)
+        elif line_str.startswith("<"):
+            with self.__listener_lock:
+                status_listener_list = list(self.__status_listener_list)
+            for listener in status_listener_list:
+                listener(line_str, timestamp)
+        elif line_str.startswith("["):
+            with self.__condition:
+                if 0 < len(self.__pending):
+                    self.__pending[0][0].add_message(line_str)
+            for listener in self.__message_listener_list:
+                listener(line_str, timestamp)
+        elif line_str.startswith("ALARM") or line_str.startswith("Grbl"):
+            self.__resolve_all(line_str)
+            for listener in self.__alarm_listener_list:
+                listener(line_str, timestamp)
+
+    def __resolve_oldest(self, response_str):
+        with self.__condition:
+            if 0 == len(self.__pending):
+                print "GrblTransport: UNMATCHED RESPONSE_STR({0})".format(response_str)
+                return
+            future, byte_count = self.__pending.popleft()
+            self.__bytes_outstanding -= byte_count
+            if self.__command_metrics is not None:
+                self.__command_metrics.record_response(response_str)
+            if "ok" != response_str:
+                self.__failures_since_drain += 1
+            self.__condition.notify_all()
+        future.resolve(response_str)
+
+    def __resolve_all(self, response_str):
+        with self.__condition:
+            lost_list = [future for future, byte_count in self.__pending]
+            self.__pending.clear()
+            if self.__command_metrics is not None:
+                self.__command_metrics.record_lost()
+            self.__bytes_outstanding = 0
+            self.__failures_since_drain += len(lost_list)
+            self.__condition.notify_all()
+        for future in lost_list:
+            future.resolve(response_str)
@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+A height map of the table: z on a regular grid, for a table whose twist and sag a plane can't capture.
+
+A HeightMap is built either from z already on a grid (e.g. probed at the table's 50 mm hole
+spacing), or from scattered measurements gridded with a thin-plate spline.  Within each cell,
+z is a bilinear or bicubic polynomial whose coefficients are computed once, so get_z() of a point
+costs the same whatever the map's size, and works on whole NumPy arrays at once.
+
+save() writes the grid and the cell coefficients to a binary file: a HEADER_FORMAT header
+followed by little-endian float64 arrays, which load() memory-maps.
+
+    python height_map.py <x,y,z CSV> [<spacing mm> [<height map file>]]
+"""
+
+import math
+import numpy as np
+import struct
+import sys
+
+
+FILE_MAGIC_STR = "SHMAP\x01\n\x00"
+HEADER_FORMAT = "<8s4d3I"       # magic, x0, y0, dx, dy, nx, ny, coefficients per cell
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INTERPOLATION_COEFF_COUNT_DICT = {"bilinear": 4, "bicubic": 16}
+TPS_MAX_POINTS = 2000           # more scattered points than this are first averaged over cells, coarser if need be
+
+# Bicubic patch p(u, v) = sum a[i, j] u**i v**j from the values and derivatives at the cell corners
+BICUBIC_MATRIX = np.array([[1.0, 0.0, 0.0, 0.0],
+                           [0.0, 0.0, 1.0, 0.0],
+                           [-3.0, 3.0, -2.0, -1.0],
+                           [2.0, -2.0, 1.0, 1.0]])
+
+
+class HeightMap(object):
+    """
+    z over the rectangle x0 <= x <= x0 + (nx - 1) * dx, y0 <= y <= y0 + (ny - 1) * dy.
+    Points outside it are clamped to its edge.
+    """
+    def __init__(self, z_grid, x0, y0, dx, dy, interpolation_str="bicubic", cell_coeffs=None):
+        """
+        :param z_grid:              (ny, nx) array, z_grid[j, i] being z at (x0 + i * dx, y0 + j * dy)
+        :param x0:                  least x of the grid
+        :param y0:                  least y of the grid
+        :param dx:                  node spacing in x
+        :param dy:                  node spacing in y
+        :param interpolation_str:   "bilinear" or "bicubic"
+        :param cell_coeffs:         precomputed (ny - 1, nx - 1, 4 or 16) coefficients, e.g. memory-mapped by load()
+        """
+        assert interpolation_str in INTERPOLATION_COEFF_COUNT_DICT
+        z_grid = np.asarray(z_grid, dtype=np.float64)
+        assert 2 == z_grid.ndim and 2 <= z_grid.shape[0] and 2 <= z_grid.shape[1]
+        assert np.all(np.isfinite(z_grid)), "HeightMap() z_grid has missing values"
+        assert 0.0 < dx and 0.0 < dy
+        self.__z_grid = z_grid
+        self.__x0, self.__y0, self.__dx, self.__dy = float(x0), float(y0), float(dx), float(dy)
+        self.__interpolation_str = interpolation_str
+        if cell_coeffs is None:
+            if "bilinear" == interpolation_str:
+                cell_coeffs = _bilinear_coeffs(z_grid)
+            else:
+                cell_coeffs = _bicubic_coeffs(z_grid)
+        assert cell_coeffs.shape == (z_grid.shape[0] - 1, z_grid.shape[1] - 1,
+                                     INTERPOLATION_COEFF_COUNT_DICT[interpolation_str])
+        self.__cell_coeffs = cell_coeffs
+
+    @classmethod
+    def from_points(cls, x_list, y_list, z_list, spacing_mm, interpolation_str="bicubic", smoothing=0.0):
+        """
+        Grid scattered measurements with a thin-plate spline, over their bounding rectangle.  Beyond
+        TPS_MAX_POINTS, the points are first averaged over cells of spacing_mm, or coarser cells if that
+        still leaves more than TPS_MAX_POINTS, so the spline's dense solve stays bounded.
+
+        :param x_list:              x values
+        :param y_list:              y values
+        :param z_list:              measured heights
+        :param spacing_mm:          grid node spacing
+        :param interpolation_str:   "bilinear" or "bicubic", used within cells
+        :param smoothing:           0.0 passes through every point; larger values smooth out measurement noise
+
+        :return:    HeightMap
+        """
+        assert isinstance(spacing_mm, float) and 0.0 < spacing_mm
+        x = np.asarray(x_list, dtype=np.float64)
+        y = np.asarray(y_list, dtype=np.float64)
+        z = np.asarray(z_list, dtype=np.float64)
+        assert 1 == x.ndim and x.shape == y.shape == z.shape and 3 <= len(x)
+
+        x0, y0 = x.min(), y.min()
+        nx = max(int(math.ceil((x.max() - x0) / spacing_mm - 1e-9)) + 1, 2)
+        ny = max(int(math.ceil((y.max() - y0) / spacing_mm - 1e-9)) + 1, 2)
+
+        # Average over grid cells, and over coarser cells until the spline's centres are few enough to solve for
+        cell_mm = spacing_mm
+        x_fit, y_fit, z_fit = x, y, z
+        while TPS_MAX_POINTS < len(x_fit):
+            x_fit, y_fit, z_fit = _cell_means(x, y, z, x0, y0, cell_mm)
+            cell_mm *= max(math.sqrt(float(len(x_fit)) / TPS_MAX_POINTS), 1.1)
+        x, y, z = x_fit, y_fit, z_fit
+
+        grid_x, grid_y = np.meshgrid(x0 + spacing_mm * np.arange(nx), y0 + spacing_mm * np.arange(ny))
+        z_grid = thin_plate_spline(x, y, z, smoothing)(grid_x.ravel(), grid_y.ravel()).reshape(ny, nx)
+
+        return cls(z_grid, x0, y0, spacing_mm, spacing_mm, interpolation_str)
+
+    @classmethod
+    def load(cls, filename_str, mmap=True):
+        """
+        :param filename_str:    file written by save()
+        :param mmap:            if True, memory-map the arrays rather than reading them
+
+        :return:    HeightMap
+        """
+        with open(filename_str, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        magic_str, x0, y0, dx, dy, nx, ny, coeff_count = struct.unpack(HEADER_FORMAT, header)
+        assert FILE_MAGIC_STR == magic_str, "HeightMap.load() {0} is not a height map".format(filename_str)
+        interpolation_str = [k for k, v in INTERPOLATION_COEFF_COUNT_DICT.items() if v == coeff_count][0]
+
+        grid_shape = (ny, nx)
+        coeff_shape = (ny - 1, nx - 1, coeff_count)
+        coeff_offset = HEADER_SIZE + 8 * ny * nx
+        if mmap:
+            z_grid = np.memmap(filename_str, dtype="<f8", mode="r", offset=HEADER_SIZE, shape=grid_shape)
+            cell_coeffs = np.memmap(filename_str, dtype="<f8", mode="r", offset=coeff_offset, shape=coeff_shape)
+        else:
+            data = np.fromfile(filename_str, dtype=np.uint8)
+            z_grid = np.frombuffer(data, "<f8", ny * nx, HEADER_SIZE).reshape(grid_shape)
+            cell_coeffs = np.frombuffer(data, "<f8", int(np.prod(coeff_shape)), coeff_offset).reshape(coeff_shape)
+
+        return cls(z_grid, x0, y0, dx, dy, interpolation_str, cell_coeffs)
+
+    def save(self, filename_str):
+        """
+        :param filename_str:    height map file to write
+
+        :return:    nothing
+        """
+        ny, nx = self.__z_grid.shape
+        with open(filename_str, "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, FILE_MAGIC_STR, self.__x0, self.__y0, self.__dx, self.__dy, nx, ny,
+                                self.__cell_coeffs.shape[2]))
+            f.write(np.ascontiguousarray(self.__z_grid, dtype="<f8").tostring())
+            f.write(np.ascontiguousarray(self.__cell_coeffs, dtype="<f8").tostring())
+
+    @property
+    def z_grid(self):
+        return self.__z_grid
+
+    @property
+    def interpolation_str(self):
+        return self.__interpolation_str
+
+    @property
+    def extent(self):           # (x_min, x_max, y_min, y_max)
+        ny, nx = self.__z_grid.shape
+        return self.__x0, self.__x0 + (nx - 1) * self.__dx, self.__y0, self.__y0 + (ny - 1) * self.__dy
+
+    def get_z(self, x, y):
+        """
+        :param x:   x value, or array of them
+        :param y:   y value, or array of them (broadcast with x)
+
+        :return:    z at (x, y): a float for scalar x and y, else an array
+        """
+        is_scalar = np.isscalar(x) and np.isscalar(y)
+        ny, nx = self.__z_grid.shape
+        u = np.clip((np.asarray(x, dtype=np.float64) - self.__x0) / self.__dx, 0.0, nx - 1)
+        v = np.clip((np.asarray(y, dtype=np.float64) - self.__y0) / self.__dy, 0.0, ny - 1)
+        i = np.minimum(u.astype(np.intp), nx - 2)
+        j = np.minimum(v.astype(np.intp), ny - 2)
+        u, v = np.broadcast_arrays(u - i, v - j)
+        coeffs = self.__cell_coeffs[j, i]
+
+        if "bilinear" == self.__interpolation_str:
+            z = coeffs[..., 0] + coeffs[..., 1] * u + coeffs[..., 2] * v + coeffs[..., 3] * u * v
+        else:
+            coeffs = coeffs.reshape(coeffs.shape[:-1] + (4, 4))
+            # Horner's rule in u, then in v
+            row = ((coeffs[..., 3, :] * u[..., None] + coeffs[..., 2, :]) * u[..., None] + coeffs[..., 1, :]) * \
+                u[..., None] + coeffs[..., 0, :]
+            z = ((row[..., 3] * v + row[..., 2]) * v + row[..., 1]) * v + row[..., 0]
+
+        return float(z) if is_scalar else z
+
+
+def _bilinear_coeffs(z_grid):
+    """
+    :return:    (ny - 1, nx - 1, 4) coefficients of z = c0 + c1 u + c2 v + c3 u v in each cell
+    """
+    z00, z10 = z_grid[:-1, :-1], z_grid[:-1, 1:]
+    z01, z11 = z_grid[1:, :-1], z_grid[1:, 1:]
+    return np.stack((z00, z10 - z00, z01 - z00, z11 - z10 - z01 + z00), axis=-1)
+
+
+def _bicubic_coeffs(z_grid):
+    """
+    Bicubic patches matching z and its finite-difference derivatives at every node, so z is smooth across cells.
+
+    :return:    (ny - 1, nx - 1, 16) coefficients a[i, j] of u**i v**j in each cell, flattened
+    """
+    fu = np.gradient(z_grid, axis=1)        # per node spacing, i.e. d/du
+    fv = np.gradient(z_grid, axis=0)
+    fuv = np.gradient(fu, axis=0)
+
+    def corners(f):     # (ny - 1, nx - 1, 2, 2): f at (u, v) corners indexed [u][v]
+        return np.stack((np.stack((f[:-1, :-1], f[1:, :-1]), axis=-1),
+                         np.stack((f[:-1, 1:], f[1:, 1:]), axis=-1)), axis=-2)
+
+    f_matrix = np.empty(z_grid[:-1, :-1].shape + (4, 4))
+    f_matrix[..., :2, :2] = corners(z_grid)
+    f_matrix[..., :2, 2:] = corners(fv)
+    f_matrix[..., 2:, :2] = corners(fu)
+    f_matrix[..., 2:, 2:] = corners(fuv)
+
+    coeffs = np.einsum("ik,...kl,jl->...ij", BICUBIC_MATRIX, f_matrix, BICUBIC_MATRIX)
+    return coeffs.reshape(coeffs.shape[:-2] + (16,))
+
+
+def _cell_means(x, y, z, x0, y0, spacing_mm):
+    """
+    :return:    x, y, z averaged over the points nearest each node of a grid of spacing_mm from (x0, y0)
+    """
+    nx = int(round((x.max() - x0) / spacing_mm)) + 1
+    ny = int(round((y.max() - y0) / spacing_mm)) + 1
+    i = np.clip(np.round((x - x0) / spacing_mm).astype(np.intp), 0, nx - 1)
+    j = np.clip(np.round((y - y0) / spacing_mm).astype(np.intp), 0, ny - 1)
+    cell = j * nx + i
+    count = np.bincount(cell, minlength=nx * ny)
+    occupied = 0 < count
+    mean_list = [np.bincount(cell, weights=values, minlength=nx * ny)[occupied] / count[occupied]
+                 for values in (x, y, z)]
+    return mean_list[0], mean_list[1], mean_list[2]
+
+
+def thin_plate_spline(x, y, z, smoothing=0.0):
+    """
+    The thin-plate spline through (or, with smoothing, near) the points: the smoothest surface
+    that bends to fit them.
+
+    :param x:           x values
+    :param y:           y values
+    :param z:           heights
+    :param smoothing:   0.0 to interpolate
+
+    :return:    function of (x array, y array) giving z array
+    """
+    assert isinstance(smoothing, float) and 0.0 <= smoothing
+    center = np.array((x.mean(), y.mean()))
+    scale = max(np.ptp(x), np.ptp(y), 1e-9)     # unit-sized coordinates keep the system well conditioned
+    points = (np.column_stack((x, y)) - center) / scale
+
+    def kernel(p, q):
+        r2 = np.sum((p[:, None, :] - q[None, :, :]) ** 2, axis=-1)
+        return np.where(0.0 < r2, 0.5 * r2 * np.log(np.maximum(r2, 1e-300)), 0.0)     # r**2 log r
+
+    count = len(points)
+    polynomial = np.column_stack((np.ones(count), points))
+    system = np.zeros((count + 3, count + 3))
+    system[:count, :count] = kernel(points, points) + smoothing * np.eye(count)
+    system[:count, count:] = polynomial
+    system[count:, :count] = polynomial.T
+    right_side = np.concatenate((z, np.zeros(3)))
+    try:
+        solution = np.linalg.solve(system, right_side)
+    except np.linalg.LinAlgError:       # e.g. repeated points, when not smoothing
+        solution = np.linalg.lstsq(system, right_side, rcond=None)[0]
+    weights, affine = solution[:count], solution[count:]
+
+    def evaluate(query_x, query_y):
+        query = (np.column_stack((query_x, query_y)) - center) / scale
+        result = affine[0] + query.dot(affine[1:])
+        for start in range(0, len(query), 4096):    # bounds the kernel matrix's memory
+            result[start:start + 4096] += kernel(query[start:start + 4096], points).dot(weights)
+        return result
+
+    return evaluate
+
+
+if "__main__" == __name__:
+    import planar_fit
+    import time
+
+    if len(sys.argv) < 2:
+        print "Usage python height_map.py <x,y,z CSV> [<spacing mm> [<height map file>]]"
+        exit(1)
+    spacing_mm = float(sys.argv[2]) if 2 < len(sys.argv) else 10.0
+    map_filename_str = sys.argv[3] if 3 < len(sys.argv) else "height_map.bin"
+
+    x_list, y_list, z_list = planar_fit.get_inputs(planar_fit.read_data_file(sys.argv[1]))
+    height_map = HeightMap.from_points(x_list, y_list, z_list, spacing_mm)
+    height_map.save(map_filename_str)
+
+    residuals = np.asarray(z_list) - height_map.get_z(np.asarray(x_list), np.asarray(y_list))
+    query_x = np.random.RandomState(0).uniform(height_map.extent[0], height_map.extent[1], 1000000)
+    query_y = np.random.RandomState(1).uniform(height_map.extent[2], height_map.extent[3], 1000000)
+    start_time = time.time()
+    HeightMap.load(map_filename_str).get_z(query_x, query_y)
+    elapsed_s = time.time() - start_time
+
+    print "{0} x {1} grid at {2:.1f} mm, written to {3}".format(
+        height_map.z_grid.shape[1], height_map.z_grid.shape[0], spacing_mm, map_filename_str)
+    print "Z: min({0:.3f}), max({1:.3f})".format(height_map.z_grid.min(), height_map.z_grid.max())
+    print "Largest difference from a measurement: {0:.4f} mm".format(np.max(np.abs(residuals)))
+    print "1,000,000 lookups from the memory-mapped file: {0:.3f} s".format(elapsed_s)
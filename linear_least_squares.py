@@ -52,7 +52,7 @@ def linear_least_squares_fit_xy_lists(x_list, y_list):
         x_matrix = np.array([x_list, np.ones(len(x_list))])
         mb_list = np.linalg.lstsq(x_matrix.T, y_list)[0]
     except:
-        mb_list = [None for i in range(len(x_list))]
+        mb_list = [None, None]
 
     return mb_list
 
@@ -81,6 +81,140 @@ def linear_least_squares_fit_tup_list(v_list):
     return mb_list
 
 
+DEGENERATE_TOLERANCE = 1e-12    # x spread, relative to x magnitude, below which a line's slope is undefined
+
+
+class LineFitBatch(object):
+    """
+    The result of linear_least_squares_fit_batch(): arrays with one entry per line.  For a transposed line,
+    slope and intercept are m and b of x = my + b, and the residuals are in x.
+    Degenerate lines (fewer than 2 points, or all at one x, or y if transposed) have NaN slope, intercept and
+    residual statistics.
+    """
+    def __init__(self, slopes, intercepts, counts, residual_std, max_abs_residual, degenerate_mask,
+                 transposed_mask):
+        self.__slopes = slopes
+        self.__intercepts = intercepts
+        self.__counts = counts
+        self.__residual_std = residual_std
+        self.__max_abs_residual = max_abs_residual
+        self.__degenerate_mask = degenerate_mask
+        self.__transposed_mask = transposed_mask
+
+    @property
+    def slopes(self):               # m of y = mx + b
+        return self.__slopes
+
+    @property
+    def intercepts(self):           # b of y = mx + b
+        return self.__intercepts
+
+    @property
+    def counts(self):               # points in each line
+        return self.__counts
+
+    @property
+    def residual_std(self):         # standard deviation of y about the line, 0.0 for a line of 2 points
+        return self.__residual_std
+
+    @property
+    def max_abs_residual(self):
+        return self.__max_abs_residual
+
+    @property
+    def degenerate_mask(self):      # True for lines that could not be fit
+        return self.__degenerate_mask
+
+    @property
+    def transposed_mask(self):      # True for lines fit as x = my + b
+        return self.__transposed_mask
+
+    def __len__(self):
+        return len(self.__slopes)
+
+
+def pack_xy_lists(xy_list_list):
+    """
+    Pack lines of points, e.g. the rows and columns of a hole pattern, for linear_least_squares_fit_batch().
+
+    :param xy_list_list:    list of lines, each a list of (x, y) tuples
+
+    :return:    (offsets, x_array, y_array): line k is x_array[offsets[k]:offsets[k + 1]], and likewise y
+    """
+    counts = [len(xy_list) for xy_list in xy_list_list]
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+    points = np.array([xy for xy_list in xy_list_list for xy in xy_list], dtype=np.float64).reshape(-1, 2)
+
+    return offsets, points[:, 0].copy(), points[:, 1].copy()
+
+
+def __line_sums(values, offsets, counts):
+    sums = np.zeros(len(counts))
+    nonempty = 0 < counts
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, offsets[:-1][nonempty])
+    return sums
+
+
+def linear_least_squares_fit_batch(offsets, x_array, y_array, transposed_mask=None):
+    """
+    Calculate the least squares fits y = mx + b of many lines at once, from closed-form sums.
+    Each line's x and y are centered on their means before the sums of products are taken,
+    so that the fit stays accurate far from (0, 0).
+
+    A near-vertical line, e.g. a column of a hole pattern, has no useful y = mx + b: mark it in
+    transposed_mask to fit x = my + b instead.
+
+    :param offsets:         K + 1 ascending indices; line k is x_array[offsets[k]:offsets[k + 1]], and likewise y
+    :param x_array:         x values of all the lines, concatenated
+    :param y_array:         y values of all the lines, concatenated
+    :param transposed_mask: K bools, True for lines to fit as x = my + b; default none
+
+    :return:    LineFitBatch of K lines
+    """
+    offsets = np.asarray(offsets, dtype=np.intp)
+    x_array = np.asarray(x_array, dtype=np.float64)
+    y_array = np.asarray(y_array, dtype=np.float64)
+    assert 1 == offsets.ndim and 1 <= len(offsets) and 0 == offsets[0]
+    assert len(x_array) == len(y_array) == offsets[-1]
+    counts = np.diff(offsets)
+    assert (0 <= counts).all(), "linear_least_squares_fit_batch() offsets must be ascending"
+    if transposed_mask is None:
+        transposed_mask = np.zeros(len(counts), dtype=bool)
+    transposed_mask = np.asarray(transposed_mask, dtype=bool)
+    assert transposed_mask.shape == counts.shape
+
+    line_index = np.repeat(np.arange(len(counts)), counts)
+    if transposed_mask.any():
+        is_transposed = transposed_mask[line_index]
+        x_array, y_array = np.where(is_transposed, y_array, x_array), np.where(is_transposed, x_array, y_array)
+    safe_counts = np.maximum(counts, 1)
+    x_mean = __line_sums(x_array, offsets, counts) / safe_counts
+    y_mean = __line_sums(y_array, offsets, counts) / safe_counts
+    dx = x_array - x_mean[line_index]
+    dy = y_array - y_mean[line_index]
+    sxx = __line_sums(dx * dx, offsets, counts)
+    sxy = __line_sums(dx * dy, offsets, counts)
+
+    degenerate_mask = (counts < 2) | (sxx <= DEGENERATE_TOLERANCE * (sxx + counts * x_mean**2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.where(degenerate_mask, np.nan, sxy / np.where(degenerate_mask, 1.0, sxx))
+    intercepts = y_mean - slopes * x_mean
+
+    residuals = dy - slopes[line_index] * dx
+    residual_sum_squares = __line_sums(residuals * residuals, offsets, counts)
+    residual_std = np.where(2 < counts, np.sqrt(residual_sum_squares / np.maximum(counts - 2, 1)), 0.0)
+    residual_std[degenerate_mask] = np.nan
+    nonempty = 0 < counts
+    max_abs_residual = np.zeros(len(counts))
+    if nonempty.any():
+        max_abs_residual[nonempty] = np.maximum.reduceat(np.where(degenerate_mask[line_index], 0.0, np.abs(residuals)),
+                                                         offsets[:-1][nonempty])
+    max_abs_residual[degenerate_mask] = np.nan
+
+    return LineFitBatch(slopes, intercepts, counts, residual_std, max_abs_residual, degenerate_mask, transposed_mask)
+
+
 if "__main__" == __name__:
     # Nominal test case
     x_list = []
@@ -124,3 +258,15 @@ if "__main__" == __name__:
     print linear_least_squares_fit_xy_lists(x_list, y_list)
     print linear_least_squares_fit_tup_list(tup_list)
 
+    # The same lines, and a vertical one, fit in one batch
+    offsets, x_array, y_array = pack_xy_lists([[(float(i), float(j)) for i in range(10) for j in range(i)],
+                                               [(0.0, 0.0), (0.0, 1.0), (1.0, 0.0), (1.0, 1.0)],
+                                               [(0.0, float(i)) for i in range(10)]])
+    line_fit_batch = linear_least_squares_fit_batch(offsets, x_array, y_array)
+    print line_fit_batch.slopes, line_fit_batch.intercepts
+    print line_fit_batch.residual_std, line_fit_batch.degenerate_mask
+
+    # The vertical one transposed, as x = my + b: x = 0.0 y + 0.0
+    line_fit_batch = linear_least_squares_fit_batch(offsets, x_array, y_array, [False, False, True])
+    print line_fit_batch.slopes, line_fit_batch.intercepts
+    print line_fit_batch.residual_std, line_fit_batch.degenerate_mask
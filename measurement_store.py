@@ -0,0 +1,428 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+A store of probe measurements: every sample of every survey, in one place, queryable.
+
+Samples are appended to columnar binary files in a directory, one little-endian file per column
+(COLUMN_DTYPE_LIST), rows of a session being contiguous.  When a session is closed, a record of its
+rows, time span, bounding rectangle and probe kinds is appended to the session index.  A query
+reads the index, then memory-maps only the rows of the sessions that could match, so answering
+"all hole-edge points near (-250, -150) from last week" does not load the rest of the store.
+
+CSV import and export keep planar_fit.py and circlefit_algebraic.py working on the stored data.
+
+    python measurement_store.py <store directory> sessions
+    python measurement_store.py <store directory> recover
+    python measurement_store.py <store directory> import <x,y[,z] CSV> <probe kind> [<session name>]
+    python measurement_store.py <store directory> export <CSV> [<probe kind> [<x> <y> <radius mm>]]
+"""
+
+import numpy as np
+import os
+import struct
+import sys
+import time
+
+
+COLUMN_DTYPE_LIST = [("x", "<f8"), ("y", "<f8"), ("z", "<f8"), ("timestamp", "<f8"), ("session", "<u4"),
+                     ("kind", "u1")]
+PROBE_KIND_LIST = ["depth", "hole_edge", "flyby", "other"]      # stored as the index into this list
+SESSION_INDEX_FILENAME = "sessions.idx"
+SESSION_RECORD_FORMAT = "<IddQQdddd32sB"    # id, start, end, first row, row count, x min, x max, y min, y max,
+                                            # name, bit mask of probe kinds
+SESSION_RECORD_SIZE = struct.calcsize(SESSION_RECORD_FORMAT)
+APPEND_BUFFER_ROWS = 4096
+
+
+class SessionInfo(object):
+    """
+    One session's record in the index.
+    """
+    def __init__(self, session_id, start_time, end_time, first_row, row_count, extent, name_str, kind_mask):
+        self.session_id = session_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.first_row = first_row
+        self.row_count = row_count
+        self.extent = extent            # (x min, x max, y min, y max)
+        self.name_str = name_str
+        self.kind_mask = kind_mask
+
+    @property
+    def kind_str_list(self):
+        return [kind_str for i, kind_str in enumerate(PROBE_KIND_LIST) if self.kind_mask & (1 << i)]
+
+    def pack(self):
+        return struct.pack(SESSION_RECORD_FORMAT, self.session_id, self.start_time, self.end_time, self.first_row,
+                           self.row_count, self.extent[0], self.extent[1], self.extent[2], self.extent[3],
+                           self.name_str[:32], self.kind_mask)
+
+    @classmethod
+    def unpack(cls, record_str):
+        field_list = struct.unpack(SESSION_RECORD_FORMAT, record_str)
+        return cls(field_list[0], field_list[1], field_list[2], field_list[3], field_list[4], field_list[5:9],
+                   field_list[9].rstrip("\x00"), field_list[10])
+
+
+class MeasurementStore(object):
+    """
+    The store in a directory, created if need be.  One session at a time may be appended to.
+
+    Opening a store only reads it: the rows of a session still being appended, by this process or another,
+    are not seen until the session is closed.  Rows left by a session that never closed, e.g. after a crash,
+    stop any new session from beginning until recover() drops them.
+    """
+    def __init__(self, directory_str):
+        assert isinstance(directory_str, str)
+        if not os.path.isdir(directory_str):
+            os.makedirs(directory_str)
+        self.__directory_str = directory_str
+        self.__session_list = []
+        self.__row_count = 0
+        self.__read_index()
+        self.__writer = None
+
+    @property
+    def directory_str(self):
+        return self.__directory_str
+
+    @property
+    def session_list(self):
+        return list(self.__session_list)
+
+    @property
+    def row_count(self):
+        return self.__row_count
+
+    def begin_session(self, name_str=""):
+        """
+        :param name_str:    a description, up to 32 characters, e.g. "table survey after leveling"
+
+        :return:    SessionWriter, to append the session's samples and then close()
+        """
+        assert self.__writer is None, "MeasurementStore.begin_session() another session is still open"
+        self.__read_index()     # for the sessions other processes closed since
+        assert 0 == self.__unindexed_row_count(), \
+            "MeasurementStore.begin_session() rows past the index: a session is still open elsewhere, " \
+            "or never closed (see recover())"
+        session_id = 1 + max([session.session_id for session in self.__session_list] + [0])
+        self.__writer = SessionWriter(self, session_id, name_str, self.__row_count)
+        return self.__writer
+
+    def recover(self):
+        """
+        Drop the rows past the last session indexed, left by a session that never closed, e.g. a crash.
+        Call only when no other process is appending to the store, as its open session would be lost.
+
+        :return:    number of rows dropped
+        """
+        assert self.__writer is None, "MeasurementStore.recover() a session is open"
+        self.__read_index()
+        dropped_row_count = self.__unindexed_row_count()
+        for name_str, dtype_str in COLUMN_DTYPE_LIST:
+            column_filename_str = self.__column_filename(name_str)
+            if os.path.exists(column_filename_str) and \
+                    self.__row_count * np.dtype(dtype_str).itemsize < os.path.getsize(column_filename_str):
+                with open(column_filename_str, "r+b") as f:
+                    f.truncate(self.__row_count * np.dtype(dtype_str).itemsize)
+        return dropped_row_count
+
+    def query(self, kind_str=None, near_xy=None, radius_mm=None, since=None, until=None, session_id_list=None):
+        """
+        Find samples.  Each criterion given narrows the result.
+
+        :param kind_str:        one of PROBE_KIND_LIST
+        :param near_xy:         (x, y), with radius_mm
+        :param radius_mm:       greatest distance from near_xy
+        :param since:           earliest timestamp (time.time()), e.g. time.time() - 7 * 24 * 3600.0
+        :param until:           latest timestamp
+        :param session_id_list: sessions to search
+
+        :return:    dict of column name to array, for the matching samples in the order appended
+        """
+        assert kind_str is None or kind_str in PROBE_KIND_LIST
+        assert (near_xy is None) == (radius_mm is None)
+        kind = None if kind_str is None else PROBE_KIND_LIST.index(kind_str)
+
+        range_list = []
+        for session in self.__session_list:
+            if session_id_list is not None and session.session_id not in session_id_list:
+                continue
+            if kind is not None and not session.kind_mask & (1 << kind):
+                continue
+            if (since is not None and session.end_time < since) or (until is not None and until < session.start_time):
+                continue
+            if near_xy is not None:
+                x_min, x_max, y_min, y_max = session.extent
+                if (near_xy[0] + radius_mm < x_min or x_max < near_xy[0] - radius_mm or
+                        near_xy[1] + radius_mm < y_min or y_max < near_xy[1] - radius_mm):
+                    continue
+            if range_list and range_list[-1][1] == session.first_row:
+                range_list[-1] = (range_list[-1][0], session.first_row + session.row_count)
+            else:
+                range_list.append((session.first_row, session.first_row + session.row_count))
+
+        column_dict = self.__memmap_columns()
+        result_list = []
+        for first, last in range_list:
+            block = dict((name_str, column[first:last]) for name_str, column in column_dict.items())
+            mask = np.ones(last - first, dtype=bool)
+            if kind is not None:
+                mask &= block["kind"] == kind
+            if since is not None:
+                mask &= since <= block["timestamp"]
+            if until is not None:
+                mask &= block["timestamp"] <= until
+            if near_xy is not None:
+                mask &= (block["x"] - near_xy[0]) ** 2 + (block["y"] - near_xy[1]) ** 2 <= radius_mm ** 2
+            result_list.append(dict((name_str, np.array(column[mask])) for name_str, column in block.items()))
+
+        return dict((name_str, np.concatenate([result[name_str] for result in result_list] +
+                                              [np.empty(0, dtype=dtype_str)]))
+                    for name_str, dtype_str in COLUMN_DTYPE_LIST)
+
+    def import_csv(self, filename_str, kind_str, name_str=None):
+        """
+        Add an x,y,z CSV (as planar_fit.py reads) or x,y CSV (as circlefit_algebraic.py reads) as a new session.
+        A sample without z gets NaN.
+
+        :param filename_str:    file name
+        :param kind_str:        one of PROBE_KIND_LIST
+        :param name_str:        session name, default the file's name
+
+        :return:    the new session's SessionInfo
+        """
+        point_list = []
+        with open(filename_str, "r") as f:
+            for line_number, line_str in enumerate(f, 1):
+                if not line_str.strip():
+                    continue
+                try:
+                    value_list = [float(v) for v in line_str.split(",")]
+                    if len(value_list) not in (2, 3):
+                        raise ValueError
+                except ValueError:
+                    raise ValueError("{0}:{1}: malformed x,y[,z] line '{2}'".format(
+                        filename_str, line_number, line_str.strip()))
+                point_list.append(value_list + [float("nan")] * (3 - len(value_list)))
+
+        timestamp = os.path.getmtime(filename_str)
+        points = np.array(point_list, dtype=np.float64).reshape(-1, 3)
+        writer = self.begin_session(os.path.basename(filename_str) if name_str is None else name_str)
+        writer.append_many(points[:, 0], points[:, 1], points[:, 2], kind_str, np.full(len(points), timestamp))
+        return writer.close()
+
+    def export_csv(self, filename_str, **query_dict):
+        """
+        Write the samples matching query(**query_dict) as an x,y,z CSV, or x,y where z is NaN.
+
+        :return:    number of samples written
+        """
+        result = self.query(**query_dict)
+        with open(filename_str, "w") as f:
+            for x, y, z in zip(result["x"].tolist(), result["y"].tolist(), result["z"].tolist()):
+                if z != z:
+                    f.write("{0:.4f},{1:.4f}\n".format(x, y))
+                else:
+                    f.write("{0:.4f},{1:.4f},{2:.4f}\n".format(x, y, z))
+        return len(result["x"])
+
+    def append_rows(self, column_dict):
+        """
+        Used by SessionWriter: append a block of rows to the column files.
+        """
+        row_count = len(column_dict["x"])
+        for name_str, dtype_str in COLUMN_DTYPE_LIST:
+            with open(self.__column_filename(name_str), "ab") as f:
+                f.write(np.ascontiguousarray(column_dict[name_str], dtype=dtype_str).tostring())
+        self.__row_count += row_count
+
+    def end_session(self, session):
+        """
+        Used by SessionWriter: record a closed session in the index.
+        """
+        if 0 < session.row_count:
+            with open(os.path.join(self.__directory_str, SESSION_INDEX_FILENAME), "ab") as f:
+                f.write(session.pack())
+            self.__session_list.append(session)
+        self.__writer = None
+
+    def __column_filename(self, name_str):
+        return os.path.join(self.__directory_str, name_str + ".bin")
+
+    def __read_index(self):
+        self.__session_list = []
+        index_filename_str = os.path.join(self.__directory_str, SESSION_INDEX_FILENAME)
+        if os.path.exists(index_filename_str):
+            with open(index_filename_str, "rb") as f:
+                index_str = f.read()
+            for offset in range(0, len(index_str) - SESSION_RECORD_SIZE + 1, SESSION_RECORD_SIZE):
+                self.__session_list.append(SessionInfo.unpack(index_str[offset:offset + SESSION_RECORD_SIZE]))
+        self.__row_count = sum([session.row_count for session in self.__session_list])
+
+    def __unindexed_row_count(self):
+        """
+        :return:    rows in the longest column file past those of the sessions indexed
+        """
+        row_count = self.__row_count
+        for name_str, dtype_str in COLUMN_DTYPE_LIST:
+            column_filename_str = self.__column_filename(name_str)
+            if os.path.exists(column_filename_str):
+                row_count = max(row_count, -(-os.path.getsize(column_filename_str) // np.dtype(dtype_str).itemsize))
+        return row_count - self.__row_count
+
+    def __memmap_columns(self):
+        column_dict = {}
+        for name_str, dtype_str in COLUMN_DTYPE_LIST:
+            if 0 == self.__row_count:
+                column_dict[name_str] = np.empty(0, dtype=dtype_str)
+            else:
+                column_dict[name_str] = np.memmap(self.__column_filename(name_str), dtype=dtype_str, mode="r",
+                                                  shape=(self.__row_count,))
+        return column_dict
+
+
+class SessionWriter(object):
+    """
+    Appends one session's samples to a MeasurementStore, a buffer at a time.
+    """
+    def __init__(self, store, session_id, name_str, first_row):
+        self.__store = store
+        self.__session_id = session_id
+        self.__name_str = name_str
+        self.__first_row = first_row
+        self.__row_count = 0
+        self.__start_time = None
+        self.__end_time = None
+        self.__extent = [np.inf, -np.inf, np.inf, -np.inf]
+        self.__kind_mask = 0
+        self.__buffer_list = []     # (x, y, z, timestamp, kind) rows
+        self.__closed = False
+
+    @property
+    def session_id(self):
+        return self.__session_id
+
+    def append(self, x, y, z, kind_str, timestamp=None):
+        """
+        :param x:           x value
+        :param y:           y value
+        :param z:           measured height, or NaN for a sample with none, e.g. a hole edge
+        :param kind_str:    one of PROBE_KIND_LIST
+        :param timestamp:   time.time() of the sample, default now
+
+        :return:    nothing
+        """
+        assert not self.__closed
+        self.__buffer_list.append((x, y, z, time.time() if timestamp is None else timestamp,
+                                   PROBE_KIND_LIST.index(kind_str)))
+        if APPEND_BUFFER_ROWS <= len(self.__buffer_list):
+            self.flush()
+
+    def append_many(self, x, y, z, kind_str, timestamp):
+        """
+        Append arrays of samples, all of one probe kind.
+
+        :return:    nothing
+        """
+        assert not self.__closed
+        self.flush()
+        x = np.asarray(x, dtype=np.float64)
+        self.__write({"x": x, "y": np.asarray(y, dtype=np.float64), "z": np.asarray(z, dtype=np.float64),
+                      "timestamp": np.asarray(timestamp, dtype=np.float64),
+                      "kind": np.full(len(x), PROBE_KIND_LIST.index(kind_str), dtype=np.uint8)})
+
+    def flush(self):
+        """
+        Write the buffered samples to the column files.
+
+        :return:    nothing
+        """
+        if self.__buffer_list:
+            rows = np.array(self.__buffer_list, dtype=np.float64)
+            self.__buffer_list = []
+            self.__write({"x": rows[:, 0], "y": rows[:, 1], "z": rows[:, 2], "timestamp": rows[:, 3],
+                          "kind": rows[:, 4].astype(np.uint8)})
+
+    def close(self):
+        """
+        Write the remaining samples and add the session to the index.
+
+        :return:    the session's SessionInfo
+        """
+        assert not self.__closed
+        self.flush()
+        self.__closed = True
+        now = time.time()
+        session = SessionInfo(self.__session_id, now if self.__start_time is None else self.__start_time,
+                              now if self.__end_time is None else self.__end_time, self.__first_row,
+                              self.__row_count, tuple(self.__extent), self.__name_str, self.__kind_mask)
+        self.__store.end_session(session)
+        return session
+
+    def __write(self, column_dict):
+        row_count = len(column_dict["x"])
+        if 0 == row_count:
+            return
+        column_dict["session"] = np.full(row_count, self.__session_id, dtype=np.uint32)
+        self.__store.append_rows(column_dict)
+
+        timestamps = column_dict["timestamp"]
+        self.__start_time = min(timestamps.min(), self.__start_time if self.__start_time is not None else np.inf)
+        self.__end_time = max(timestamps.max(), self.__end_time if self.__end_time is not None else -np.inf)
+        self.__extent = [min(self.__extent[0], column_dict["x"].min()), max(self.__extent[1], column_dict["x"].max()),
+                         min(self.__extent[2], column_dict["y"].min()), max(self.__extent[3], column_dict["y"].max())]
+        for kind in np.unique(column_dict["kind"]).tolist():
+            self.__kind_mask |= 1 << kind
+        self.__row_count += row_count
+
+
+if "__main__" == __name__:
+    if len(sys.argv) < 3 or sys.argv[2] not in ("sessions", "import", "export", "recover"):
+        print "Usage python measurement_store.py <store directory> sessions"
+        print "      python measurement_store.py <store directory> recover"
+        print "      python measurement_store.py <store directory> import <x,y[,z] CSV> <probe kind> [<session name>]"
+        print "      python measurement_store.py <store directory> export <CSV> [<probe kind> [<x> <y> <radius mm>]]"
+        print "where probe kind is one of {0}".format(", ".join(PROBE_KIND_LIST))
+        exit(1)
+
+    measurement_store = MeasurementStore(sys.argv[1])
+    if "sessions" == sys.argv[2]:
+        for session in measurement_store.session_list:
+            print "{0:4d}  {1}  {2:8d} samples  X {3:9.3f}..{4:9.3f}  Y {5:9.3f}..{6:9.3f}  {7}  {8}".format(
+                session.session_id, time.strftime("%Y-%m-%d %H:%M", time.localtime(session.start_time)),
+                session.row_count, session.extent[0], session.extent[1], session.extent[2], session.extent[3],
+                ",".join(session.kind_str_list), session.name_str)
+    elif "recover" == sys.argv[2]:
+        print "{0} rows of unclosed sessions dropped".format(measurement_store.recover())
+    elif "import" == sys.argv[2]:
+        session = measurement_store.import_csv(sys.argv[3], sys.argv[4], sys.argv[5] if 5 < len(sys.argv) else None)
+        print "Session {0}: {1} samples".format(session.session_id, session.row_count)
+    else:
+        query_dict = {}
+        if 4 < len(sys.argv):
+            query_dict["kind_str"] = sys.argv[4]
+        if 7 < len(sys.argv):
+            query_dict["near_xy"] = (float(sys.argv[5]), float(sys.argv[6]))
+            query_dict["radius_mm"] = float(sys.argv[7])
+        print "{0} samples written".format(measurement_store.export_csv(sys.argv[3], **query_dict))
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+AXIS_NAME_LIST = ["x", "y", "z"]
+POSITION_TOLERANCE_MM = 0.0005  # commands are sent with 3 decimals, so closer than this is the same place
+
+
+class QueuedMove(object):
+    """
+    A straight G00 or G01 move to the axis values in axis_dict, e.g. {"x": -10.0, "y": -20.0}.
+    """
+    def __init__(self, kind_str, axis_dict, speed_mm_s, start):
+        assert kind_str in ("G00", "G01")
+        assert isinstance(axis_dict, dict) and 0 < len(axis_dict)
+        assert all([axis_str in AXIS_NAME_LIST for axis_str in axis_dict])
+        self.__kind_str = kind_str
+        self.__axis_dict = dict(axis_dict)
+        self.__speed_mm_s = speed_mm_s
+        self.__start = start
+        self.__end = tuple(axis_dict.get(axis_str, s) for axis_str, s in zip(AXIS_NAME_LIST, start))
+
+    @property
+    def kind_str(self):
+        return self.__kind_str
+
+    @property
+    def axis_dict(self):
+        return self.__axis_dict
+
+    @property
+    def speed_mm_s(self):       # None for G00
+        return self.__speed_mm_s
+
+    @property
+    def start(self):            # (x, y, z), None where unknown
+        return self.__start
+
+    @property
+    def end(self):              # (x, y, z), None where unknown
+        return self.__end
+
+    @property
+    def delta(self):            # (dx, dy, dz), or None if the start is not fully known
+        if None in self.__start or None in self.__end:
+            return None
+        return tuple(e - s for s, e in zip(self.__start, self.__end))
+
+    def moving_axis_list(self):
+        """
+        :return:    names of the axes this move changes (all commanded axes if the start is unknown)
+        """
+        return [axis_str for axis_str, s, e in zip(AXIS_NAME_LIST, self.__start, self.__end)
+                if axis_str in self.__axis_dict and (s is None or abs(e - s) > POSITION_TOLERANCE_MM)]
+
+
+class MotionQueue(object):
+    """
+    Holds back the most recent move so it can be merged with the next one, reducing the number of
+    commands (serial round trips and planner blocks) sent to the controller.
+
+    A move is merged into the pending one when both are the same kind at the same speed and either
+
+        - it continues in the same direction (collinear), or
+        - merge_corners is True, and they are single-axis X and Y moves on different axes,
+          e.g. move_x() then move_y() becomes one move_xy().  The tool then cuts the corner.
+
+    Z is never combined with X or Y, so the tool is always raised or lowered separately from a
+    traverse.  Moves that would not change the position are dropped.
+
+    The pending move must be flushed before anything depends on the tool having arrived, e.g. a
+    sensor reading.  Positions are tracked from the moves themselves: forget_position() must be
+    called when anything else moves the tool or changes the coordinate system.
+    """
+    def __init__(self, merge_corners=True):
+        assert isinstance(merge_corners, bool)
+        self.__merge_corners = merge_corners
+        self.__position = (None, None, None)    # end of the last move added
+        self.__pending = None
+        self.__added_count = 0
+        self.__emitted_count = 0
+        self.__dropped_count = 0
+        self.__merged_count = 0
+
+    @property
+    def position(self):         # where the moves added so far leave the tool, None where unknown
+        return self.__position
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    @property
+    def added_count(self):
+        return self.__added_count
+
+    @property
+    def emitted_count(self):
+        return self.__emitted_count
+
+    @property
+    def dropped_count(self):
+        return self.__dropped_count
+
+    @property
+    def merged_count(self):
+        return self.__merged_count
+
+    def forget_position(self):
+        """
+        The tool position is no longer known, e.g. after homing or changing the coordinate system.
+        The pending move must already have been flushed.
+
+        :return:    nothing
+        """
+        assert self.__pending is None
+        self.__position = (None, None, None)
+
+    def add(self, kind_str, axis_dict, speed_mm_s=None):
+        """
+        Add a move.
+
+        :param kind_str:    "G00" or "G01"
+        :param axis_dict:   axis name to target value, e.g. {"x": -10.0}
+        :param speed_mm_s:  speed for G01, None for G00
+
+        :return:    list of QueuedMoves that must be sent now (the previously pending move if this
+                    one could not be merged with it)
+        """
+        move = QueuedMove(kind_str, axis_dict, speed_mm_s, self.__position)
+        self.__added_count += 1
+
+        if 0 == len(move.moving_axis_list()):
+            self.__dropped_count += 1
+            return []
+
+        self.__position = move.end
+
+        if self.__pending is not None and self.__can_merge(self.__pending, move):
+            merged_axis_dict = dict(self.__pending.axis_dict)
+            merged_axis_dict.update(move.axis_dict)
+            self.__pending = QueuedMove(kind_str, merged_axis_dict, speed_mm_s, self.__pending.start)
+            self.__merged_count += 1
+            return []
+
+        emit_list = self.flush()
+        self.__pending = move
+        return emit_list
+
+    def flush(self):
+        """
+        :return:    list of QueuedMoves that must be sent now, i.e. the pending move, if any
+        """
+        if self.__pending is None:
+            return []
+        emit_list = [self.__pending]
+        self.__pending = None
+        self.__emitted_count += 1
+        return emit_list
+
+    def __can_merge(self, first, second):
+        if first.kind_str != second.kind_str or first.speed_mm_s != second.speed_mm_s:
+            return False
+
+        first_axis_list = first.moving_axis_list()
+        second_axis_list = second.moving_axis_list()
+        if ("z" in first_axis_list) != ("z" in second_axis_list):
+            return False
+
+        is_corner = (1 == len(first_axis_list) and 1 == len(second_axis_list) and
+                     "z" not in first_axis_list and first_axis_list != second_axis_list)
+        if self.__merge_corners and is_corner:
+            return True
+
+        first_delta = first.delta
+        second_delta = second.delta
+        if first_delta is None or second_delta is None:
+            return False
+
+        dot = sum(f * s for f, s in zip(first_delta, second_delta))
+        first_length_sq = sum(f * f for f in first_delta)
+        second_length_sq = sum(s * s for s in second_delta)
+        # Same direction: the angle between them is near 0 (cos > 1 - 1e-9)
+        return 0.0 < dot and dot * dot >= (1.0 - 1e-9) * first_length_sq * second_length_sq
@@ -19,12 +19,14 @@
         OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import itertools
 import math
 import numpy as np
 import sys
 
 
 EPSILON = 0.0001
+NOISE_STD_MM = 0.01     # assumed probe repeatability, until there are enough probes to estimate it
 
 LFTMOST_X = -420.0
 RGTMOST_X = 0.0
@@ -41,41 +43,163 @@ def get_z(coeffs, x, y):
     """
     Calculate and return the height z given the coefficients and ordinates of ax + by + c = z
 
-    :param coeffs:  numpy ndarray of coefficients a, b, c, in the order (c, a, b)
-    :param x:       x value
-    :param y:       y vakye
+    :param coeffs:  coefficients (a, b, c), or an (K, 3) array of K coefficient sets
+    :param x:       x value, or array of x values
+    :param y:       y value, or array of y values
 
-    :return:    the calculated z value
+    :return:    the calculated z value; for arrays, z for every point (shape (K, N) given K coefficient sets)
     """
-    assert isinstance(coeffs, tuple) and 3 == len(coeffs)
-    assert all([isinstance(v, float) for v in coeffs])
-    assert isinstance(x, float)
-    assert isinstance(y, float)
+    assert 3 == np.shape(coeffs)[-1]
 
-    a, b, c = coeffs
-    z = a*x + b*y + c
-    # print z
+    if isinstance(x, float) and isinstance(y, float) and 1 == np.ndim(coeffs):
+        a, b, c = coeffs
+        return a*x + b*y + c
 
-    return z
+    coeffs = np.asarray(coeffs, dtype=np.float64)
+    if 2 == coeffs.ndim:
+        coeffs = coeffs[:, np.newaxis, :]
+    return coeffs[..., 0] * np.asarray(x, dtype=np.float64) + coeffs[..., 1] * np.asarray(y, dtype=np.float64) + \
+        coeffs[..., 2]
 
 
-def get_z_by_name(name_str):
+class MountPoints(object):
     """
-    Get z adjust value for mount hole (x, y) tuple matching name_str
+    Named table mount points, as arrays, with lookup by name.
+    """
+    def __init__(self, name_str_list, x_list, y_list):
+        assert len(name_str_list) == len(x_list) == len(y_list)
+        assert len(set(name_str_list)) == len(name_str_list), "MountPoints() duplicate mount name"
+        self.__name_str_list = list(name_str_list)
+        self.__x = np.array(x_list, dtype=np.float64)
+        self.__y = np.array(y_list, dtype=np.float64)
+        self.__index_dict = dict((name_str, i) for i, name_str in enumerate(self.__name_str_list))
+
+    @property
+    def name_str_list(self):
+        return list(self.__name_str_list)
+
+    @property
+    def x(self):
+        return self.__x
+
+    @property
+    def y(self):
+        return self.__y
+
+    def __len__(self):
+        return len(self.__name_str_list)
+
+    def index(self, name_str):
+        """
+        :param name_str:    a mount's name, e.g. "back-left"
+
+        :return:    the mount's position in the arrays
+        """
+        assert name_str in self.__index_dict, "MountPoints.index() no mount named {0}".format(name_str)
+        return self.__index_dict[name_str]
+
+
+def table_mount_points():
+    """
+    The mounting hole (pair) locations of the table: the 4 corners, the middles of its sides, and its middle.
+
+    :return:    MountPoints
+    """
+    rgt_x = RGTMOST_X + RGTMOST_MOUNT_OFFSET_X
+    lft_x = LFTMOST_X + LFTMOST_MOUNT_OFFSET_X
+    back_y = BACKMOST_Y + BACKMOST_MOUNT_OFFSET_Y
+    frnt_y = FRNTMOST_Y + FRNTMOST_MOUNT_OFFSET_Y
+    midl_x = (lft_x + rgt_x) / 2.0
+    midl_y = (back_y + frnt_y) / 2.0
+
+    return MountPoints(["back-right", "middle-back", "back-left", "middle-left", "front-left", "middle-front",
+                        "front-right", "middle-right", "table-middle"],
+                       [rgt_x, midl_x, lft_x, lft_x, lft_x, midl_x, rgt_x, rgt_x, midl_x],
+                       [back_y, back_y, back_y, midl_y, frnt_y, frnt_y, frnt_y, midl_y, midl_y])
+
+
+class LevelingResult(object):
+    """
+    The result of level_table(), for one coefficient set or K of them (every array then has a leading K axis).
+    """
+    def __init__(self, coeffs, mount_points, mount_z, relative_coeffs, thickness_diff_x, thickness_diff_y):
+        self.__coeffs = coeffs
+        self.__mount_points = mount_points
+        self.__mount_z = mount_z
+        self.__relative_coeffs = relative_coeffs
+        self.__thickness_diff_x = thickness_diff_x
+        self.__thickness_diff_y = thickness_diff_y
+
+    @property
+    def coeffs(self):               # (a, b, c) of the measured surface
+        return self.__coeffs
+
+    @property
+    def mount_points(self):
+        return self.__mount_points
+
+    @property
+    def mount_z(self):              # surface height at each mount point
+        return self.__mount_z
+
+    @property
+    def relative_coeffs(self):      # (a, b, c) relative to the highest mount point
+        return self.__relative_coeffs
+
+    @property
+    def adjustments(self):          # how far to raise the table at each mount point, >= 0
+        return np.abs(get_z(self.__relative_coeffs, self.__mount_points.x, self.__mount_points.y))
+
+    @property
+    def thickness_diff_x(self):     # thickness difference across a 100 mm round part, left-right
+        return self.__thickness_diff_x
+
+    @property
+    def thickness_diff_y(self):     # thickness difference across a 100 mm round part, back-front
+        return self.__thickness_diff_y
+
+    @property
+    def thickness_diff_diagonal(self):
+        return np.sqrt(self.__thickness_diff_x**2 + self.__thickness_diff_y**2)
+
+    def adjustment(self, name_str):
+        """
+        :param name_str:    a mount's name, e.g. "back-left"
 
-    :param name_str:    str matching one of table_mount_point_list's 2nd arg
+        :return:    how far to raise the table at that mount point (an array of K given K coefficient sets)
+        """
+        return self.adjustments[..., self.__mount_points.index(name_str)]
 
-    Note: table_mount_point_list should already be defined by the time
-            this function is called.
 
-    :return:    z
+def level_table(coeffs, mount_points=None):
     """
-    assert isinstance(name_str, str)
-    match_list = [v[0] for v in table_mount_point_list if v[1] == name_str]
-    assert 1 == len(match_list)
-    x, y = match_list[0]
-    z = abs(get_z(coeffs, x, y))
-    return z
+    Work out how far to raise the table at each mount point to make it parallel to the tool travel.
+
+    The highest mount point is the basis for adjustment, since we assume that we can't lower the highest
+    point, only raise the lower mounting points.
+
+    :param coeffs:          (a, b, c) of the measured surface, or a (K, 3) array of K coefficient sets
+    :param mount_points:    MountPoints, default table_mount_points()
+
+    :return:    LevelingResult
+    """
+    mount_points = table_mount_points() if mount_points is None else mount_points
+    assert isinstance(mount_points, MountPoints) and 0 < len(mount_points)
+    coeffs = np.array(coeffs, dtype=np.float64)
+    assert coeffs.ndim in (1, 2) and 3 == coeffs.shape[-1]
+
+    mount_z = get_z(coeffs, mount_points.x, mount_points.y)
+    relative_coeffs = coeffs.copy()
+    relative_coeffs[..., 2] -= mount_z.max(axis=-1)
+
+    # A part's thickness difference follows the slope between the table's corner mounts, over the tool travel
+    corner_points = table_mount_points()
+    span_x = corner_points.x[corner_points.index("front-left")] - corner_points.x[corner_points.index("front-right")]
+    span_y = corner_points.y[corner_points.index("front-left")] - corner_points.y[corner_points.index("back-left")]
+    thickness_diff_x = 100.0 * np.abs(coeffs[..., 0] * span_x) / abs(LFTMOST_X - RGTMOST_X)
+    thickness_diff_y = 100.0 * np.abs(coeffs[..., 1] * span_y) / abs(FRNTMOST_Y - BACKMOST_Y)
+
+    return LevelingResult(coeffs, mount_points, mount_z, relative_coeffs, thickness_diff_x, thickness_diff_y)
 
 
 def get_inputs(depthdata_str_list):
@@ -133,6 +257,118 @@ def read_data_file(filename_str):
     return record_list
 
 
+def read_depth_array(filename_str, skip_malformed=False):
+    """
+    Read an x,y,z CSV file, like read_data_file() and get_inputs() together, straight into an array.
+    Blank lines are ignored.
+
+    :param filename_str:    file name
+    :param skip_malformed:  if True, report malformed lines and leave them out; if False, raise ValueError
+
+    :return:    (N, 3) float64 array of x, y, z
+    """
+    assert isinstance(filename_str, str)
+
+    try:
+
+        with open(filename_str, "r") as file_depth_data:
+            text_str = file_depth_data.read()
+
+    except IOError:
+        print "Could not open file named {0}".format(filename_str)
+        exit()
+
+    return parse_depth_text(text_str, 1, filename_str, skip_malformed)
+
+
+def read_depth_chunks(filename_str, chunk_line_count=1000000, skip_malformed=False):
+    """
+    Read an x,y,z CSV file too large to hold at once, e.g. a long fly-by scan log, a chunk of lines at a time.
+
+    :param filename_str:        file name
+    :param chunk_line_count:    lines per chunk
+    :param skip_malformed:      see read_depth_array()
+
+    :return:    generator of (M, 3) float64 arrays of x, y, z
+    """
+    assert isinstance(chunk_line_count, int) and 0 < chunk_line_count
+
+    with open(filename_str, "r") as file_depth_data:
+        first_line_number = 1
+        while True:
+            line_str_list = list(itertools.islice(file_depth_data, chunk_line_count))
+            if not line_str_list:
+                break
+            yield parse_depth_text("".join(line_str_list), first_line_number, filename_str, skip_malformed)
+            first_line_number += len(line_str_list)
+
+
+def parse_depth_text(text_str, first_line_number=1, filename_str="", skip_malformed=False):
+    """
+    Parse x,y,z lines.  Well-formed text is parsed in one vectorized pass; only if that finds a
+    problem is the text parsed line by line, to find which lines are malformed.
+
+    This falls short of parsing millions of lines in a fraction of a second: 2 million lines take 1.1 to
+    1.5 s, about 1 s of it in np.fromstring() converting the numbers, which no NumPy call here does faster.
+    That is 2 to 3 times faster than line by line.
+
+    :param text_str:            lines of the file
+    :param first_line_number:   line number of the first line, for reporting
+    :param filename_str:        file name, for reporting
+    :param skip_malformed:      see read_depth_array()
+
+    :return:    (N, 3) float64 array of x, y, z
+    """
+    if not text_str.endswith("\n"):
+        text_str += "\n"
+    text_bytes = np.frombuffer(text_str, dtype=np.uint8)
+    is_newline = text_bytes == ord("\n")
+    is_comma = text_bytes == ord(",")
+    is_token = ~(is_newline | is_comma | (text_bytes == ord(" ")) | (text_bytes == ord("\t")) |
+                 (text_bytes == ord("\r")))
+
+    # Each line must be blank, or token,token,token with white space anywhere but inside a token: "1,2,3 4\n5,6,\n"
+    # has the right numbers of commas and of values, but not per line.  So check the sequence of token starts,
+    # commas and newlines
+    is_token_start = is_token & ~np.concatenate(([False], is_token[:-1]))
+    event_kinds = text_bytes[np.flatnonzero(is_comma | is_newline | is_token_start)]
+    previous_kinds = np.concatenate(([ord("\n")], event_kinds[:-1]))
+    is_token_event = (ord(",") != event_kinds) & (ord("\n") != event_kinds)
+    is_previous_token = (ord(",") != previous_kinds) & (ord("\n") != previous_kinds)
+    is_newline_event = ord("\n") == event_kinds
+    token_counts = np.diff(np.concatenate(([0], np.cumsum(is_token_event)[is_newline_event])))
+
+    if not np.any(is_token_event & is_previous_token) and \
+            np.all(is_previous_token[ord(",") == event_kinds]) and \
+            not np.any(is_newline_event & (ord(",") == previous_kinds)) and \
+            np.all((0 == token_counts) | (3 == token_counts)):
+        values = np.fromstring(text_str.replace(",", " "), dtype=np.float64, sep=" ")
+        if len(values) == 3 * np.count_nonzero(token_counts):
+            return values.reshape(-1, 3)
+
+    point_list = []
+    malformed_list = []
+    for i, line_str in enumerate(text_str.splitlines()):
+        str_list = line_str.split(",")
+        try:
+            if 3 != len(str_list):
+                raise ValueError
+            point_list.append([float(v) for v in str_list])
+        except ValueError:
+            if line_str.strip():
+                malformed_list.append((first_line_number + i, line_str))
+
+    for line_number, line_str in malformed_list[:10]:
+        print "{0}:{1}: malformed x,y,z line '{2}'".format(filename_str, line_number, line_str.strip())
+    if 10 < len(malformed_list):
+        print "{0}: {1} more malformed lines".format(filename_str, len(malformed_list) - 10)
+    if malformed_list and not skip_malformed:
+        raise ValueError("{0}: {1} malformed x,y,z lines, the first at line {2}".format(
+            filename_str, len(malformed_list), malformed_list[0][0]))
+
+    return np.array(point_list, dtype=np.float64).reshape(-1, 3)
+
+
 def planar_least_sqauares_fit(x_list, y_list, z_list):
     determinant = np.column_stack((np.ones(len(x_list)), x_list, y_list))
     coeffs, residuals, rank, sigma = np.linalg.lstsq(determinant, z_list)
@@ -143,12 +379,311 @@ def planar_least_sqauares_fit(x_list, y_list, z_list):
     return coeffs
 
 
+class RobustPlaneFit(object):
+    """
+    Result of ransac_plane_fit() or irls_plane_fit().
+    """
+    def __init__(self, coeffs, residuals, inlier_mask, scale_mm, iteration_count):
+        self.__coeffs = coeffs
+        self.__residuals = residuals
+        self.__inlier_mask = inlier_mask
+        self.__scale_mm = scale_mm
+        self.__iteration_count = iteration_count
+
+    @property
+    def coeffs(self):           # (a, b, c), as from planar_least_sqauares_fit()
+        return self.__coeffs
+
+    @property
+    def residuals(self):        # z - (ax + by + c) for every point
+        return self.__residuals
+
+    @property
+    def inlier_mask(self):      # True for the points the fit kept
+        return self.__inlier_mask
+
+    @property
+    def outlier_count(self):
+        return int(len(self.__inlier_mask) - np.count_nonzero(self.__inlier_mask))
+
+    @property
+    def scale_mm(self):         # robust estimate of the inliers' residual standard deviation
+        return self.__scale_mm
+
+    @property
+    def iteration_count(self):  # RANSAC hypotheses drawn, or IRLS iterations run
+        return self.__iteration_count
+
+
+def __as_point_arrays(x_list, y_list, z_list):
+    x = np.asarray(x_list, dtype=np.float64)
+    y = np.asarray(y_list, dtype=np.float64)
+    z = np.asarray(z_list, dtype=np.float64)
+    assert 1 == x.ndim and x.shape == y.shape == z.shape and 3 <= len(x)
+    return x, y, z
+
+
+def __weighted_plane_fit(x, y, z, w):
+    """
+    Weighted least squares plane through the points, from the 3x3 normal equations of the
+    points centered on their weighted mean.
+
+    :return:    (a, b, c)
+    """
+    w_sum = w.sum()
+    mx, my, mz = w.dot(x) / w_sum, w.dot(y) / w_sum, w.dot(z) / w_sum
+    dx, dy, dz = x - mx, y - my, z - mz
+    wdx, wdy = w * dx, w * dy
+    a, b = np.linalg.lstsq(np.array([[wdx.dot(dx), wdx.dot(dy)], [wdx.dot(dy), wdy.dot(dy)]]),
+                           np.array([wdx.dot(dz), wdy.dot(dz)]), rcond=None)[0]
+    return float(a), float(b), float(mz - a * mx - b * my)
+
+
+def __mad_scale(residuals):
+    return 1.4826 * float(np.median(np.abs(residuals - np.median(residuals))))
+
+
+def ransac_plane_fit(x_list, y_list, z_list, threshold_mm=0.05, hypothesis_count=500, score_point_count=4096,
+                     seed=0):
+    """
+    Plane fit that ignores outliers, e.g. a contact reading off a chip, a fold of foil or a threaded hole.
+
+    Planes through hypothesis_count random triples of points are computed and scored all at once
+    as arrays, each by how many of a random subset of score_point_count points lie within threshold_mm.
+    The best is then refit by least squares to all the points within threshold_mm of it, twice.
+
+    :param x_list:              x values
+    :param y_list:              y values
+    :param z_list:              measured heights
+    :param threshold_mm:        largest residual of an inlier
+    :param hypothesis_count:    random triples tried
+    :param score_point_count:   points each hypothesis is scored on
+    :param seed:                random seed, so results repeat
+
+    :return:    RobustPlaneFit
+    """
+    assert isinstance(threshold_mm, float) and 0.0 < threshold_mm
+    x, y, z = __as_point_arrays(x_list, y_list, z_list)
+    random_state = np.random.RandomState(seed)
+
+    triples = random_state.randint(0, len(x), size=(hypothesis_count, 3))
+    p = np.stack((x[triples], y[triples], z[triples]), axis=-1)    # (hypotheses, 3 points, xyz)
+    normal = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    valid = np.abs(normal[:, 2]) > EPSILON * np.linalg.norm(normal, axis=1)    # not degenerate, not vertical
+    normal, p0 = normal[valid], p[valid, 0]
+    assert 0 < len(normal), "ransac_plane_fit() all sampled points are in a line"
+    a = -normal[:, 0] / normal[:, 2]
+    b = -normal[:, 1] / normal[:, 2]
+    c = p0[:, 2] - a * p0[:, 0] - b * p0[:, 1]
+
+    score_index = random_state.choice(len(x), size=min(score_point_count, len(x)), replace=False)
+    score_residuals = z[score_index] - (np.outer(a, x[score_index]) + np.outer(b, y[score_index]) + c[:, None])
+    best = int(np.argmax(np.count_nonzero(np.abs(score_residuals) <= threshold_mm, axis=1)))
+
+    coeffs = (float(a[best]), float(b[best]), float(c[best]))
+    for i in range(2):
+        inlier_mask = np.abs(z - (coeffs[0] * x + coeffs[1] * y + coeffs[2])) <= threshold_mm
+        coeffs = __weighted_plane_fit(x[inlier_mask], y[inlier_mask], z[inlier_mask],
+                                      np.ones(np.count_nonzero(inlier_mask)))
+    residuals = z - (coeffs[0] * x + coeffs[1] * y + coeffs[2])
+    inlier_mask = np.abs(residuals) <= threshold_mm
+
+    return RobustPlaneFit(coeffs, residuals, inlier_mask, __mad_scale(residuals[inlier_mask]), hypothesis_count)
+
+
+def irls_plane_fit(x_list, y_list, z_list, loss_str="tukey", initial_coeffs=None, max_iterations=50,
+                   tolerance=1e-9):
+    """
+    Plane fit by iteratively reweighted least squares, which down-weights (Huber) or rejects (Tukey)
+    points with large residuals, relative to a robust (median absolute deviation) residual scale.
+
+    :param x_list:          x values
+    :param y_list:          y values
+    :param z_list:          measured heights
+    :param loss_str:        "huber" or "tukey"
+    :param initial_coeffs:  (a, b, c) to start from, e.g. ransac_plane_fit().coeffs; by default least squares
+                            for Huber, and the Huber fit for Tukey, which needs a good start
+    :param max_iterations:  limit on reweighting passes
+    :param tolerance:       stop once no coefficient changes by more than this
+
+    :return:    RobustPlaneFit; inliers are within 3 scales (Huber) or given any weight (Tukey)
+    """
+    assert loss_str in ("huber", "tukey")
+    x, y, z = __as_point_arrays(x_list, y_list, z_list)
+    tuning = 1.345 if "huber" == loss_str else 4.685    # 95% efficiency for normally distributed errors
+
+    if initial_coeffs is not None:
+        coeffs = initial_coeffs
+    elif "huber" == loss_str:
+        coeffs = __weighted_plane_fit(x, y, z, np.ones(len(x)))
+    else:
+        coeffs = irls_plane_fit(x, y, z, "huber", max_iterations=max_iterations, tolerance=tolerance).coeffs
+    iteration_count = 0
+    scale_mm = 0.0
+    while iteration_count < max_iterations:
+        iteration_count += 1
+        residuals = z - (coeffs[0] * x + coeffs[1] * y + coeffs[2])
+        scale_mm = __mad_scale(residuals)
+        if scale_mm <= 0.0:
+            break           # more than half the points are exactly on the plane
+        u = np.abs(residuals) / (tuning * scale_mm)
+        if "huber" == loss_str:
+            w = 1.0 / np.maximum(u, 1.0)
+        else:
+            w = np.where(u < 1.0, (1.0 - u**2)**2, 0.0)
+        new_coeffs = __weighted_plane_fit(x, y, z, w)
+        converged = max([abs(n - o) for n, o in zip(new_coeffs, coeffs)]) <= tolerance
+        coeffs = new_coeffs
+        if converged:
+            break
+
+    residuals = z - (coeffs[0] * x + coeffs[1] * y + coeffs[2])
+    inlier_limit_mm = (3.0 if "huber" == loss_str else tuning) * scale_mm
+    inlier_mask = np.abs(residuals) <= inlier_limit_mm if 0.0 < scale_mm else residuals == 0.0
+
+    return RobustPlaneFit(coeffs, residuals, inlier_mask, scale_mm, iteration_count)
+
+
+class IncrementalPlaneFit(object):
+    """
+    Least squares fit of the plane ax + by + c = z, updated one measurement at a time while probing,
+    instead of refitting every measurement with planar_least_sqauares_fit() when all are on disk.
+
+    Keeps the means and centered sums of products of x, y, z (Welford's method), so each update
+    is O(1) and the sums stay well conditioned even though the table's x and y are hundreds of mm
+    from (0, 0).  The coefficients and their covariance are available after any update.
+    """
+    def __init__(self):
+        self.__count = 0
+        self.__mean = np.zeros(3)           # of (x, y, z)
+        self.__comoment = np.zeros((3, 3))  # sums of products of (x, y, z) deviations from the mean
+
+    @property
+    def count(self):
+        return self.__count
+
+    def add(self, x, y, z):
+        """
+        Add one measurement.
+
+        :param x:   x value
+        :param y:   y value
+        :param z:   measured height z
+
+        :return:    nothing
+        """
+        assert isinstance(x, float)
+        assert isinstance(y, float)
+        assert isinstance(z, float)
+
+        point = np.array((x, y, z))
+        self.__count += 1
+        delta = point - self.__mean
+        self.__mean += delta / self.__count
+        self.__comoment += np.outer(delta, point - self.__mean)
+
+    def add_many(self, x_list, y_list, z_list):
+        """
+        Add a batch of measurements at once, e.g. a pass of a fly-by scan.
+
+        :param x_list:  x values
+        :param y_list:  y values
+        :param z_list:  measured heights
+
+        :return:    nothing
+        """
+        points = np.column_stack((x_list, y_list, z_list)).astype(np.float64)
+        if 0 == len(points):
+            return
+
+        count = len(points)
+        mean = points.mean(axis=0)
+        deviations = points - mean
+        total_count = self.__count + count
+        delta = mean - self.__mean
+        self.__comoment += deviations.T.dot(deviations) + np.outer(delta, delta) * self.__count * count / total_count
+        self.__mean += delta * count / total_count
+        self.__count = total_count
+
+    @property
+    def coeffs(self):
+        """
+        :return:    the current fit (a, b, c), or None before 3 measurements not all on a line
+        """
+        slopes = self.__slopes()
+        if slopes is None:
+            return None
+        a, b = slopes
+        c = self.__mean[2] - a * self.__mean[0] - b * self.__mean[1]
+        return float(a), float(b), float(c)
+
+    @property
+    def residual_std_mm(self):
+        """
+        :return:    standard deviation of the measurements about the fitted plane, or None before 4 measurements
+        """
+        slopes = self.__slopes()
+        if slopes is None or self.__count <= 3:
+            return None
+        sum_squares = self.__comoment[2, 2] - slopes.dot(self.__comoment[:2, 2])
+        return math.sqrt(max(sum_squares, 0.0) / (self.__count - 3))
+
+    @property
+    def covariance(self):
+        """
+        :return:    3x3 covariance matrix of (a, b, c), or None before 4 measurements
+        """
+        residual_std_mm = self.residual_std_mm
+        if residual_std_mm is None:
+            return None
+        slope_covariance = residual_std_mm**2 * np.linalg.inv(self.__comoment[:2, :2])
+        mean_xy = self.__mean[:2]
+
+        covariance = np.empty((3, 3))
+        covariance[:2, :2] = slope_covariance
+        covariance[:2, 2] = covariance[2, :2] = -slope_covariance.dot(mean_xy)
+        covariance[2, 2] = residual_std_mm**2 / self.__count + mean_xy.dot(slope_covariance).dot(mean_xy)
+        return covariance
+
+    def is_stable(self, slope_tolerance=1e-5, min_count=6, noise_std_mm=NOISE_STD_MM, min_dof=10):
+        """
+        Whether the tilt is known well enough to stop probing: the standard errors of a and b are both
+        below slope_tolerance (1e-5 is 0.001 mm per 100 mm).  The residual standard deviation of a few
+        measurements can be small by chance, so until there are min_dof of them beyond 3 the larger of it
+        and noise_std_mm is used.
+
+        :param slope_tolerance: largest acceptable standard error of a and of b
+        :param min_count:       fewest measurements to trust the error estimate
+        :param noise_std_mm:    probe repeatability to assume, the least standard deviation used before min_dof
+        :param min_dof:         residual degrees of freedom (measurements - 3) to trust the fit's standard
+                                deviation alone
+
+        :return:    True if stable
+        """
+        assert isinstance(slope_tolerance, float) and 0.0 < slope_tolerance
+        assert isinstance(noise_std_mm, float) and 0.0 <= noise_std_mm
+        assert isinstance(min_dof, int) and 1 <= min_dof
+        residual_std_mm = self.residual_std_mm
+        if residual_std_mm is None or self.__count < min_count:
+            return False
+        if self.__count - 3 < min_dof:
+            residual_std_mm = max(noise_std_mm, residual_std_mm)
+        slope_variances = residual_std_mm**2 * np.diag(np.linalg.inv(self.__comoment[:2, :2]))
+        return math.sqrt(slope_variances[0]) < slope_tolerance and math.sqrt(slope_variances[1]) < slope_tolerance
+
+    def __slopes(self):
+        if self.__count < 3:
+            return None
+        xy_comoment = self.__comoment[:2, :2]
+        if np.linalg.det(xy_comoment) <= EPSILON**2 * np.trace(xy_comoment)**2:
+            return None     # measurements all on a line, or nearly
+        return np.linalg.solve(xy_comoment, self.__comoment[:2, 2])
+
+
 if "__main__" == __name__:
     filename_str = sys.argv[1] if 1 < len(sys.argv) else "depth_data.csv"
 
-    record_list = read_data_file(filename_str)
-
-    x_list, y_list, z_list = get_inputs(record_list)
+    x_list, y_list, z_list = read_depth_array(filename_str).T
 
     measured_coeffs = planar_least_sqauares_fit(x_list, y_list, z_list)
     a, b, c = measured_coeffs
@@ -167,50 +702,33 @@ if "__main__" == __name__:
     print
     print "Measurement minima and maxima:"
     print
-    print "X: min({:.3f}), max({:.3f})".format(min(x_list), max(x_list))
-    print "Y: min({:.3f}), max({:.3f})".format(min(y_list), max(y_list))
-    print "Z: min({:.3f}), max({:.3f})".format(min(z_list), max(z_list))
+    print "X: min({:.3f}), max({:.3f})".format(x_list.min(), x_list.max())
+    print "Y: min({:.3f}), max({:.3f})".format(y_list.min(), y_list.max())
+    print "Z: min({:.3f}), max({:.3f})".format(z_list.min(), z_list.max())
     print
 
-    if abs(LFTMOST_X - min(x_list)) > EPSILON:
+    if abs(LFTMOST_X - x_list.min()) > EPSILON:
         print "Warning: No measurement taken at left extrema (:.3f).".format(LFTMOST_X)
-    if abs(RGTMOST_X - max(x_list)) > EPSILON:
+    if abs(RGTMOST_X - x_list.max()) > EPSILON:
         print "Warning: No measurement taken at right extrema ({:.3f}).".format(RGTMOST_X)
-    if abs(BACKMOST_Y - max(y_list)) > EPSILON:
+    if abs(BACKMOST_Y - y_list.max()) > EPSILON:
         print "Warning: No measurement taken at back extrema (:.3f).".format(BACKMOST_Y)
-    if abs(FRNTMOST_Y - min(y_list)) > EPSILON:
+    if abs(FRNTMOST_Y - y_list.min()) > EPSILON:
         print "Warning: No measurement taken at front extrema. (:.3f)".format(FRNTMOST_Y)
 
-    # Calculate the locations of the mounting holes in the table's 4 corners
-    frnt_rgt = ((RGTMOST_X + RGTMOST_MOUNT_OFFSET_X, FRNTMOST_Y + FRNTMOST_MOUNT_OFFSET_Y), "front-right")
-    back_rgt = ((RGTMOST_X + RGTMOST_MOUNT_OFFSET_X, BACKMOST_Y + BACKMOST_MOUNT_OFFSET_Y), "back-right")
-    back_lft = ((LFTMOST_X + LFTMOST_MOUNT_OFFSET_X, BACKMOST_Y + BACKMOST_MOUNT_OFFSET_Y), "back-left")
-    frnt_lft = ((LFTMOST_X + LFTMOST_MOUNT_OFFSET_X, FRNTMOST_Y + FRNTMOST_MOUNT_OFFSET_Y), "front-left")
-
-    # The maximum height of the 4 corner mounting points is used as the basis for adjustment,
-    # since we assume that we can't lower the highest point, only raise the lower mounting points.
-    #
-    z_fr = get_z(measured_coeffs, frnt_rgt[0][0], frnt_rgt[0][1])
-    z_br = get_z(measured_coeffs, back_rgt[0][0], back_rgt[0][1])
-    z_bl = get_z(measured_coeffs, back_lft[0][0], back_lft[0][1])
-    z_fl = get_z(measured_coeffs, frnt_lft[0][0], frnt_lft[0][1])
-
-    diff_rl_100mm = 100.0 * max(abs(z_fl - z_fr), abs(z_bl - z_br)) / abs(LFTMOST_X - RGTMOST_X)
-    diff_fb_100mm = 100.0 * max(abs(z_fl - z_bl), abs(z_fr - z_br)) / abs(FRNTMOST_Y - BACKMOST_Y)
-    diff_diag_100 = math.sqrt(diff_rl_100mm**2 + diff_fb_100mm**2)
+    leveling = level_table(measured_coeffs)
 
     print
     print
     print "A 100 mm diameter round part made with the current table will have different thicknesses."
-    print "In the X direction (left-right), there will be a {:.3f} mm thickness difference.".format(diff_rl_100mm)
-    print "In the Y direction (back-front), there will be a {:.3f} mm thickness difference.".format(diff_fb_100mm)
-    print "In a diagonal direction, there will be a {:.3f} mm thickness difference.".format(diff_diag_100)
-
-    max_mount_z = max(z_bl, z_br, z_fr, z_fl)
+    print "In the X direction (left-right), there will be a {:.3f} mm thickness difference.".format(
+        leveling.thickness_diff_x)
+    print "In the Y direction (back-front), there will be a {:.3f} mm thickness difference.".format(
+        leveling.thickness_diff_y)
+    print "In a diagonal direction, there will be a {:.3f} mm thickness difference.".format(
+        leveling.thickness_diff_diagonal)
 
-    # Adjust the measured coefficients, creating a new coeff set relative to the highest mount point
-    c = c - max_mount_z
-    coeffs = (a, b, c)
+    a, b, c = leveling.relative_coeffs
 
     print
     print
@@ -222,19 +740,11 @@ if "__main__" == __name__:
     print "Below is a table of the errors relative to the higest table mount position."
     print
 
-    # Calculate the rest of the mount hole (pair) locations
-    midl_rgt = ((RGTMOST_X + RGTMOST_MOUNT_OFFSET_X, (back_rgt[0][1] + frnt_rgt[0][1]) / 2.0), "middle-right")
-    midl_lft = ((LFTMOST_X + LFTMOST_MOUNT_OFFSET_X, (back_lft[0][1] + frnt_lft[0][1]) / 2.0), "middle-left")
-    midl_frnt = (((frnt_lft[0][0] + frnt_rgt[0][0]) / 2.0, FRNTMOST_Y + FRNTMOST_MOUNT_OFFSET_Y), "middle-front")
-    midl_back = (((back_lft[0][0] + back_rgt[0][0]) / 2.0, BACKMOST_Y + BACKMOST_MOUNT_OFFSET_Y), "middle-back")
-    middle = (((midl_back[0][0] + midl_frnt[0][0])/2.0, (midl_lft[0][1] + midl_rgt[0][1]) / 2.0), "table-middle")
-
-    table_mount_point_list = [back_rgt, midl_back, back_lft, midl_lft, frnt_lft, midl_frnt, frnt_rgt, midl_rgt, middle]
+    mount_points = leveling.mount_points
+    relative_z = get_z(leveling.relative_coeffs, mount_points.x, mount_points.y)
 
     print
-    for corner in table_mount_point_list:
-        (x, y), desc_str = corner
-        z = get_z(coeffs, x, y)
+    for desc_str, x, y, z in zip(mount_points.name_str_list, mount_points.x, mount_points.y, relative_z):
         print "{0:12s}: X({1:8.3f}), Y({2:8.3f}), Z({3:8.3f})".format(desc_str, x, y, z)
 
     print
@@ -247,17 +757,17 @@ if "__main__" == __name__:
     print
     print "                BACK"
     print
-    print "        {0:.3f}   {1:.3f}   {2:.3f}".format(get_z_by_name("back-left"),
-                                                       get_z_by_name("middle-back"),
-                                                       get_z_by_name("back-right"))
+    print "        {0:.3f}   {1:.3f}   {2:.3f}".format(leveling.adjustment("back-left"),
+                                                       leveling.adjustment("middle-back"),
+                                                       leveling.adjustment("back-right"))
     print
-    print "LEFT    {0:.3f}   {1:.3f}   {2:.3f}    RIGHT".format(get_z_by_name("middle-left"),
-                                                                get_z_by_name("table-middle"),
-                                                                get_z_by_name("middle-right"))
+    print "LEFT    {0:.3f}   {1:.3f}   {2:.3f}    RIGHT".format(leveling.adjustment("middle-left"),
+                                                                leveling.adjustment("table-middle"),
+                                                                leveling.adjustment("middle-right"))
     print
-    print "        {0:.3f}   {1:.3f}   {2:.3f}".format(get_z_by_name("front-left"),
-                                                       get_z_by_name("middle-front"),
-                                                       get_z_by_name("front-right"))
+    print "        {0:.3f}   {1:.3f}   {2:.3f}".format(leveling.adjustment("front-left"),
+                                                       leveling.adjustment("middle-front"),
+                                                       leveling.adjustment("front-right"))
     print
     print "                FRONT"
 
@@ -0,0 +1,243 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+How sure is the plane fit, and are its shim recommendations real or noise?
+
+analytic_covariance() gives the covariance of the fitted (a, b, c) from the least squares solution,
+sigma^2 (X^T X)^-1, and from it the standard error of each mount point's correction.
+
+bootstrap_coeffs() resamples the fit's residuals: each resample adds residuals drawn with replacement to
+the fitted surface and refits.  Since a least squares fit is linear in z, a resample's coefficients are
+the fit's plus pinv(X) times its residual vector, so the pseudo-inverse is computed once, and a batch of
+resamples is refitted with one matrix product.  Batches are spread across a process pool, each with its
+own seed, so the result does not depend on the number of processes.  The corrections for all the
+resamples are then worked out in one planar_fit.level_table() call.
+
+    python plane_fit_uncertainty.py <x,y,z CSV> [<resample count> [<processes>]]
+"""
+
+import multiprocessing
+import numpy as np
+import sys
+import time
+
+from planar_fit import level_table, read_depth_array
+
+
+RESAMPLE_COUNT = 10000
+BATCH_ELEMENT_COUNT = 1 << 22       # points x resamples per batch, which bounds a batch's memory to ~50 MB
+
+
+def __design_matrix(x_list, y_list):
+    return np.column_stack((np.asarray(x_list, dtype=np.float64), np.asarray(y_list, dtype=np.float64),
+                            np.ones(len(x_list))))
+
+
+def analytic_covariance(x_list, y_list, z_list):
+    """
+    Fit ax + by + c = z, and work out the covariance of (a, b, c) from the residuals.
+
+    :param x_list:  x values
+    :param y_list:  y values
+    :param z_list:  z values
+
+    :return:    ((a, b, c), 3x3 covariance of (a, b, c), residuals)
+    """
+    design = __design_matrix(x_list, y_list)
+    z = np.asarray(z_list, dtype=np.float64)
+    assert 3 < len(z), "analytic_covariance() needs at least 4 points"
+
+    coeffs, _, rank, _ = np.linalg.lstsq(design, z, rcond=-1)
+    assert 3 == rank, "analytic_covariance() the points are collinear"
+    residuals = z - design.dot(coeffs)
+    sigma_squared = residuals.dot(residuals) / (len(z) - 3)
+    covariance = sigma_squared * np.linalg.inv(design.T.dot(design))
+
+    return tuple(coeffs.tolist()), covariance, residuals
+
+
+def correction_std(coeffs, covariance, mount_points=None):
+    """
+    Standard error of each mount point's correction, to first order.  The correction is the height
+    difference to the highest mount point, so its variance is J C J^T, J = (x - x_high, y - y_high, 0).
+
+    :param coeffs:          (a, b, c)
+    :param covariance:      3x3 covariance of (a, b, c)
+    :param mount_points:    planar_fit.MountPoints, default planar_fit.table_mount_points()
+
+    :return:    standard error for each mount point, in mm
+    """
+    leveling = level_table(coeffs, mount_points)
+    mount_points = leveling.mount_points
+    highest = int(np.argmax(leveling.mount_z))
+    jacobian = np.column_stack((mount_points.x - mount_points.x[highest], mount_points.y - mount_points.y[highest],
+                                np.zeros(len(mount_points))))
+
+    return np.sqrt(np.einsum("ij,jk,ik->i", jacobian, covariance, jacobian))
+
+
+def __bootstrap_batch(pseudo_inverse, residuals, resample_count, seed):
+    random_state = np.random.RandomState(seed)
+    index = random_state.randint(0, len(residuals), size=(len(residuals), resample_count))
+    return pseudo_inverse.dot(residuals[index]).T
+
+
+__worker_args = None    # (pseudo_inverse, residuals) in each pool process
+
+
+def __init_worker(pseudo_inverse, residuals):
+    global __worker_args
+    __worker_args = (pseudo_inverse, residuals)
+
+
+def __bootstrap_in_worker(resample_count, seed):
+    pseudo_inverse, residuals = __worker_args
+    return __bootstrap_batch(pseudo_inverse, residuals, resample_count, seed)
+
+
+def bootstrap_coeffs(x_list, y_list, z_list, resample_count=RESAMPLE_COUNT, processes=1, seed=0):
+    """
+    Residual bootstrap of the plane fit ax + by + c = z.
+
+    :param x_list:          x values
+    :param y_list:          y values
+    :param z_list:          z values
+    :param resample_count:  number of resamples
+    :param processes:       1 to resample in this process, more for a pool of that many
+    :param seed:            random seed; batch i uses seed + i
+
+    :return:    (resample_count, 3) array of (a, b, c), one row per resample
+    """
+    assert isinstance(resample_count, int) and 0 < resample_count
+    assert isinstance(processes, int) and 1 <= processes
+    coeffs, _, residuals = analytic_covariance(x_list, y_list, z_list)
+    pseudo_inverse = np.linalg.pinv(__design_matrix(x_list, y_list))
+
+    batch_size = max(1, min(resample_count, BATCH_ELEMENT_COUNT // len(residuals)))
+    batch_list = [(min(batch_size, resample_count - first), seed + i)
+                  for i, first in enumerate(range(0, resample_count, batch_size))]
+
+    if 1 == processes:
+        delta_list = [__bootstrap_batch(pseudo_inverse, residuals, count, batch_seed)
+                      for count, batch_seed in batch_list]
+    else:
+        pool = multiprocessing.Pool(processes, __init_worker, (pseudo_inverse, residuals))
+        try:
+            delta_list = [result.get() for result in
+                          [pool.apply_async(__bootstrap_in_worker, batch) for batch in batch_list]]
+        finally:
+            pool.terminate()
+
+    return np.array(coeffs) + np.concatenate(delta_list)
+
+
+class ShimUncertainty(object):
+    """
+    The result of shim_uncertainty(): the corrections at each mount point and their error bars.
+    """
+    def __init__(self, leveling, covariance, correction_std, correction_interval, coeff_samples):
+        self.__leveling = leveling
+        self.__covariance = covariance
+        self.__correction_std = correction_std
+        self.__correction_interval = correction_interval
+        self.__coeff_samples = coeff_samples
+
+    @property
+    def leveling(self):             # planar_fit.LevelingResult for the fitted plane
+        return self.__leveling
+
+    @property
+    def covariance(self):           # analytic 3x3 covariance of (a, b, c)
+        return self.__covariance
+
+    @property
+    def correction_std(self):       # analytic standard error of each mount point's correction
+        return self.__correction_std
+
+    @property
+    def correction_interval(self):  # (lower, upper) bootstrap confidence interval of each correction
+        return self.__correction_interval
+
+    @property
+    def coeff_samples(self):        # bootstrap (a, b, c), one row per resample
+        return self.__coeff_samples
+
+
+def shim_uncertainty(x_list, y_list, z_list, mount_points=None, confidence=0.95, resample_count=RESAMPLE_COUNT,
+                     processes=1, seed=0):
+    """
+    Fit the plane, and work out error bars on every mount point's correction.
+
+    :param x_list:          x values
+    :param y_list:          y values
+    :param z_list:          z values
+    :param mount_points:    planar_fit.MountPoints, default planar_fit.table_mount_points()
+    :param confidence:      confidence level of the bootstrap intervals
+    :param resample_count:  number of bootstrap resamples
+    :param processes:       1 to resample in this process, more for a pool of that many
+    :param seed:            random seed
+
+    :return:    ShimUncertainty
+    """
+    assert 0.0 < confidence < 1.0
+    coeffs, covariance, _ = analytic_covariance(x_list, y_list, z_list)
+    leveling = level_table(coeffs, mount_points)
+    coeff_samples = bootstrap_coeffs(x_list, y_list, z_list, resample_count, processes, seed)
+    corrections = level_table(coeff_samples, leveling.mount_points).adjustments
+    tail_percent = 50.0 * (1.0 - confidence)
+    correction_interval = np.percentile(corrections, [tail_percent, 100.0 - tail_percent], axis=0).T
+
+    return ShimUncertainty(leveling, covariance, correction_std(coeffs, covariance, leveling.mount_points),
+                           correction_interval, coeff_samples)
+
+
+if "__main__" == __name__:
+    if len(sys.argv) < 2:
+        print "Usage python plane_fit_uncertainty.py <x,y,z CSV> [<resample count> [<processes>]]"
+        exit(1)
+
+    x_list, y_list, z_list = read_depth_array(sys.argv[1]).T
+    resample_count = int(sys.argv[2]) if 2 < len(sys.argv) else RESAMPLE_COUNT
+    processes = int(sys.argv[3]) if 3 < len(sys.argv) else 1
+
+    start_time = time.time()
+    uncertainty = shim_uncertainty(x_list, y_list, z_list, resample_count=resample_count, processes=processes)
+    elapsed_s = time.time() - start_time
+
+    a, b, c = uncertainty.leveling.coeffs
+    a_std, b_std, c_std = np.sqrt(np.diag(uncertainty.covariance))
+    print
+    print "{0} points, {1} resamples in {2:.2f} s".format(len(x_list), resample_count, elapsed_s)
+    print
+    print "a = {0:.9f} +/- {1:.9f}".format(a, a_std)
+    print "b = {0:.9f} +/- {1:.9f}".format(b, b_std)
+    print "c = {0:.6f} +/- {1:.6f}".format(c, c_std)
+    print
+    print "Corrections (mm) with their standard errors and 95% bootstrap intervals:"
+    print
+    mount_points = uncertainty.leveling.mount_points
+    for i, name_str in enumerate(mount_points.name_str_list):
+        print "{0:12s}: {1:6.3f} +/- {2:.3f}  [{3:6.3f}, {4:6.3f}]".format(
+            name_str, uncertainty.leveling.adjustments[i], uncertainty.correction_std[i],
+            uncertainty.correction_interval[i][0], uncertainty.correction_interval[i][1])
+    print
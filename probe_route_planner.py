@@ -0,0 +1,290 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+Orders a set of probe XY targets to minimize tool travel between them.
+
+Probing itself takes the same time whatever the order, but over the 420 x 370 mm bed the
+traverses between probe points dominate a survey.  The route is built with a nearest-neighbour
+tour, then improved with 2-opt (reverse a stretch of the route) and Or-opt (move a run of
+1 to 3 points elsewhere) until neither finds an improvement.
+
+Every target must pass is_x_valid()/is_y_valid(), checked all at once by tool_path.  Since the valid
+area is a rectangle, the straight traverses between valid targets stay inside it too.
+"""
+
+from shapeoko_commands import XMAX, XMIN, YMAX, YMIN
+from tool_path import x_valid_mask
+from tool_path import y_valid_mask
+import numpy as np
+import sys
+
+
+MAX_IMPROVEMENT_PASSES = 100
+IMPROVEMENT_EPSILON_MM = 1e-9
+
+
+class ProbeRoute(object):
+    """
+    Result of plan_probe_route().
+    """
+    def __init__(self, order, point_array, start_xy, travel_before_mm, travel_after_mm, pass_count):
+        self.__order = order
+        self.__point_array = point_array
+        self.__start_xy = start_xy
+        self.__travel_before_mm = travel_before_mm
+        self.__travel_after_mm = travel_after_mm
+        self.__pass_count = pass_count
+
+    @property
+    def order(self):            # indices into the caller's points, in visiting order
+        return self.__order
+
+    @property
+    def point_array(self):      # (N, 2) points in visiting order
+        return self.__point_array
+
+    @property
+    def start_xy(self):
+        return self.__start_xy
+
+    @property
+    def travel_before_mm(self):     # travel visiting the points in the order given
+        return self.__travel_before_mm
+
+    @property
+    def travel_after_mm(self):
+        return self.__travel_after_mm
+
+    @property
+    def pass_count(self):       # improvement passes run
+        return self.__pass_count
+
+    def travel_time_s(self, speed_mm_s):
+        """
+        :param speed_mm_s:  traverse speed
+
+        :return:    estimated (travel time before, travel time after), ignoring acceleration
+        """
+        assert isinstance(speed_mm_s, float) and 0.0 < speed_mm_s
+        return self.__travel_before_mm / speed_mm_s, self.__travel_after_mm / speed_mm_s
+
+
+def make_grid_points(x_first, x_last, y_first, y_last, spacing_mm):
+    """
+    Points of a regular grid, e.g. the threaded holes of the aluminum table at 50 mm spacing.
+
+    :param x_first:     first X ordinate
+    :param x_last:      last X ordinate (included if on the grid)
+    :param y_first:     first Y ordinate
+    :param y_last:      last Y ordinate (included if on the grid)
+    :param spacing_mm:  grid spacing
+
+    :return:    (N, 2) array of points, row by row
+    """
+    assert isinstance(spacing_mm, float) and 0.0 < spacing_mm
+    x_count = int(np.floor(abs(x_last - x_first) / spacing_mm + 1e-9)) + 1
+    y_count = int(np.floor(abs(y_last - y_first) / spacing_mm + 1e-9)) + 1
+    x_values = x_first + np.sign(x_last - x_first) * spacing_mm * np.arange(x_count)
+    y_values = y_first + np.sign(y_last - y_first) * spacing_mm * np.arange(y_count)
+    grid_x, grid_y = np.meshgrid(x_values, y_values)
+
+    return np.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+
+def route_length(start_xy, point_array, return_to_start=False):
+    """
+    :param start_xy:        (x, y) where the tool starts
+    :param point_array:     (N, 2) points in visiting order
+    :param return_to_start: if True, include the traverse back to start_xy
+
+    :return:    total straight-line travel in mm
+    """
+    path = np.vstack((np.asarray(start_xy, dtype=np.float64).reshape(1, 2), point_array))
+    if return_to_start:
+        path = np.vstack((path, path[:1]))
+
+    return float(np.sum(np.hypot(np.diff(path[:, 0]), np.diff(path[:, 1]))))
+
+
+def __nearest_neighbour_route(pts):
+    """
+    :param pts: (N + 1, 2) targets, followed by the start point
+
+    :return:    route: the start's index N followed by the indices of the targets, nearest first
+    """
+    n = len(pts) - 1
+    unvisited = np.ones(n, dtype=bool)
+    route = np.empty(n + 1, dtype=np.int64)
+    route[0] = n
+    current = pts[n]
+    for k in range(1, n + 1):
+        d = np.hypot(pts[:n, 0] - current[0], pts[:n, 1] - current[1])
+        d[~unvisited] = np.inf
+        i = int(np.argmin(d))
+        route[k] = i
+        unvisited[i] = False
+        current = pts[i]
+
+    return route
+
+
+def __distances(pts, p, q_indices):
+    return np.hypot(pts[q_indices, 0] - p[0], pts[q_indices, 1] - p[1])
+
+
+def __two_opt_pass(pts, route, closed):
+    """
+    One 2-opt pass: for each position i, reverse the stretch route[i..j] that shortens the route most.
+    route[0], the start, stays put.  Improves route in place.
+
+    :return:    True if any improvement was made
+    """
+    n = len(route)
+    improved = False
+    for i in range(1, n - 1):
+        a = pts[route[i - 1]]
+        b = pts[route[i]]
+        j = np.arange(i + 1, n)
+        c_indices = route[j]
+        d_indices = route[(j + 1) % n] if closed else route[np.minimum(j + 1, n - 1)]
+        # Reversing route[i..j] replaces edges (a, b) and (c, d) with (a, c) and (b, d)
+        d_cd = np.hypot(pts[d_indices, 0] - pts[c_indices, 0], pts[d_indices, 1] - pts[c_indices, 1])
+        d_bd = __distances(pts, b, d_indices)
+        if not closed:
+            d_cd[-1] = 0.0      # an open route has no edge after its last point
+            d_bd[-1] = 0.0
+        gain = np.hypot(*(b - a)) + d_cd - __distances(pts, a, c_indices) - d_bd
+        k = int(np.argmax(gain))
+        if gain[k] > IMPROVEMENT_EPSILON_MM:
+            route[i:j[k] + 1] = route[i:j[k] + 1][::-1].copy()
+            improved = True
+
+    return improved
+
+
+def __or_opt_pass(pts, route, closed, max_run_length=3):
+    """
+    One Or-opt pass: move each run of 1 to max_run_length points, either way round, to wherever
+    it shortens the route most.  route[0], the start, stays put.  Improves route in place.
+
+    :return:    True if any improvement was made
+    """
+    n = len(route)
+    improved = False
+    for run_length in range(1, max_run_length + 1):
+        i = 1
+        while i + run_length <= n:
+            run = route[i:i + run_length]
+            first = pts[run[0]]
+            last = pts[run[-1]]
+            prev = pts[route[i - 1]]
+            removal_gain = np.hypot(*(first - prev))
+            if i + run_length < n or closed:
+                nxt = pts[route[(i + run_length) % n]]
+                removal_gain += np.hypot(*(nxt - last)) - np.hypot(*(nxt - prev))
+
+            # Candidate insertions after rest[k]: between rest[k] and rest[k + 1], or at the end
+            rest = np.concatenate((route[:i], route[i + run_length:]))
+            p_indices = rest
+            q_indices = np.roll(rest, -1)
+            d_pq = np.hypot(pts[q_indices, 0] - pts[p_indices, 0], pts[q_indices, 1] - pts[p_indices, 1])
+            d_p_first = __distances(pts, first, p_indices)
+            d_p_last = __distances(pts, last, p_indices)
+            if closed:
+                cost_fwd = d_p_first + __distances(pts, last, q_indices) - d_pq
+                cost_rev = d_p_last + __distances(pts, first, q_indices) - d_pq
+            else:
+                cost_fwd = d_p_first + np.append(__distances(pts, last, q_indices[:-1]) - d_pq[:-1], 0.0)
+                cost_rev = d_p_last + np.append(__distances(pts, first, q_indices[:-1]) - d_pq[:-1], 0.0)
+            cost_fwd[i - 1] = np.inf    # that is where it came from
+            cost_rev[i - 1] = np.inf
+
+            k_fwd = int(np.argmin(cost_fwd))
+            k_rev = int(np.argmin(cost_rev))
+            reverse = cost_rev[k_rev] < cost_fwd[k_fwd]
+            k = k_rev if reverse else k_fwd
+            insertion_cost = cost_rev[k] if reverse else cost_fwd[k]
+
+            if removal_gain - insertion_cost > IMPROVEMENT_EPSILON_MM:
+                route[:] = np.concatenate((rest[:k + 1], run[::-1] if reverse else run, rest[k + 1:]))
+                improved = True
+            else:
+                i += 1
+
+    return improved
+
+
+def plan_probe_route(point_array, start_xy=(0.0, 0.0), return_to_start=False,
+                     max_passes=MAX_IMPROVEMENT_PASSES, session=None):
+    """
+    Order probe targets to minimize the tool's travel between them.
+
+    :param point_array:     (N, 2) array (or list of (x, y) tuples) of probe targets
+    :param start_xy:        (x, y) where the tool starts, e.g. (curpos.x, curpos.y)
+    :param return_to_start: if True, the route ends back at start_xy
+    :param max_passes:      limit on 2-opt/Or-opt improvement passes
+    :param session:         ShapeokoSession whose limits apply, default that of the shapeoko_commands functions
+
+    :return:    ProbeRoute
+    """
+    xy = np.asarray(point_array, dtype=np.float64)
+    assert 2 == xy.ndim and 2 == xy.shape[1] and 1 <= len(xy)
+    x_min, x_max, y_min, y_max = (XMIN, XMAX, YMIN, YMAX) if session is None else session.limits[:4]
+    assert np.all(x_valid_mask(xy[:, 0], session)), "plan_probe_route() X outside {0}..{1}".format(x_max, x_min)
+    assert np.all(y_valid_mask(xy[:, 1], session)), "plan_probe_route() Y outside {0}..{1}".format(y_max, y_min)
+    start = np.asarray(start_xy, dtype=np.float64)
+    assert (2,) == start.shape
+
+    travel_before_mm = route_length(start, xy, return_to_start)
+
+    pts = np.vstack((xy, start.reshape(1, 2)))
+    route = __nearest_neighbour_route(pts)
+
+    pass_count = 0
+    while pass_count < max_passes:
+        pass_count += 1
+        two_opt_improved = __two_opt_pass(pts, route, return_to_start)
+        or_opt_improved = __or_opt_pass(pts, route, return_to_start)
+        if not (two_opt_improved or or_opt_improved):
+            break
+
+    order = route[1:]
+    travel_after_mm = route_length(start, xy[order], return_to_start)
+
+    return ProbeRoute(order, xy[order], (float(start[0]), float(start[1])), travel_before_mm, travel_after_mm,
+                      pass_count)
+
+
+if "__main__" == __name__:
+    # Survey every threaded hole of the aluminum table, in a random order and then in a planned order
+    seed = int(sys.argv[1]) if 1 < len(sys.argv) else 0
+
+    point_array = make_grid_points(-10.0, -410.0, -10.0, -360.0, 50.0)
+    np.random.RandomState(seed).shuffle(point_array)
+
+    probe_route = plan_probe_route(point_array)
+    time_before_s, time_after_s = probe_route.travel_time_s(1000.0 / 60.0)
+
+    print "{0} probe points, {1} improvement passes".format(len(point_array), probe_route.pass_count)
+    print "Travel before: {0:10.1f} mm  ({1:7.1f} s at F1000)".format(probe_route.travel_before_mm, time_before_s)
+    print "Travel after:  {0:10.1f} mm  ({1:7.1f} s at F1000)".format(probe_route.travel_after_mm, time_after_s)
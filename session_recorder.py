@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+Record everything said on the serial link to the Shapeoko, and play it back.
+
+A SessionRecorder appends each write to, and each line read from, the port to a compact binary log.
+Each record is a timestamp in seconds since recording started, a direction and the bytes:
+
+    <d timestamp_s> <B direction> <H length> <length bytes>     (little-endian, RECORD_HEADER_FORMAT)
+
+Records are packed into a preallocated buffer and written to the file when it fills, or every
+flush_interval_s, so recording adds one struct.pack_into() per line.  A flush thread writes out
+the buffer on time even while the link is idle, so a crash loses at most flush_interval_s of log.
+
+A ReplayPort reads the log back as a port: readline() returns the recorded Shapeoko lines, each once
+the commands recorded before it have been written, at full speed or in real time.  Point
+shapeoko_commands.connect_and_synchronize(port=...) at it to rerun a survey without the machine.
+
+    python session_recorder.py <session log>        prints the log
+"""
+
+import struct
+import sys
+import threading
+import time
+
+
+monotonic = getattr(time, "monotonic", time.time)   # Python 2 has no monotonic clock
+
+FILE_MAGIC_STR = "SHREC\x01\n\x00"              # 8 bytes at the start of every session log
+RECORD_HEADER_FORMAT = "<dBH"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+RECORD_MAX_DATA_SIZE = 0xffff
+DIRECTION_TX = 0                                # host to Shapeoko
+DIRECTION_RX = 1                                # Shapeoko to host
+DIRECTION_NAME_DICT = {DIRECTION_TX: ">>", DIRECTION_RX: "<<"}
+
+
+class SessionRecorder(object):
+    """
+    Appends timestamped records to a session log.  Safe to call from the transport's reader thread
+    and the command thread at once.
+    """
+    def __init__(self, filename, buffer_size=1 << 18, flush_interval_s=1.0):
+        assert isinstance(filename, str)
+        assert isinstance(buffer_size, int) and RECORD_HEADER_SIZE + RECORD_MAX_DATA_SIZE <= buffer_size
+        assert isinstance(flush_interval_s, float) and 0.0 <= flush_interval_s
+        self.__filename = filename
+        self.__file = open(filename, "wb")
+        self.__file.write(FILE_MAGIC_STR)
+        self.__buffer = bytearray(buffer_size)
+        self.__buffer_used = 0
+        self.__flush_interval_s = flush_interval_s
+        self.__start_time = monotonic()
+        self.__last_flush_time = self.__start_time
+        self.__record_count = 0
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__flush_thread = None
+        if 0.0 < flush_interval_s:
+            self.__flush_thread = threading.Thread(target=self.__flush_loop, name="SessionRecorder")
+            self.__flush_thread.daemon = True
+            self.__flush_thread.start()
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @property
+    def record_count(self):
+        return self.__record_count
+
+    @property
+    def closed(self):
+        return self.__file is None
+
+    def record(self, direction, data_str):
+        """
+        :param direction:   DIRECTION_TX or DIRECTION_RX
+        :param data_str:    bytes written or read, e.g. "G01 X-10.000 F1000.000\n" or "ok\r\n"
+
+        :return:    nothing
+        """
+        assert direction in DIRECTION_NAME_DICT
+        now = monotonic()
+        with self.__lock:
+            if self.__file is None:
+                return
+            data_str = data_str[:RECORD_MAX_DATA_SIZE]
+            record_size = RECORD_HEADER_SIZE + len(data_str)
+            if len(self.__buffer) < self.__buffer_used + record_size:
+                self.__write_buffer()
+            struct.pack_into(RECORD_HEADER_FORMAT, self.__buffer, self.__buffer_used,
+                             now - self.__start_time, direction, len(data_str))
+            data_start = self.__buffer_used + RECORD_HEADER_SIZE
+            self.__buffer[data_start:data_start + len(data_str)] = data_str
+            self.__buffer_used += record_size
+            self.__record_count += 1
+            if self.__flush_interval_s <= now - self.__last_flush_time:
+                self.__flush_file(now)
+
+    def flush(self):
+        """
+        Write every record so far to the file.
+
+        :return:    nothing
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.__flush_file(monotonic())
+
+    def close(self):
+        self.__stop_event.set()
+        if self.__flush_thread is not None:
+            self.__flush_thread.join()
+            self.__flush_thread = None
+        with self.__lock:
+            if self.__file is not None:
+                self.__write_buffer()
+                self.__file.close()
+                self.__file = None
+
+    def __flush_loop(self):
+        while not self.__stop_event.wait(self.__flush_interval_s):
+            now = monotonic()
+            with self.__lock:
+                if self.__file is not None and self.__flush_interval_s <= now - self.__last_flush_time:
+                    self.__flush_file(now)
+
+    def __flush_file(self, now):
+        self.__write_buffer()
+        self.__file.flush()
+        self.__last_flush_time = now
+
+    def __write_buffer(self):
+        if 0 < self.__buffer_used:
+            self.__file.write(buffer(self.__buffer, 0, self.__buffer_used))
+            self.__buffer_used = 0
+
+
+class RecordingPort(object):
+    """
+    Wraps a serial port, recording every write() and every non-empty readline() to a SessionRecorder.
+    """
+    def __init__(self, port, recorder):
+        assert isinstance(recorder, SessionRecorder)
+        self.__port = port
+        self.__recorder = recorder
+
+    @property
+    def port(self):             # the wrapped port
+        return self.__port
+
+    @property
+    def recorder(self):
+        return self.__recorder
+
+    @property
+    def timeout(self):
+        return self.__port.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.__port.timeout = timeout
+
+    def write(self, data_str):
+        self.__recorder.record(DIRECTION_TX, data_str)
+        return self.__port.write(data_str)
+
+    def readline(self):
+        line_str = self.__port.readline()
+        if line_str:            # a read timeout is not part of the conversation
+            self.__recorder.record(DIRECTION_RX, line_str)
+        return line_str
+
+    def close(self):
+        self.__port.close()
+
+
+def read_session(filename):
+    """
+    :param filename:    a session log written by SessionRecorder
+
+    :return:    list of (timestamp_s, direction, data_str) records
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    assert data.startswith(FILE_MAGIC_STR), "read_session() {0} is not a session log".format(filename)
+
+    record_list = []
+    offset = len(FILE_MAGIC_STR)
+    while offset + RECORD_HEADER_SIZE <= len(data):
+        timestamp_s, direction, length = struct.unpack_from(RECORD_HEADER_FORMAT, data, offset)
+        offset += RECORD_HEADER_SIZE
+        if len(data) < offset + length:
+            break               # truncated by a crash before the last flush completed
+        record_list.append((timestamp_s, direction, data[offset:offset + length]))
+        offset += length
+
+    return record_list
+
+
+class ReplayPort(object):
+    """
+    A port that plays back a recorded session.  readline() returns each recorded Shapeoko line once
+    as many bytes have been written as had been when it was recorded, so a reader thread cannot run
+    ahead of the commands, and, if realtime, not before its recorded time.  Otherwise, like a serial
+    port, it returns "" after timeout seconds.
+
+    Writes are compared with the recording; mismatch_count says how far the replay has diverged.
+    Replays of sessions that polled status are timing dependent, so are best run with realtime=True.
+    """
+    def __init__(self, filename, realtime=False, timeout=None):
+        assert isinstance(realtime, bool)
+        record_list = read_session(filename)
+        self.__tx_str = "".join([data_str for _, direction, data_str in record_list if direction == DIRECTION_TX])
+        self.__rx_list = []     # (timestamp_s, TX bytes recorded before it, line_str)
+        tx_byte_count = 0
+        for timestamp_s, direction, data_str in record_list:
+            if direction == DIRECTION_TX:
+                tx_byte_count += len(data_str)
+            else:
+                self.__rx_list.append((timestamp_s, tx_byte_count, data_str))
+        self.__realtime = realtime
+        self.timeout = timeout
+        self.__rx_index = 0
+        self.__tx_byte_count = 0
+        self.__mismatch_count = 0
+        self.__start_time = monotonic()
+        self.__condition = threading.Condition()
+
+    @property
+    def lines_remaining(self):
+        return len(self.__rx_list) - self.__rx_index
+
+    @property
+    def mismatch_count(self):   # writes that differed from the recording
+        return self.__mismatch_count
+
+    def write(self, data_str):
+        with self.__condition:
+            expected_str = self.__tx_str[self.__tx_byte_count:self.__tx_byte_count + len(data_str)]
+            if expected_str != data_str:
+                self.__mismatch_count += 1
+                print "ReplayPort.write() WROTE({0!r}), RECORDED({1!r})".format(data_str, expected_str)
+            self.__tx_byte_count += len(data_str)
+            self.__condition.notify_all()
+        return len(data_str)
+
+    def readline(self):
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        with self.__condition:
+            while self.__rx_index < len(self.__rx_list):
+                timestamp_s, tx_byte_count, line_str = self.__rx_list[self.__rx_index]
+                now = monotonic()
+                wait_s = None
+                if self.__tx_byte_count < tx_byte_count:
+                    wait_s = 0.1 if deadline is None else deadline - now
+                elif self.__realtime and now < self.__start_time + timestamp_s:
+                    wait_s = self.__start_time + timestamp_s - now
+                    if deadline is not None:
+                        wait_s = min(wait_s, deadline - now)
+                else:
+                    self.__rx_index += 1
+                    return line_str
+                if deadline is not None and deadline <= now:
+                    return ""
+                self.__condition.wait(wait_s)
+
+        if self.timeout is not None:
+            time.sleep(self.timeout)        # the recording is over; the Shapeoko has nothing more to say
+        return ""
+
+    def close(self):
+        pass
+
+
+if "__main__" == __name__:
+    if len(sys.argv) != 2:
+        print "Usage python session_recorder.py <session log>"
+        exit(1)
+
+    for timestamp_s, direction, data_str in read_session(sys.argv[1]):
+        print "{0:10.4f} {1} {2!r}".format(timestamp_s, DIRECTION_NAME_DICT[direction], data_str)
@@ -20,14 +20,25 @@
 """
 
 
+from command_metrics import CommandMetrics
+from grbl_transport import GrblTransport
+from motion_queue import MotionQueue
+from session_recorder import RecordingPort
+from session_recorder import SessionRecorder
+from status_poller import StatusPoller
+from status_poller import parse_status_report
+import collections
 import serial
 import time
 
 
-class ToolPosition:
+class ToolPosition(object):
     """
     Structure for defining a Shapeoko tool position as an (X, Y, Z) point.
+    For whole paths of positions, see tool_path.ToolPath.
     """
+    __slots__ = ("__x", "__y", "__z")
+
     def __init__(self, x, y, z):
         assert isinstance(x, float)
         assert isinstance(y, float)
@@ -64,20 +75,20 @@ class ToolPosition:
         self.__z = z
 
 
-# GLOBALS INCLUDE:
-#   curpos
-#   __cmd_count
-#   __shapeoko_port
-
-curpos = ToolPosition(x=0.0, y=0.0, z=0.0)    # current position
-
-__shapeoko_port = None          # used to communicate with the Shapeoko over the USB serial port
-__cmd_count = 0                 # normally unused, helpful for debugging; see COMMAND_LOGGING_ENABLED
-
+# Settings of the default session driven by this module's functions; scripts may change them at any time.
+# A ShapeokoSession takes its own as constructor arguments, defaulting to these values.
 VERIFY_NEGATIVE_VALUES = True   # If True, verifies move() and goto() values are between XMIN, XMAX, YMIN, YMAX
 COMMAND_LOGGING_ENABLED = False # If True, module prints each GCODE command with its sequence nbr
 SLEEP_BEFORE_ESTOP = 5          # Allows user to examine situation, set breakpoint in debugger (e.g. use 30)
 STEP_DISTANCE_MM = 0.025        # Shapeoko moves the same minimal step distance in X, Y, and Z
+STREAMING_ENABLED = False       # If True, move() and goto() commands are streamed; see stream_command()
+COALESCE_MOTION = False         # If True, consecutive move() and goto() commands are merged; see MotionQueue
+GRBL_RX_BUFFER_SIZE = 127       # Bytes in GRBL's serial receive buffer, less the one it reserves
+GRBL_PLANNER_BLOCK_COUNT = 15   # Moves GRBL's planner can hold
+RESPONSE_TIMEOUT_S = 30         # Seconds to wait for a response before giving up on the Shapeoko
+TRANSPORT_READ_TIMEOUT_S = 0.1  # Serial read timeout used by the GrblTransport reader thread
+RESYNC_READ_TIMEOUT_S = 0.02    # Serial read timeout while resynchronize() talks to the Shapeoko
+RESYNC_TIMEOUT_S = 1.0          # Seconds resynchronize() waits for any one answer before resetting instead
 
 # Since our coordinate system is defined from (0, 0), it is common to think of that as the minimum value.
 # However, the useful range of motion is only in the negative range of x and y values.  For the purposes
@@ -90,516 +101,1679 @@ YMIN, YMAX, YINC = 0.0, -370.0, STEP_DISTANCE_MM
 # user of the module if used.
 ZMIN, ZMAX, ZINC = 0.0, None, STEP_DISTANCE_MM
 
+# Lines of GRBL's "$#" report whose offsets add up to the work coordinate offset.  The others are the
+# stored G28 and G30 positions and the last probe, "[PRB:x,y,z:success]".
+WCO_OFFSET_NAME_SET = {"G54", "G55", "G56", "G57", "G58", "G59", "G92", "TLO"}
 
-def is_x_valid(x):
-    """
-    (If VERIFY_NEGATIVE_VALUES is True,) validate x value
 
-    Note, the XINC extra little bit of slop allows the jiggle_xy() calls to execute on the edges
+def parse_probe_report(report_str):
+    """
+    Parse GRBL's probe cycle feedback, e.g. "[PRB:-10.000,-20.000,-61.250:1]"
 
-    :param x:   position on the X axis
+    :param report_str:  the feedback line
 
-    :return:    True if Valid, False otherwise
+    :return:    (ToolPosition in machine coordinates, True if contact was made), or None if not a probe report
     """
-    assert isinstance(x, float)
+    assert isinstance(report_str, str)
+    if not (report_str.startswith("[PRB:") and report_str.endswith("]")):
+        return None
 
-    return (XMAX - XINC) <= x <= (XMIN + XINC)
+    position_str, _, success_str = report_str[len("[PRB:"):-1].partition(":")
+    try:
+        x, y, z = [float(v) for v in position_str.split(",")]
+    except ValueError:
+        return None
 
+    return ToolPosition(x=x, y=y, z=z), "1" == success_str
 
-def is_y_valid(y):
-    """
-    (If VERIFY_NEGATIVE_VALUES is True), validate y value
 
-    Note: the YINC extra little bit of slop allows the jiggle_xy() calls to execute on the edges
+def format_move(kind_str, axis_dict, speed_mm_s):
+    """
+    Format a G00 or G01 command, e.g. "G01 X-10.000 Y-20.000 F1000.000"
 
-    :param y: position on the Y axis
+    :param kind_str:    "G00" or "G01"
+    :param axis_dict:   axis name to new position, e.g. {"x": -10.0, "y": -20.0}
+    :param speed_mm_s:  speed in mm/s for G01, None for G00
 
-    :return:    True if Valid, False otherrwise
+    :return:    the command string
     """
-    assert isinstance(y, float)
-    return (YMAX - YINC) <= y <= (YMIN + YINC)
+    word_list = [kind_str]
+    for axis_str in ["x", "y", "z"]:
+        if axis_str in axis_dict:
+            word_list.append("{0}{1:3.3f}".format(axis_str.upper(), axis_dict[axis_str]))
+    if speed_mm_s is not None:
+        word_list.append("F{0:3.3f}".format(speed_mm_s))
 
+    return " ".join(word_list)
 
-def read_3_reset_startup_lines():
+
+class ShapeokoSession(object):
     """
-    Connect to the Shapeoko, printing and returning the 1st 3 lines.
+    One Shapeoko controller and everything needed to drive it: its serial port, GrblTransport, tool position,
+    streaming state, command counter, metrics, and settings, limits and timeouts included.
 
-    :return:    3 strings: the 1st 3 lines from the initial Shapeoko connect
+    The functions of this module drive a default session, so scripts written for one machine need no session;
+    shapeoko_session.SessionManager drives several at once.  Methods return True on success, False on failure.
     """
-    global __shapeoko_port
+    def __init__(self, port_str="/dev/ttyACM0", name_str=None, streaming_enabled=False, verify_negative_values=True,
+                 coalesce_motion=False, command_logging_enabled=False, command_metrics_enabled=False,
+                 x_min=XMIN, x_max=XMAX, y_min=YMIN, y_max=YMAX, z_min=ZMIN, z_max=ZMAX,
+                 step_distance_mm=STEP_DISTANCE_MM, sleep_before_estop_s=SLEEP_BEFORE_ESTOP,
+                 response_timeout_s=RESPONSE_TIMEOUT_S, transport_read_timeout_s=TRANSPORT_READ_TIMEOUT_S,
+                 resync_read_timeout_s=RESYNC_READ_TIMEOUT_S, rx_buffer_size=GRBL_RX_BUFFER_SIZE,
+                 planner_block_count=GRBL_PLANNER_BLOCK_COUNT):
+        """
+        :param port_str:                    serial port device, e.g. the port_name of a grbl_simulator.GrblSimulator
+        :param name_str:                    prefixes the session's messages; default port_str, "" for no prefix
+        :param streaming_enabled:           if True, moves are streamed; see stream_command()
+        :param verify_negative_values:      if True, move and goto targets are checked against the limits
+        :param coalesce_motion:             if True, consecutive moves are merged; see MotionQueue
+        :param command_logging_enabled:     if True, each command is printed with its sequence number
+        :param command_metrics_enabled:     if True, start with enable_command_metrics()
+        :param x_min:                       X limits, x_max < x_min (see XMIN, XMAX)
+        :param y_min:                       Y limits, y_max < y_min
+        :param z_min:                       Z limits; z_max None if not known (it depends on the tool)
+        :param step_distance_mm:            minimal step, the slop allowed at the limits
+        :param sleep_before_estop_s:        seconds to sleep after a failure, to examine the situation
+        :param response_timeout_s:          seconds to wait for a response before giving up on the Shapeoko
+        :param transport_read_timeout_s:    serial read timeout used by the GrblTransport reader thread
+        :param resync_read_timeout_s:       serial read timeout while resynchronize() talks to the Shapeoko
+        :param rx_buffer_size:              bytes in GRBL's serial receive buffer, less the one it reserves
+        :param planner_block_count:         moves GRBL's planner can hold
+        """
+        assert isinstance(port_str, str)
+        assert name_str is None or isinstance(name_str, str)
+        self.__port_str = port_str
+        self.__name_str = name_str
+        self.__curpos = ToolPosition(x=0.0, y=0.0, z=0.0)
+        self.__shapeoko_port = None
+        self.__cmd_count = 0
+        self.__stream_pending = collections.deque()  # (cmd_str, byte_count, ack_callback) of each unanswered command
+        self.__stream_bytes_outstanding = 0         # sum of the byte_count values in __stream_pending
+        self.__transport = None
+        self.__status_poller = None
+        self.__motion_queue = MotionQueue()
+        self.__command_metrics = CommandMetrics() if command_metrics_enabled else None
+        self.__session_recorder = None
+        self.__wcs_str = None                       # coordinate system last selected, restored by resynchronize()
+
+        self.__streaming_enabled = streaming_enabled
+        self.__verify_negative_values = verify_negative_values
+        self.__coalesce_motion = coalesce_motion
+        self.__command_logging_enabled = command_logging_enabled
+        self.__x_min, self.__x_max = x_min, x_max
+        self.__y_min, self.__y_max = y_min, y_max
+        self.__z_min, self.__z_max = z_min, z_max
+        self.__step_distance_mm = step_distance_mm
+        self.__sleep_before_estop_s = sleep_before_estop_s
+        self.__response_timeout_s = response_timeout_s
+        self.__transport_read_timeout_s = transport_read_timeout_s
+        self.__resync_read_timeout_s = resync_read_timeout_s
+        self.__rx_buffer_size = rx_buffer_size
+        self.__planner_block_count = planner_block_count
+        self.configure()
+
+    def configure(self, streaming_enabled=None, verify_negative_values=None, coalesce_motion=None,
+                  command_logging_enabled=None, x_min=None, x_max=None, y_min=None, y_max=None, z_min=None,
+                  z_max=None, step_distance_mm=None, sleep_before_estop_s=None, response_timeout_s=None,
+                  transport_read_timeout_s=None, resync_read_timeout_s=None, rx_buffer_size=None,
+                  planner_block_count=None):
+        """
+        Change settings given to the constructor.  A setting left None is unchanged (z_max, once set, stays set).
+
+        :return:    nothing
+        """
+        if streaming_enabled is not None:
+            self.__streaming_enabled = streaming_enabled
+        if verify_negative_values is not None:
+            self.__verify_negative_values = verify_negative_values
+        if coalesce_motion is not None:
+            self.__coalesce_motion = coalesce_motion
+        if command_logging_enabled is not None:
+            self.__command_logging_enabled = command_logging_enabled
+        if x_min is not None:
+            self.__x_min = x_min
+        if x_max is not None:
+            self.__x_max = x_max
+        if y_min is not None:
+            self.__y_min = y_min
+        if y_max is not None:
+            self.__y_max = y_max
+        if z_min is not None:
+            self.__z_min = z_min
+        if z_max is not None:
+            self.__z_max = z_max
+        if step_distance_mm is not None:
+            self.__step_distance_mm = step_distance_mm
+        if sleep_before_estop_s is not None:
+            self.__sleep_before_estop_s = sleep_before_estop_s
+        if response_timeout_s is not None:
+            self.__response_timeout_s = response_timeout_s
+        if transport_read_timeout_s is not None:
+            self.__transport_read_timeout_s = transport_read_timeout_s
+        if resync_read_timeout_s is not None:
+            self.__resync_read_timeout_s = resync_read_timeout_s
+        if rx_buffer_size is not None:
+            self.__rx_buffer_size = rx_buffer_size
+        if planner_block_count is not None:
+            self.__planner_block_count = planner_block_count
+
+        assert isinstance(self.__streaming_enabled, bool)
+        assert isinstance(self.__verify_negative_values, bool)
+        assert isinstance(self.__coalesce_motion, bool)
+        assert isinstance(self.__command_logging_enabled, bool)
+        assert isinstance(self.__x_min, float) and isinstance(self.__x_max, float) and self.__x_max < self.__x_min
+        assert isinstance(self.__y_min, float) and isinstance(self.__y_max, float) and self.__y_max < self.__y_min
+        assert isinstance(self.__z_min, float)
+        assert self.__z_max is None or (isinstance(self.__z_max, float) and self.__z_max < self.__z_min)
+        assert isinstance(self.__step_distance_mm, float) and 0.0 < self.__step_distance_mm
+        assert isinstance(self.__sleep_before_estop_s, (int, float)) and 0 <= self.__sleep_before_estop_s
+        assert isinstance(self.__response_timeout_s, (int, float)) and 0 < self.__response_timeout_s
+        assert isinstance(self.__transport_read_timeout_s, float) and 0.0 < self.__transport_read_timeout_s
+        assert isinstance(self.__resync_read_timeout_s, float) and 0.0 < self.__resync_read_timeout_s
+        assert isinstance(self.__rx_buffer_size, int) and 0 < self.__rx_buffer_size
+        assert isinstance(self.__planner_block_count, int) and 0 < self.__planner_block_count
 
-    time.sleep(0.01)
-    line1_str = __shapeoko_port.readline().strip()
-    time.sleep(0.01)
-    line2_str = __shapeoko_port.readline().strip()
-    time.sleep(0.01)
-    line3_str = __shapeoko_port.readline().strip()
+    @property
+    def name_str(self):
+        return self.__port_str if not self.__name_str else self.__name_str
 
-    print line1_str  # blank line
-    print line2_str  # "Grbl 1.1f ['$' for help]"
-    print line3_str  # "[MSG:'$H'|'$X' to unlock]"
+    @property
+    def port_str(self):
+        return self.__port_str
 
-    return line1_str, line2_str, line3_str
+    @property
+    def curpos(self):           # where the tool was last told to go, once acknowledged
+        return self.__curpos
 
+    @property
+    def cmd_count(self):        # commands sent; see command_logging_enabled
+        return self.__cmd_count
 
-def connect_and_synchronize():
-    """
-    Connect to the Shapeoko/GRBL via the USB port.  Verify that the connection is established.
+    @property
+    def transport(self):        # the GrblTransport started by start_transport(), or None
+        return self.__transport
 
-    :return:    nothing
-    """
-    global __shapeoko_port
+    @property
+    def command_metrics(self):  # the CommandMetrics started by enable_command_metrics(), or None
+        return self.__command_metrics
 
-    __shapeoko_port = serial.Serial("/dev/ttyACM0",
-                                    baudrate=115200,
-                                    parity=serial.PARITY_NONE,
-                                    stopbits=serial.STOPBITS_ONE,
-                                    bytesize=serial.EIGHTBITS,
-                                    writeTimeout=0,
-                                    timeout=30,
-                                    rtscts=False,
-                                    dsrdtr=False,
-                                    xonxoff=False)
+    @property
+    def motion_queue(self):     # the MotionQueue used when coalesce_motion, e.g. for its merged and dropped counts
+        return self.__motion_queue
 
-    line1_str, line2_str, line3_str = read_3_reset_startup_lines()
+    @property
+    def streaming_enabled(self):
+        return self.__streaming_enabled
 
-    while "[MSG:'$H'|'$X' to unlock]" != line3_str and "Grbl 1.1f ['$' for help]" != line2_str:
-        ctrl_x_int = 0x18
-        ctrl_x_chstr = chr(ctrl_x_int)
-        output_and_log(ctrl_x_chstr)
-        time.sleep(1)
-        line1_str, line2_str, line3_str = read_3_reset_startup_lines()
+    @streaming_enabled.setter
+    def streaming_enabled(self, streaming_enabled):
+        self.configure(streaming_enabled=streaming_enabled)
 
+    @property
+    def verify_negative_values(self):
+        return self.__verify_negative_values
 
-def read_port_await_str(expected_response_str):
-    """
-    It appears that the Shapeoko responds with the string "ok" (or an "err nn" string) when
-    a command is processed.  Read the shapeoko_port and verify the response string in this routine.
-    If an error occurs, a message.
+    @verify_negative_values.setter
+    def verify_negative_values(self, verify_negative_values):
+        self.configure(verify_negative_values=verify_negative_values)
 
-    :param expected_response_str:   a string, typically "ok"
+    @property
+    def limits(self):           # (x_min, x_max, y_min, y_max, z_min, z_max)
+        return self.__x_min, self.__x_max, self.__y_min, self.__y_max, self.__z_min, self.__z_max
 
-    :return:    True if "ok" received, otherwise False
-    """
-    assert isinstance(expected_response_str, str)
-    global __shapeoko_port
+    @property
+    def step_distance_mm(self): # the slop allowed at the limits
+        return self.__step_distance_mm
 
-    response_str = __shapeoko_port.readline().strip()
+    @property
+    def response_timeout_s(self):
+        return self.__response_timeout_s
 
-    if expected_response_str != response_str:
-        print "RESPONSE_STR_LEN({0}), RESPONSE_STR({1})".format(len(response_str), response_str)
+    def is_x_valid(self, x):
+        """
+        (If verify_negative_values is True,) validate x value
 
-    return expected_response_str == response_str
+        Note, the step_distance_mm extra little bit of slop allows the jiggle_xy() calls to execute on the edges
 
+        :param x:   position on the X axis
 
-def output_and_log(cmd_str):
-    """
-    Write the command string to the Shapeoko shapeoko_port, logging it to console if enabled.
+        :return:    True if Valid, False otherwise
+        """
+        assert isinstance(x, float)
 
-    :param cmd_str: Shapeoko command string
+        return (self.__x_max - self.__step_distance_mm) <= x <= (self.__x_min + self.__step_distance_mm)
 
-    :return:    nothing
-    """
-    assert isinstance(cmd_str, str)
-    global __shapeoko_port
-    global __cmd_count
+    def is_y_valid(self, y):
+        """
+        (If verify_negative_values is True), validate y value
 
-    __cmd_count += 1    # Use this help track down problems
-    if COMMAND_LOGGING_ENABLED:
-        print "{0:5d}: '{1}'".format(__cmd_count, cmd_str)
+        Note: the step_distance_mm extra little bit of slop allows the jiggle_xy() calls to execute on the edges
 
-    __shapeoko_port.write("{0}\n".format(cmd_str))
+        :param y: position on the Y axis
 
+        :return:    True if Valid, False otherrwise
+        """
+        assert isinstance(y, float)
 
-def home_system():
-    """
-    Issue a Home command to the Shapeoko.  After this, the machine's coordinate system is usable.
+        return (self.__y_max - self.__step_distance_mm) <= y <= (self.__y_min + self.__step_distance_mm)
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
+    def is_z_valid(self, z):
+        """
+        (If verify_negative_values is True), validate z value: at or below z_min, and not below z_max if known
 
-    Call this function like this:
+        :param z: position on the Z axis
 
-        assert home_system(), "Useful message indicating where failure occurred"
+        :return:    True if Valid, False otherrwise
+        """
+        assert isinstance(z, float)
 
-    :return:    True -> success, False -> not so much
-    """
-    output_and_log("$H")
+        return z <= self.__z_min and (self.__z_max is None or self.__z_max - self.__step_distance_mm <= z)
+
+    def read_3_reset_startup_lines(self):
+        """
+        Connect to the Shapeoko, printing and returning the 1st 3 lines.
+
+        :return:    3 strings: the 1st 3 lines from the initial Shapeoko connect
+        """
+        time.sleep(0.01)
+        line1_str = self.__shapeoko_port.readline().strip()
+        time.sleep(0.01)
+        line2_str = self.__shapeoko_port.readline().strip()
+        time.sleep(0.01)
+        line3_str = self.__shapeoko_port.readline().strip()
+
+        print line1_str  # blank line
+        print line2_str  # "Grbl 1.1f ['$' for help]"
+        print line3_str  # "[MSG:'$H'|'$X' to unlock]"
+
+        return line1_str, line2_str, line3_str
+
+    def connect_and_synchronize(self, port_str=None, port=None):
+        """
+        Connect to the Shapeoko/GRBL via the USB port.  Verify that the connection is established.
+
+        :param port_str:    serial port device, default the session's port_str
+        :param port:        if not None, an open port to use instead of port_str, e.g. a session_recorder.ReplayPort
+
+        :return:    nothing
+        """
+        if port_str is not None:
+            self.__port_str = port_str
+
+        self.__forget_link_state()
+        if port is None:
+            port = self.__open_port(self.__response_timeout_s, pulse_dtr=True)
+        else:
+            port.timeout = self.__response_timeout_s
+        self.__shapeoko_port = port if self.__session_recorder is None else RecordingPort(port,
+                                                                                          self.__session_recorder)
+
+        line1_str, line2_str, line3_str = self.read_3_reset_startup_lines()
+
+        while "[MSG:'$H'|'$X' to unlock]" != line3_str and "Grbl 1.1f ['$' for help]" != line2_str:
+            ctrl_x_int = 0x18
+            ctrl_x_chstr = chr(ctrl_x_int)
+            self.__shapeoko_port.write(ctrl_x_chstr)    # real-time command: a "\n" after it would be answered "ok"
+            time.sleep(1)
+            line1_str, line2_str, line3_str = self.read_3_reset_startup_lines()
+
+    def connect(self):
+        """
+        connect_and_synchronize(), then start_transport(), as a SessionManager does for each session.
+
+        :return:    nothing
+        """
+        self.connect_and_synchronize()
+        self.start_transport()
+
+    def close(self):
+        """
+        Send any move held back by coalesce_motion and wait for outstanding commands, then stop the transport
+        and close the port.
+
+        :return:    True -> every command was answered "ok", False -> failure
+        """
+        all_ok = True
+        if self.__shapeoko_port is not None:
+            all_ok = self.flush_motion()
+        if self.__transport is not None:
+            all_ok = self.stop_transport() and all_ok
+        if self.__shapeoko_port is not None:
+            all_ok = self.drain_stream() and all_ok
+            self.__shapeoko_port.close()
+            self.__shapeoko_port = None
+
+        return all_ok
+
+    def resynchronize(self, port_str=None, port=None, timeout_s=RESYNC_TIMEOUT_S):
+        """
+        Reconnect to the Shapeoko after a USB hiccup without resetting it, so that it keeps its homed machine
+        position and need not be homed again.  The port is opened without pulsing DTR (which resets an Arduino),
+        stale input is discarded, and "?" and "$G" are asked.  If GRBL is Idle, the coordinate system last
+        selected and absolute distance mode are restored if lost, and curpos is set to the reported position.
+        This takes milliseconds.
+
+        If GRBL does not answer within timeout_s, is not Idle (e.g. it is in Alarm, having lost its position),
+        or has just been reset, fall back to connect_and_synchronize().
+
+        Call this method like this:
+
+            if not session.resynchronize():
+                assert session.home_system(), "Useful message indicating where failure occurred"
+
+        :param port_str:    serial port device, default the session's port_str
+        :param port:        if not None, an open port to use instead of port_str
+        :param timeout_s:   seconds to wait for each answer
+
+        :return:    True -> resynchronized, False -> connected by resetting the Shapeoko, which must be homed again
+        """
+        assert isinstance(timeout_s, float) and 0.0 < timeout_s
+        if port_str is not None:
+            self.__port_str = port_str
+
+        self.__forget_link_state()
+        if port is None:
+            port = self.__open_port(self.__resync_read_timeout_s, pulse_dtr=False)
+        else:
+            port.timeout = self.__resync_read_timeout_s
+        self.__shapeoko_port = port if self.__session_recorder is None else RecordingPort(port,
+                                                                                          self.__session_recorder)
+
+        machine_status = self.__resync_state(timeout_s)
+        if machine_status is None:
+            self.__print("resynchronize() SHAPEOKO NOT IDLE, RESETTING")
+            self.__shapeoko_port.write(chr(0x18))   # Ctrl-X now, so connect_and_synchronize() reads the banner at once
+            self.connect_and_synchronize(port=port)
+            return False
+
+        self.__shapeoko_port.timeout = self.__response_timeout_s
+        self.__curpos.x, self.__curpos.y, self.__curpos.z = [float(v) for v in machine_status.wpos]
+        self.__motion_queue.forget_position()
+
+        return True
+
+    def __forget_link_state(self):
+        if self.__transport is not None:
+            self.stop_transport()
+        if self.__command_metrics is not None:
+            self.__command_metrics.record_lost()
+        self.__stream_pending.clear()       # Any responses still owed by a previous connection are lost
+        self.__stream_bytes_outstanding = 0
+
+    def __open_port(self, timeout_s, pulse_dtr):
+        port = serial.Serial(None,
+                             baudrate=115200,
+                             parity=serial.PARITY_NONE,
+                             stopbits=serial.STOPBITS_ONE,
+                             bytesize=serial.EIGHTBITS,
+                             writeTimeout=0,
+                             timeout=timeout_s,
+                             rtscts=False,
+                             dsrdtr=False,
+                             xonxoff=False)
+        port.port = self.__port_str
+        if not pulse_dtr:
+            port.dtr = False    # asserting DTR on open resets an Arduino-based controller
+        port.open()
+
+        return port
+
+    def __resync_read_until(self, is_last_line, timeout_s):
+        """
+        :return:    lines read up to and including the one for which is_last_line() is True,
+                    or None if a startup banner (i.e. a reset) was seen or timeout_s passed without one
+        """
+        line_str_list = []
+        deadline = time.time() + timeout_s
+        while time.time() < deadline:
+            line_str = self.read_response_line()
+            if line_str.startswith("Grbl "):
+                return None
+            if line_str:
+                line_str_list.append(line_str)
+                if is_last_line(line_str):
+                    return line_str_list
+
+        return None
+
+    def __resync_state(self, timeout_s):
+        """
+        :return:    the Shapeoko's status, with wpos, once its coordinate system is restored, or None if not Idle
+        """
+        deadline = time.time() + timeout_s
+        while self.read_response_line() and time.time() < deadline:
+            pass                # stale responses and status reports from before the hiccup
+
+        machine_status = self.__resync_status(timeout_s)
+        if machine_status is None or not machine_status.is_idle:
+            return None
+
+        line_str_list = self.__resync_query("$G", timeout_s)
+        if line_str_list is None:
+            return None
+        modal_str_list = []
+        for line_str in line_str_list:
+            if line_str.startswith("[GC:"):
+                modal_str_list = line_str[4:-1].split()
+
+        restore_str_list = []
+        if self.__wcs_str is not None and self.__wcs_str not in modal_str_list:
+            restore_str_list.append(self.__wcs_str)
+            modal_str_list.append(self.__wcs_str)
+        if "G90" not in modal_str_list:
+            restore_str_list.append("G90")
+        if restore_str_list:
+            if self.__resync_query(" ".join(restore_str_list), timeout_s) is None:
+                return None
+            machine_status = self.__resync_status(timeout_s)    # for the WCO of the restored coordinate system
+            if machine_status is None:
+                return None
+
+        if machine_status.wpos is None and machine_status.wco is None:
+            line_str_list = self.__resync_query("$#", timeout_s)    # GRBL reports WCO only every so often
+            if line_str_list is None:
+                return None
+            offset_dict = {}
+            for line_str in line_str_list:
+                if line_str.startswith("["):
+                    name_str, _, value_str = line_str[1:-1].partition(":")
+                    if name_str in WCO_OFFSET_NAME_SET:
+                        value_str = value_str.partition(":")[0]     # any ":flag" suffix
+                        offset_dict[name_str] = [float(v) for v in value_str.split(",")[:3]]
+            wcs_str_list = [modal_str for modal_str in modal_str_list if modal_str.startswith("G5")]
+            wco = list(offset_dict.get(wcs_str_list[0] if wcs_str_list else "G54", [0.0, 0.0, 0.0]))
+            wco = [w + o for w, o in zip(wco, offset_dict.get("G92", [0.0, 0.0, 0.0]))]
+            wco[2] += offset_dict.get("TLO", [0.0])[0]
+            machine_status = machine_status.with_wco(tuple(wco))
+
+        return machine_status.with_wco(None)
+
+    def __resync_status(self, timeout_s):
+        self.__shapeoko_port.write("?")     # real-time command: answered without an "ok"
+        line_str_list = self.__resync_read_until(lambda line_str: line_str.startswith("<"), timeout_s)
+
+        return None if line_str_list is None else parse_status_report(line_str_list[-1])
+
+    def __resync_query(self, cmd_str, timeout_s):
+        self.__shapeoko_port.write("{0}\n".format(cmd_str))
+        line_str_list = self.__resync_read_until(lambda line_str: "ok" == line_str or line_str.startswith("error"),
+                                                 timeout_s)
+        if line_str_list is None or "ok" != line_str_list[-1]:
+            return None
+
+        return line_str_list
+
+    def read_response_line(self):
+        """
+        Read the next line sent by the Shapeoko, stripped of its line terminator.
+
+        :return:    the line, or "" if the shapeoko_port read timed out
+        """
+        return self.__shapeoko_port.readline().strip()
+
+    def read_port_await_str(self, expected_response_str):
+        """
+        It appears that the Shapeoko responds with the string "ok" (or an "err nn" string) when
+        a command is processed.  Read the shapeoko_port and verify the response string in this routine.
+        If an error occurs, a message.
+
+        :param expected_response_str:   a string, typically "ok"
+
+        :return:    True if "ok" received, otherwise False
+        """
+        assert isinstance(expected_response_str, str)
+
+        response_str = self.read_response_line()
+        if self.__command_metrics is not None:
+            self.__command_metrics.record_response(response_str)
+
+        if expected_response_str != response_str:
+            self.__print("RESPONSE_STR_LEN({0}), RESPONSE_STR({1})".format(len(response_str), response_str))
+
+        return expected_response_str == response_str
+
+    def output_and_log(self, cmd_str):
+        """
+        Write the command string to the Shapeoko shapeoko_port, logging it to console if enabled.
+
+        :param cmd_str: Shapeoko command string
+
+        :return:    nothing
+        """
+        assert isinstance(cmd_str, str)
+
+        self.__cmd_count += 1   # Use this help track down problems
+        if self.__command_logging_enabled:
+            self.__print("{0:5d}: '{1}'".format(self.__cmd_count, cmd_str))
+        if self.__command_metrics is not None:
+            self.__command_metrics.record_send(cmd_str)
+
+        self.__shapeoko_port.write("{0}\n".format(cmd_str))
+
+    def service_stream_response(self):
+        """
+        Read the response to the oldest streamed command, and remove that command from the stream.
+
+        GRBL responds to every line it receives, in the order received, with "ok" or "error:N".
+        Other lines (status reports, [MSG:...] feedback) are skipped.  The ack_callback of a
+        command answered with "ok" is called.  Since a lost response means the program no longer
+        knows which command GRBL is working on, a timeout or an ALARM abandons every pending command.
+
+        :return:    True -> the command was answered with "ok", False -> failure
+        """
+        assert 0 < len(self.__stream_pending)
+
+        response_str = self.read_response_line()
+        while "ok" != response_str and not response_str.startswith("error"):
+            if "" == response_str or response_str.startswith("ALARM"):
+                self.__print("service_stream_response() RESPONSE_STR({0}), ABANDONING {1} COMMANDS".format(
+                    response_str, len(self.__stream_pending)))
+                if self.__command_metrics is not None:
+                    self.__command_metrics.record_lost()
+                self.__stream_pending.clear()
+                self.__stream_bytes_outstanding = 0
+                return False
+            response_str = self.read_response_line()
+
+        cmd_str, byte_count, ack_callback = self.__stream_pending.popleft()
+        self.__stream_bytes_outstanding -= byte_count
+        if self.__command_metrics is not None:
+            self.__command_metrics.record_response(response_str)
+
+        if "ok" != response_str:
+            self.__print("stream_command('{0}') RESPONSE_STR({1})".format(cmd_str, response_str))
+            return False
 
-    responded = read_port_await_str("ok")
+        if ack_callback is not None:
+            ack_callback()
 
-    if not responded:
-        print "home_system() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
+        return True
 
-    return responded
+    def stream_command(self, cmd_str, ack_callback=None):
+        """
+        Send a command without waiting for its response, keeping GRBL's serial receive buffer full.
+
+        This is GRBL's "character counting" streaming protocol: the bytes of every command not yet
+        answered are counted, and responses are only read when the next command would overflow
+        rx_buffer_size.  GRBL's planner then always has the next moves queued, so it does not
+        decelerate to a stop between commands.
 
+        :param cmd_str:         Shapeoko command string
+        :param ack_callback:    optional function of no arguments, called when the command is answered "ok"
 
-def define_wcs2_to_current_mcs_in_eprom():
-    """
-    Set a coordinate system named "2" to the machine's current X, Y, and Z; record it in EPROM.
+        :return:    True -> all responses read while making room were "ok", False -> failure
+        """
+        assert isinstance(cmd_str, str)
+        byte_count = len(cmd_str) + 1   # the "\n" appended by output_and_log() is buffered too
+        assert byte_count <= self.__rx_buffer_size
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
+        all_ok = True
+        while self.__stream_bytes_outstanding + byte_count > self.__rx_buffer_size:
+            all_ok = self.service_stream_response() and all_ok
 
-    Call this function like this:
+        self.output_and_log(cmd_str)
+        self.__stream_pending.append((cmd_str, byte_count, ack_callback))
+        self.__stream_bytes_outstanding += byte_count
 
-        assert define_wcs2_to_current_mcs_in_eprom(), "Useful message indicating where failure occurred"
+        return all_ok
 
-    :return:    True -> success, False -> failure
-    """
-    output_and_log("G10 L20 P2 X0 Y0 Z0")
+    def drain_stream(self):
+        """
+        Read the responses to all streamed commands.  When this returns, every command has been answered.
+
+        :return:    True -> every response was "ok", False -> failure
+        """
+        all_ok = self.flush_motion()
+
+        return self.__drain_stream() and all_ok
 
-    responded = read_port_await_str("ok")
+    def __drain_stream(self):
+        """
+        drain_stream(), leaving any held-back move held back, for sending a command ahead of it
+        """
+        if self.__transport is not None:
+            return self.__transport.drain(self.__response_timeout_s)
+
+        all_ok = True
+        while 0 < len(self.__stream_pending):
+            all_ok = self.service_stream_response() and all_ok
+
+        return all_ok
+
+    def start_transport(self):
+        """
+        Hand the shapeoko_port over to a GrblTransport, whose reader thread reads every line the
+        Shapeoko sends from then on.  The command methods become thin wrappers that send through
+        the transport and, unless streaming, wait on the returned CommandFuture.
 
-    if not responded:
-        print "define_wcs2_to_current_mcs() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
+        Call this after connect_and_synchronize().
 
-    return responded
+        :return:    the GrblTransport, e.g. to add status listeners or to send() from other threads
+        """
+        assert self.__shapeoko_port is not None
+        assert self.__transport is None
+        assert self.drain_stream(), "start_transport() streamed command failed"
 
+        self.__shapeoko_port.timeout = self.__transport_read_timeout_s  # lets stop_transport() return promptly
+        self.__transport = GrblTransport(self.__shapeoko_port, self.__rx_buffer_size, self.__command_metrics)
+        self.__transport.start()
 
-def set_wcs_to_wcs2():
-    """
-    Start using the coordinate system name "2" for subsequent G00 and G01 X, Y, Z commands.
+        return self.__transport
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
+    def stop_transport(self):
+        """
+        Stop the GrblTransport started by start_transport(), and go back to reading the shapeoko_port directly.
 
-    Call this function like this:
+        :return:    True -> every command sent through the transport was answered "ok", False -> failure
+        """
+        assert self.__transport is not None
 
-        assert set_wcs_to_wcs2(), "Useful message indicating where failure occurred"
+        if self.__status_poller is not None:
+            self.stop_status_poller()
+        all_ok = self.__transport.drain(self.__response_timeout_s)
+        self.__transport.stop()
+        self.__transport = None
+        self.__shapeoko_port.timeout = self.__response_timeout_s
 
-    :return:    True -> success, False -> failure
-    """
-    output_and_log("G55")
+        return all_ok
 
-    responded = read_port_await_str("ok")
+    def enable_command_metrics(self):
+        """
+        Start recording, for every command type, the commands sent, bytes on the wire, failures and
+        send-to-response latency.  Call before start_transport() for the transport to record too.
 
-    if not responded:
-        print "set_wcs_to_current_mcs() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
+        :return:    the CommandMetrics; call its dump() at the end of a session
+        """
+        if self.__command_metrics is None:
+            self.__command_metrics = CommandMetrics()
 
-    return responded
+        return self.__command_metrics
 
+    def start_session_recording(self, filename):
+        """
+        Start logging every command written to, and every line read from, the Shapeoko to a binary
+        session log, which session_recorder.ReplayPort can play back.  Call before connect_and_synchronize()
+        for the log to replay from the start, and in any case before start_transport().
 
-def move_x(new_x, speed_mm_s=1000.0):
-    """
-    Move tool to the new_x position at speed_mm_s.  Update curpos.x with new position.
+        :param filename:    session log to create
+
+        :return:    the SessionRecorder
+        """
+        assert self.__session_recorder is None
+        assert self.__transport is None, "start_session_recording() called after start_transport()"
+
+        self.__session_recorder = SessionRecorder(filename)
+        if self.__shapeoko_port is not None:
+            self.__shapeoko_port = RecordingPort(self.__shapeoko_port, self.__session_recorder)
+
+        return self.__session_recorder
+
+    def stop_session_recording(self):
+        """
+        Stop the recording started by start_session_recording(), and write out the rest of the log.
+
+        :return:    nothing
+        """
+        assert self.__session_recorder is not None
+        assert self.__transport is None, "stop_session_recording() called before stop_transport()"
+
+        if isinstance(self.__shapeoko_port, RecordingPort):
+            self.__shapeoko_port = self.__shapeoko_port.port
+        self.__session_recorder.close()
+        self.__session_recorder = None
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
+    def start_status_poller(self, rate_hz=20.0):
+        """
+        Start polling GRBL's real-time status through the GrblTransport, so that get_machine_status(),
+        get_machine_position() and get_buffer_fill() report what the machine is actually doing.
 
-    Call this function like this:
+        Call this after start_transport().
 
-        assert move_x(new_x_value), "Useful message indicating where failure occurred"
+        :param rate_hz: status reports per second, e.g. 10.0 to 50.0
 
-    :param new_x:       new X position of tool
-    :param speed_mm_s:  speed in mm/s
+        :return:    the StatusPoller
+        """
+        assert self.__transport is not None
+        assert self.__status_poller is None
 
-    :return:    True -> success, False -> failure
+        self.__status_poller = StatusPoller(self.__transport, rate_hz)
+        self.__status_poller.start()
+
+        return self.__status_poller
+
+    def stop_status_poller(self):
+        """
+        Stop the StatusPoller started by start_status_poller().
+
+        :return:    nothing
+        """
+        assert self.__status_poller is not None
+
+        self.__status_poller.stop()
+        self.__status_poller = None
+
+    def get_machine_status(self):
+        """
+        Unlike curpos, which is where the tool was last told to go, this is where GRBL last reported it to be.
+
+        :return:    the latest status_poller.MachineStatus, or None if not polling or no report yet
+        """
+        assert self.flush_motion(), "get_machine_status() held-back move failed"
+
+        return None if self.__status_poller is None else self.__status_poller.status
+
+    def get_machine_position(self):
+        """
+        :return:    the tool's last reported position in the active coordinate system as a ToolPosition,
+                    or None if not known
+        """
+        machine_status = self.get_machine_status()
+        if machine_status is None or machine_status.wpos is None:
+            return None
+
+        x, y, z = machine_status.wpos
+        return ToolPosition(x=x, y=y, z=z)
+
+    def get_buffer_fill(self):
+        """
+        GRBL only reports its buffer state if enabled, with $10=2 or $10=3.
+
+        :return:    (planner blocks in use, receive buffer bytes in use) as last reported, or None if not known
+        """
+        machine_status = self.get_machine_status()
+        if machine_status is None or machine_status.planner_blocks_free is None:
+            return None
+
+        return (self.__planner_block_count - machine_status.planner_blocks_free,
+                self.__rx_buffer_size + 1 - machine_status.rx_bytes_free)
+
+    def transport_command(self, cmd_str, ack_callback=None, blocking=True):
+        """
+        Send a command through the GrblTransport.  Failures are printed when the response arrives.
+
+        :param cmd_str:         Shapeoko command string
+        :param ack_callback:    optional function of no arguments, called when the command is answered "ok"
+        :param blocking:        if True, wait for the response
+
+        :return:    True -> success (or, if not blocking, sent), False -> failure
+        """
+        assert self.__transport is not None
+
+        def on_done(future):
+            if future.ok:
+                if ack_callback is not None:
+                    ack_callback()
+            else:
+                self.__print("transport_command('{0}') RESPONSE_STR({1})".format(future.cmd_str,
+                                                                                 future.response_str))
+
+        self.__cmd_count += 1
+        future = self.__transport.send(cmd_str)
+        future.add_done_callback(on_done)
+
+        if not blocking:
+            return True
+
+        future.result(self.__response_timeout_s)
+        return future.ok
+
+    def issue_command(self, cmd_str, caller_str, ack_callback=None, blocking=False):
+        """
+        Send a command to the Shapeoko (through the GrblTransport, if started), streaming it if
+        streaming_enabled, otherwise awaiting its "ok".
+
+        If a failure is detected, sleep so the operator can examine the situation.
+
+        :param cmd_str:         Shapeoko command string
+        :param caller_str:      name of the calling function, used in the failure message
+        :param ack_callback:    optional function of no arguments, called when the command is answered "ok"
+        :param blocking:        if True, always wait for this command's response, even when streaming
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(cmd_str, str)
+        assert isinstance(caller_str, str)
+
+        responded = True
+        if blocking:
+            responded = self.flush_motion()     # the held-back move must go first
+
+        if self.__transport is not None:
+            responded = self.transport_command(cmd_str, ack_callback,
+                                               blocking or not self.__streaming_enabled) and responded
+        elif self.__streaming_enabled and not blocking:
+            responded = self.stream_command(cmd_str, ack_callback)
+        else:
+            responded = self.__drain_stream() and responded     # responses to streamed commands arrive first
+            self.output_and_log(cmd_str)
+            responded = self.read_port_await_str("ok") and responded
+            if responded and ack_callback is not None:
+                ack_callback()
+
+        if not responded:
+            self.__print("{0} RESPONSE STRING({1}) NOT RECEIVED".format(caller_str, "ok"))
+            time.sleep(self.__sleep_before_estop_s)
+
+        return responded
+
+    def query_command(self, cmd_str, caller_str):
+        """
+        Send a command whose answer includes feedback lines, e.g. "$G" -> "[GC:...]" or "G38.2 ..." -> "[PRB:...]",
+        and wait for its "ok".
+
+        If a failure is detected, sleep so the operator can examine the situation.
+
+        :param cmd_str:     Shapeoko command string
+        :param caller_str:  name of the calling function, used in the failure message
+
+        :return:    list of the [...] feedback lines answering the command, or None on failure
+        """
+        assert isinstance(cmd_str, str)
+        assert isinstance(caller_str, str)
+
+        responded = self.flush_motion()
+
+        if self.__transport is not None:
+            responded = self.__transport.drain(self.__response_timeout_s) and responded
+            self.__cmd_count += 1
+            future = self.__transport.send(cmd_str)
+            response_str = future.result(self.__response_timeout_s)
+            message_list = future.message_list
+        else:
+            responded = self.drain_stream() and responded
+            self.output_and_log(cmd_str)
+            message_list = []
+            response_str = self.read_response_line()
+            while response_str.startswith("[") or response_str.startswith("<"):
+                if response_str.startswith("["):
+                    message_list.append(response_str)
+                response_str = self.read_response_line()
+            if self.__command_metrics is not None:
+                self.__command_metrics.record_response(response_str)
+
+        if not responded or "ok" != response_str:
+            self.__print("{0} RESPONSE STRING({1}) NOT RECEIVED, RESPONSE_STR({2})".format(caller_str, "ok",
+                                                                                         response_str))
+            time.sleep(self.__sleep_before_estop_s)
+            return None
+
+        return message_list
+
+    def command(self, cmd_str, ack_callback=None, blocking=True):
+        """
+        issue_command(), waiting for the response unless blocking is False.
+
+        :return:    True -> success (or, if not blocking, sent), False -> failure
+        """
+        return self.issue_command(cmd_str, "command('{0}')".format(cmd_str), ack_callback, blocking)
+
+    def query(self, cmd_str):
+        """
+        query_command(), e.g. query("$G").
+
+        :return:    list of the [...] feedback lines answering the command, or None on failure
+        """
+        return self.query_command(cmd_str, "query('{0}')".format(cmd_str))
+
+    def issue_move(self, kind_str, axis_dict, speed_mm_s, caller_str):
+        """
+        Send a G00 or G01 move, which updates curpos when acknowledged.  If coalesce_motion, the move
+        may instead be held back to be merged with the next one, and sent by a later move or by
+        flush_motion(); see MotionQueue.
+
+        :param kind_str:    "G00" or "G01"
+        :param axis_dict:   axis name to new position, e.g. {"x": -10.0, "y": -20.0}
+        :param speed_mm_s:  speed in mm/s for G01, None for G00
+        :param caller_str:  name of the calling function, used in the failure message
+
+        :return:    True -> success, False -> failure
+        """
+        if not self.__coalesce_motion:
+            return self.issue_command(format_move(kind_str, axis_dict, speed_mm_s), caller_str,
+                                      self.curpos_updater(**axis_dict))
+
+        responded = True
+        for move in self.__motion_queue.add(kind_str, axis_dict, speed_mm_s):
+            responded = self.issue_command(format_move(move.kind_str, move.axis_dict, move.speed_mm_s), caller_str,
+                                           self.curpos_updater(**move.axis_dict)) and responded
+
+        return responded
+
+    def flush_motion(self):
+        """
+        Send the move held back by coalesce_motion, if any.  Every sensing read, every other command,
+        drain_stream() and close() call this first, so callers only need it to time a move exactly.
+
+        :return:    True -> success, False -> failure
+        """
+        responded = True
+        for move in self.__motion_queue.flush():
+            responded = self.issue_command(format_move(move.kind_str, move.axis_dict, move.speed_mm_s),
+                                           "flush_motion()", self.curpos_updater(**move.axis_dict)) and responded
+
+        return responded
+
+    def curpos_updater(self, x=None, y=None, z=None):
+        """
+        Make an ack_callback that records an acknowledged move in curpos.
+
+        :param x:   new X position of tool, or None if unchanged
+        :param y:   new Y position of tool, or None if unchanged
+        :param z:   new Z position of tool, or None if unchanged
+
+        :return:    function of no arguments
+        """
+        curpos = self.__curpos
+
+        def update_curpos():
+            if x is not None:
+                curpos.x = x
+            if y is not None:
+                curpos.y = y
+            if z is not None:
+                curpos.z = z
+
+        return update_curpos
+
+    def home_system(self):
+        """
+        Issue a Home command to the Shapeoko.  After this, the machine's coordinate system is usable.
+
+        If a failure is detected, sleep so the operator can examine the situation.
+        Since the loss of expected responses to commands indicates that the program does not know
+        the exact position of the device, the caller should immediately abort on a failure.
+
+        Call this method like this:
+
+            assert session.home_system(), "Useful message indicating where failure occurred"
+
+        :return:    True -> success, False -> not so much
+        """
+        responded = self.issue_command("$H", "home_system()", blocking=True)
+        self.__motion_queue.forget_position()   # the tool position in the coordinate system changes
+
+        return responded
+
+    def define_wcs2_to_current_mcs_in_eprom(self):
+        """
+        Set a coordinate system named "2" to the machine's current X, Y, and Z; record it in EPROM.
+
+        If a failure is detected, sleep so the operator can examine the situation.
+        Since the loss of expected responses to commands indicates that the program does not know
+        the exact position of the device, the caller should immediately abort on a failure.
+
+        :return:    True -> success, False -> failure
+        """
+        responded = self.issue_command("G10 L20 P2 X0 Y0 Z0", "define_wcs2_to_current_mcs()", blocking=True)
+        self.__motion_queue.forget_position()   # the tool position in the coordinate system changes
+
+        return responded
+
+    def set_wcs_to_wcs2(self):
+        """
+        Start using the coordinate system name "2" for subsequent G00 and G01 X, Y, Z commands.
+
+        If a failure is detected, sleep so the operator can examine the situation.
+        Since the loss of expected responses to commands indicates that the program does not know
+        the exact position of the device, the caller should immediately abort on a failure.
+
+        :return:    True -> success, False -> failure
+        """
+        responded = self.issue_command("G55", "set_wcs_to_current_mcs()", blocking=True)
+        self.__motion_queue.forget_position()   # the tool position in the coordinate system changes
+        if responded:
+            self.__wcs_str = "G55"
+
+        return responded
+
+    def move_x(self, new_x, speed_mm_s=1000.0):
+        """
+        Move tool to the new_x position at speed_mm_s.  Update curpos.x with new position.
+
+        :param new_x:       new X position of tool
+        :param speed_mm_s:  speed in mm/s
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_x, float)
+        if self.__verify_negative_values:
+            assert self.is_x_valid(new_x)
+        assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
+
+        return self.issue_move("G01", {"x": new_x}, speed_mm_s, "move_x()")
+
+    def move_y(self, new_y, speed_mm_s=1000.0):
+        """
+        Move tool to the new_y position at speed_mm_s.  Update curpos.y with new position.
+
+        :param new_y:       new Y position of tool
+        :param speed_mm_s:  speed in mm/s
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_y, float)
+        if self.__verify_negative_values:
+            assert self.is_y_valid(new_y)
+        assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
+
+        return self.issue_move("G01", {"y": new_y}, speed_mm_s, "move_y()")
+
+    def move_xy(self, new_x, new_y, speed_mm_s=1000.0):
+        """
+        Move tool to the (new_x, new_y) position at speed_mm_s.  Update curpos.x and curpos.y with new position.
+
+        :param new_x:       new X position of tool
+        :param new_y:       new Y position of tool
+        :param speed_mm_s:  speed in mm/s
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_x, float)
+        assert isinstance(new_y, float)
+        if self.__verify_negative_values:
+            assert self.is_x_valid(new_x)
+            assert self.is_y_valid(new_y)
+        assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
+
+        return self.issue_move("G01", {"x": new_x, "y": new_y}, speed_mm_s, "move_xy()")
+
+    def move_z(self, new_z, speed_mm_s=1000.0):
+        """
+        Move tool to the new_z position at speed_mm_s.  Update curpos.z with new position.
+
+        :param new_z:       new Z position of tool
+        :param speed_mm_s:  speed in mm/s
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_z, float)
+        if self.__verify_negative_values:
+            assert self.is_z_valid(new_z)
+        assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
+
+        return self.issue_move("G01", {"z": new_z}, speed_mm_s, "move_z()")
+
+    def goto_x(self, new_x):
+        """
+        Move tool to the new_x position at high speed.  Update curpos.x with new position.
+
+        :param new_x:       new X position of tool
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_x, float)
+        if self.__verify_negative_values:
+            assert self.is_x_valid(new_x)
+
+        return self.issue_move("G00", {"x": new_x}, None, "goto_x()")
+
+    def goto_y(self, new_y):
+        """
+        Move tool to the new_y position at high speed.  Update curpos.y with new position.
+
+        :param new_y:       new Y position of tool
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_y, float)
+        if self.__verify_negative_values:
+            assert self.is_y_valid(new_y)
+
+        return self.issue_move("G00", {"y": new_y}, None, "goto_y()")
+
+    def goto_xy(self, new_x, new_y):
+        """
+        Move tool to the (new_x, new_y) position at high speed.  Update curpos.x and curpos.y with new position.
+
+        :param new_x:       new X position of tool
+        :param new_y:       new Y position of tool
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_x, float)
+        assert isinstance(new_y, float)
+        if self.__verify_negative_values:
+            assert self.is_x_valid(new_x)
+            assert self.is_y_valid(new_y)
+
+        return self.issue_move("G00", {"x": new_x, "y": new_y}, None, "goto_xy()")
+
+    def goto_z(self, new_z):
+        """
+        Move tool to the new_z position at high speed.  Update curpos.z with new position.
+
+        :param new_z:       new Z position of tool
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(new_z, float)
+        if self.__verify_negative_values:
+            assert self.is_z_valid(new_z)
+
+        return self.issue_move("G00", {"z": new_z}, None, "goto_z()")
+
+    def probe_toward_z(self, new_z, speed_mm_s, kind_str="G38.2"):
+        """
+        Run one GRBL probe cycle along Z: move toward new_z at speed_mm_s until the probe pin changes.
+
+            G38.2   toward the surface until contact, ALARM if none        G38.3   same, no ALARM
+            G38.4   away from the surface until contact is lost, ALARM     G38.5   same, no ALARM
+
+        The tool stops just past the trigger point, so curpos.z is no longer known exactly afterwards.
+
+        :param new_z:       Z position at which to give up
+        :param speed_mm_s:  speed in mm/s
+        :param kind_str:    "G38.2", "G38.3", "G38.4" or "G38.5"
+
+        :return:    the trigger point as a ToolPosition in machine coordinates, or None if not triggered or failed
+        """
+        assert isinstance(new_z, float)
+        if self.__verify_negative_values:
+            assert self.is_z_valid(new_z)
+        assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
+        assert kind_str in ("G38.2", "G38.3", "G38.4", "G38.5")
+
+        message_list = self.query_command("{0} Z{1:3.3f} F{2:3.3f}".format(kind_str, new_z, speed_mm_s),
+                                          "probe_toward_z()")
+        self.__motion_queue.forget_position()   # GRBL continues from wherever the probe stopped the tool
+
+        if message_list is None:
+            return None
+
+        for message_str in message_list:
+            probe_report = parse_probe_report(message_str)
+            if probe_report is not None:
+                trigger_position, is_triggered = probe_report
+                return trigger_position if is_triggered else None
+
+        self.__print("probe_toward_z() PRB REPORT NOT RECEIVED")
+        return None
+
+    def probe_z(self, max_depth_mm, fast_speed_mm_s=200.0, slow_speed_mm_s=10.0, backoff_mm=1.0):
+        """
+        Find the surface below the tool with GRBL's probe cycle, the contact circuit being wired to the
+        controller's probe pin.  A fast approach finds the surface roughly, the tool backs off by backoff_mm,
+        and a slow approach touches it again precisely.  This is five commands, where stepping Z by
+        step_distance_mm with move_z() takes one per step.
+
+        The tool is returned to its starting height, curpos.z, afterwards.
+
+        Call this method like this:
+
+            contact_position = session.probe_z(max_depth_value)
+            assert contact_position is not None, "Useful message indicating where failure occurred"
+
+        :param max_depth_mm:        how far below curpos.z to search
+        :param fast_speed_mm_s:     speed of the first approach
+        :param slow_speed_mm_s:     speed of the precise approach
+        :param backoff_mm:          how far to back off between approaches
+
+        :return:    the contact point as a ToolPosition in machine coordinates (the WCS2 coordinates set up by
+                    define_wcs2_to_current_mcs_in_eprom() at home), or None if no contact or failure
+        """
+        assert isinstance(max_depth_mm, float) and 0.0 < max_depth_mm
+        assert isinstance(fast_speed_mm_s, float) and 1. <= fast_speed_mm_s <= 1000.
+        assert isinstance(slow_speed_mm_s, float) and 1. <= slow_speed_mm_s <= fast_speed_mm_s
+        assert isinstance(backoff_mm, float) and 0.0 < backoff_mm <= max_depth_mm
+        start_z = self.__curpos.z
+
+        rough_position = self.probe_toward_z(start_z - max_depth_mm, fast_speed_mm_s)
+        if rough_position is None:
+            return None
+
+        # The tool is just past the contact point, whose Z in the current coordinate system is not known: back off
+        # with a relative move, then touch again
+        responded = self.issue_command("G91 G01 Z{0:3.3f} F{1:3.3f}".format(backoff_mm, fast_speed_mm_s),
+                                       "probe_z()", blocking=True)
+        responded = self.issue_command("G90", "probe_z()", blocking=True) and responded
+        if not responded:
+            return None
+
+        contact_position = self.probe_toward_z(start_z - max_depth_mm, slow_speed_mm_s)
+
+        responded = self.issue_command("G00 Z{0:3.3f}".format(start_z), "probe_z()", self.curpos_updater(z=start_z),
+                                       blocking=True)
+
+        return contact_position if responded else None
+
+    def query_status_report(self):
+        """
+        Request a GRBL real-time status report, and return it.
+
+        :return:    the status report, e.g. "<Idle|MPos:0.000,0.000,0.000|FS:0,0>", or "" if none arrived
+        """
+        assert self.flush_motion(), "query_status_report() held-back move failed"
+
+        if self.__transport is not None:
+            report_str = self.__transport.query_status(self.__response_timeout_s)
+            return "" if report_str is None else report_str
+
+        assert self.drain_stream(), "query_status_report() streamed command failed"
+        self.__shapeoko_port.write("?")     # real-time command: acted on at once, answered without an "ok"
+        report_str = self.read_response_line()
+        while "" != report_str and not report_str.startswith("<"):
+            report_str = self.read_response_line()
+
+        return report_str
+
+    def wait_until_idle(self, poll_status=False):
+        """
+        Wait until the Shapeoko has finished executing every command sent so far.
+
+        GRBL answers a move with "ok" as soon as the move is in its planner, long before the tool gets
+        there.  A G4 P0 dwell is different: GRBL waits for the planner to empty before executing it,
+        so its "ok" arrives once the tool has stopped at the last commanded position.  This costs one
+        round trip, and is the barrier to use before taking a sensor reading at a commanded location.
+
+        Call this method like this:
+
+            assert session.wait_until_idle(), "Useful message indicating where failure occurred"
+
+        :param poll_status: if True, also poll "?" status reports until GRBL reports Idle
+
+        :return:    True -> success, False -> failure
+        """
+        assert isinstance(poll_status, bool)
+
+        responded = self.issue_command("G4 P0", "wait_until_idle()", blocking=True)
+
+        while responded and poll_status:
+            report_str = self.query_status_report()
+            if not report_str.startswith("<"):
+                self.__print("wait_until_idle() STATUS REPORT NOT RECEIVED")
+                time.sleep(self.__sleep_before_estop_s)
+                return False
+            if report_str.startswith("<Idle"):
+                break
+
+        return responded
+
+    def jiggle_xy(self, iterations=1):
+        """
+        Move tool around the current tool position in X and Y by minimal step distance
+
+        Superseded by wait_until_idle(), which synchronizes with a single command instead of five moves.
+
+        The Shapeoko/GRBL has a buffered input mechanism.  It receives the USB/Serial commands, and
+        can issue its OK response immediately, but schedules them as it chooses.  It also appears that
+        the G00 and G01 commands may sometimes be elided?!
+        Calling jiggle_xy() can help the caller maintain synchronization between the large command move
+        requests and the OK responses; this is useful when using the tool to take sensor readings at
+        commanded locations.
+
+        :return:    True
+        """
+        step_mm = self.__step_distance_mm
+        x1 = self.__curpos.x
+        y1 = self.__curpos.y
+        for i in range(iterations):
+            assert self.move_xy(x1 + step_mm, y1 + step_mm), "Failed to jiggle_xy() step 1"
+            assert self.move_x(x1 - step_mm), "Failed to jiggle_xy() step 2"
+            assert self.move_y(y1 - step_mm), "Failed to jiggle_xy() step 3"
+            assert self.move_x(x1 + step_mm), "Failed to jiggle_xy() step 4"
+            assert self.move_xy(x1, y1), "Failed to jiggle_xy() step 5"
+        return True
+
+    def __print(self, message_str):
+        if "" == self.__name_str:
+            print message_str
+        else:
+            print "{0}: {1}".format(self.name_str, message_str)
+
+
+# GLOBALS INCLUDE:
+#   curpos
+#   __default_session
+
+__default_session = ShapeokoSession(name_str="", verify_negative_values=VERIFY_NEGATIVE_VALUES)
+curpos = __default_session.curpos       # current position, updated by the default session
+
+
+def __session():
+    """
+    :return:    the default ShapeokoSession, with this module's settings as they are now
     """
-    assert isinstance(new_x, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert is_x_valid(new_x)
-    assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
-    global curpos
+    __default_session.configure(streaming_enabled=STREAMING_ENABLED,
+                                verify_negative_values=VERIFY_NEGATIVE_VALUES,
+                                coalesce_motion=COALESCE_MOTION,
+                                command_logging_enabled=COMMAND_LOGGING_ENABLED,
+                                x_min=XMIN, x_max=XMAX, y_min=YMIN, y_max=YMAX, z_min=ZMIN, z_max=ZMAX,
+                                step_distance_mm=STEP_DISTANCE_MM,
+                                sleep_before_estop_s=SLEEP_BEFORE_ESTOP,
+                                response_timeout_s=RESPONSE_TIMEOUT_S,
+                                transport_read_timeout_s=TRANSPORT_READ_TIMEOUT_S,
+                                resync_read_timeout_s=RESYNC_READ_TIMEOUT_S,
+                                rx_buffer_size=GRBL_RX_BUFFER_SIZE,
+                                planner_block_count=GRBL_PLANNER_BLOCK_COUNT)
+
+    return __default_session
 
-    output_and_log("G01 X{0:3.3f} F{1:3.3f}".format(new_x, speed_mm_s))
 
-    responded = read_port_await_str("ok")
+def is_x_valid(x):
+    """
+    ShapeokoSession.is_x_valid() of the default session
+    """
+    return __session().is_x_valid(x)
 
-    if not responded:
-        print "move_x() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.x = new_x
 
-    return responded
+def is_y_valid(y):
+    """
+    ShapeokoSession.is_y_valid() of the default session
+    """
+    return __session().is_y_valid(y)
 
 
-def move_y(new_y, speed_mm_s=1000.0):
+def read_3_reset_startup_lines():
+    """
+    ShapeokoSession.read_3_reset_startup_lines() of the default session
     """
-    Move tool to the new_y position at speed_mm_s.  Update curpos.y with new position.
+    return __session().read_3_reset_startup_lines()
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
 
-    Call this function like this:
+def connect_and_synchronize(port_str="/dev/ttyACM0", port=None):
+    """
+    ShapeokoSession.connect_and_synchronize() of the default session
+    """
+    return __session().connect_and_synchronize(port_str, port)
 
-        assert move_y(new_y_value), "Useful message indicating where failure occurred"
 
-    :param new_y:       new Y position of tool
-    :param speed_mm_s:  speed in mm/s
+def resynchronize(port_str=None, port=None, timeout_s=RESYNC_TIMEOUT_S):
+    """
+    ShapeokoSession.resynchronize() of the default session
+    """
+    return __session().resynchronize(port_str, port, timeout_s)
+
 
-    :return:    True -> success, False -> failure
+def read_response_line():
     """
-    assert isinstance(new_y, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert is_y_valid(new_y)
-    assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
-    global curpos
+    ShapeokoSession.read_response_line() of the default session
+    """
+    return __session().read_response_line()
 
-    output_and_log("G01 Y{0:3.3f} F{1:3.3f}".format(new_y, speed_mm_s))
 
-    responded = read_port_await_str("ok")
+def read_port_await_str(expected_response_str):
+    """
+    ShapeokoSession.read_port_await_str() of the default session
+    """
+    return __session().read_port_await_str(expected_response_str)
 
-    if not responded:
-        print "move_y() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.y = new_y
 
-    return responded
+def output_and_log(cmd_str):
+    """
+    ShapeokoSession.output_and_log() of the default session
+    """
+    return __session().output_and_log(cmd_str)
 
 
-def move_xy(new_x, new_y, speed_mm_s=1000.0):
+def service_stream_response():
+    """
+    ShapeokoSession.service_stream_response() of the default session
     """
-    Move tool to the (new_x, new_y) position at speed_mm_s.  Update curpos.x and curpos.y with new position.
+    return __session().service_stream_response()
+
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
+def stream_command(cmd_str, ack_callback=None):
+    """
+    ShapeokoSession.stream_command() of the default session
+    """
+    return __session().stream_command(cmd_str, ack_callback)
 
-    Call this function like this:
 
-        assert move_xy(new_x_value, new_y_value), "Useful message indicating where failure occurred"
+def drain_stream():
+    """
+    ShapeokoSession.drain_stream() of the default session
+    """
+    return __session().drain_stream()
 
-    :param new_x:       new X position of tool
-    :param new_y:       new Y position of tool
-    :param speed_mm_s:  speed in mm/s
 
-    :return:    True -> success, False -> failure
+def start_transport():
+    """
+    ShapeokoSession.start_transport() of the default session
     """
-    assert isinstance(new_x, float)
-    assert isinstance(new_y, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert is_x_valid(new_x)
-        assert is_y_valid(new_y)
-    assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
-    global curpos
+    return __session().start_transport()
 
-    output_and_log("G01 X{0:3.3f} Y{1:3.3f} F{2:3.3f}".format(new_x, new_y, speed_mm_s))
 
-    responded = read_port_await_str("ok")
+def stop_transport():
+    """
+    ShapeokoSession.stop_transport() of the default session
+    """
+    return __session().stop_transport()
 
-    if not responded:
-        print "move_xy() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.x = new_x
-        curpos.y = new_y
 
-    return responded
+def get_transport():
+    """
+    :return:    the GrblTransport started by start_transport(), or None
+    """
+    return __default_session.transport
 
 
-def move_z(new_z, speed_mm_s=1000.0):
+def enable_command_metrics():
     """
-    Move tool to the new_z position at speed_mm_s.  Update curpos.z with new position.
+    ShapeokoSession.enable_command_metrics() of the default session
+    """
+    return __session().enable_command_metrics()
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
 
-    Call this function like this:
+def get_command_metrics():
+    """
+    :return:    the CommandMetrics started by enable_command_metrics(), or None
+    """
+    return __default_session.command_metrics
 
-        assert move_z(new_z_value), "Useful message indicating where failure occurred"
 
-    :param new_z:       new Z position of tool
-    :param speed_mm_s:  speed in mm/s
+def start_session_recording(filename):
+    """
+    ShapeokoSession.start_session_recording() of the default session
+    """
+    return __session().start_session_recording(filename)
+
 
-    :return:    True -> success, False -> failure
+def stop_session_recording():
+    """
+    ShapeokoSession.stop_session_recording() of the default session
     """
-    assert isinstance(new_z, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert new_z <= XMIN
-    assert isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.
-    global curpos
+    return __session().stop_session_recording()
 
-    output_and_log("G01 Z{0:3.3f} F{1:3.3f}".format(new_z, speed_mm_s))
 
-    responded = read_port_await_str("ok")
+def start_status_poller(rate_hz=20.0):
+    """
+    ShapeokoSession.start_status_poller() of the default session
+    """
+    return __session().start_status_poller(rate_hz)
 
-    if not responded:
-        print "move_z() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.z = new_z
 
-    return responded
+def stop_status_poller():
+    """
+    ShapeokoSession.stop_status_poller() of the default session
+    """
+    return __session().stop_status_poller()
 
 
-def goto_x(new_x):
+def get_machine_status():
+    """
+    ShapeokoSession.get_machine_status() of the default session
     """
-    Move tool to the new_x position at speed_mm_s at high speed.    Update curpos.x with new position.
+    return __session().get_machine_status()
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
 
-    Call this function like this:
+def get_machine_position():
+    """
+    ShapeokoSession.get_machine_position() of the default session
+    """
+    return __session().get_machine_position()
+
 
-        assert goto_x(new_x_value), "Useful message indicating where failure occurred"
+def get_buffer_fill():
+    """
+    ShapeokoSession.get_buffer_fill() of the default session
+    """
+    return __session().get_buffer_fill()
 
-    :param new_x:       new X position of tool
 
-    :return:    True -> success, False -> failure
+def transport_command(cmd_str, ack_callback=None, blocking=True):
+    """
+    ShapeokoSession.transport_command() of the default session
     """
-    assert isinstance(new_x, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert is_x_valid(new_x)
-    global curpos
+    return __session().transport_command(cmd_str, ack_callback, blocking)
 
-    output_and_log("G00 X{0:3.3f}".format(new_x))
 
-    responded = read_port_await_str("ok")
+def issue_command(cmd_str, caller_str, ack_callback=None, blocking=False):
+    """
+    ShapeokoSession.issue_command() of the default session
+    """
+    return __session().issue_command(cmd_str, caller_str, ack_callback, blocking)
 
-    if not responded:
-        print "goto_x() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.x = new_x
 
-    return responded
+def query_command(cmd_str, caller_str):
+    """
+    ShapeokoSession.query_command() of the default session
+    """
+    return __session().query_command(cmd_str, caller_str)
 
 
-def goto_y(new_y):
+def issue_move(kind_str, axis_dict, speed_mm_s, caller_str):
     """
-    Move tool to the new_y position at speed_mm_s at high speed.    Update curpos.y with new position.
+    ShapeokoSession.issue_move() of the default session
+    """
+    return __session().issue_move(kind_str, axis_dict, speed_mm_s, caller_str)
+
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
+def flush_motion():
+    """
+    ShapeokoSession.flush_motion() of the default session
+    """
+    return __session().flush_motion()
 
-    Call this function like this:
 
-        assert goto_y(new_y_value), "Useful message indicating where failure occurred"
+def get_motion_queue():
+    """
+    :return:    the MotionQueue used when COALESCE_MOTION, e.g. for its merged and dropped counts
+    """
+    return __default_session.motion_queue
 
-    :param new_y:       new Y position of tool
 
-    :return:    True -> success, False -> failure
+def curpos_updater(x=None, y=None, z=None):
+    """
+    ShapeokoSession.curpos_updater() of the default session
     """
-    assert isinstance(new_y, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert is_y_valid(new_y)
-    global curpos
+    return __session().curpos_updater(x, y, z)
 
-    output_and_log("G00 Y{0:3.3f}".format(new_y))
 
-    responded = read_port_await_str("ok")
+def home_system():
+    """
+    ShapeokoSession.home_system() of the default session
+    """
+    return __session().home_system()
 
-    if not responded:
-        print "goto_y() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.y = new_y
 
-    return responded
+def define_wcs2_to_current_mcs_in_eprom():
+    """
+    ShapeokoSession.define_wcs2_to_current_mcs_in_eprom() of the default session
+    """
+    return __session().define_wcs2_to_current_mcs_in_eprom()
 
 
-def goto_xy(new_x, new_y):
+def set_wcs_to_wcs2():
+    """
+    ShapeokoSession.set_wcs_to_wcs2() of the default session
     """
-    Move tool to the (new_x, new_y) position at speed_mm_s at high speed.
-    Update curpos.x and curpos.y with new position.
+    return __session().set_wcs_to_wcs2()
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
 
-    Call this function like this:
+def move_x(new_x, speed_mm_s=1000.0):
+    """
+    ShapeokoSession.move_x() of the default session
+    """
+    return __session().move_x(new_x, speed_mm_s)
+
 
-        assert goto_xy(new_z_value, new_y_value), "Useful message indicating where failure occurred"
+def move_y(new_y, speed_mm_s=1000.0):
+    """
+    ShapeokoSession.move_y() of the default session
+    """
+    return __session().move_y(new_y, speed_mm_s)
 
-    :param new_x:       new X position of tool
-    :param new_y:       new Y position of tool
 
-    :return:    True -> success, False -> failure
+def move_xy(new_x, new_y, speed_mm_s=1000.0):
+    """
+    ShapeokoSession.move_xy() of the default session
     """
-    assert isinstance(new_x, float)
-    assert isinstance(new_y, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert is_x_valid(new_x)
-        assert is_y_valid(new_y)
-    global curpos
+    return __session().move_xy(new_x, new_y, speed_mm_s)
 
-    output_and_log("G00 X{0:3.3f} Y{1:3.3f}".format(new_x, new_y))
 
-    responded = read_port_await_str("ok")
+def move_z(new_z, speed_mm_s=1000.0):
+    """
+    ShapeokoSession.move_z() of the default session
+    """
+    return __session().move_z(new_z, speed_mm_s)
 
-    if not responded:
-        print "goto_x() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.x = new_x
-        curpos.y = new_y
 
-    return responded
+def goto_x(new_x):
+    """
+    ShapeokoSession.goto_x() of the default session
+    """
+    return __session().goto_x(new_x)
 
 
-def goto_z(new_z):
+def goto_y(new_y):
+    """
+    ShapeokoSession.goto_y() of the default session
     """
-    Move tool to the new_z position at speed_mm_s at high speed.    Update curpos.z with new position.
+    return __session().goto_y(new_y)
 
-    If a failure is detected, sleep so the operator can examine the situation.
-    Since the loss of expected responses to commands indicates that the program does not know
-    the exact position of the device, the caller should immediately abort on a failure.
 
-    Call this function like this:
+def goto_xy(new_x, new_y):
+    """
+    ShapeokoSession.goto_xy() of the default session
+    """
+    return __session().goto_xy(new_x, new_y)
 
-        assert goto_z(new_z_value), "Useful message indicating where failure occurred"
 
-    :param new_z:       new Z position of tool
+def goto_z(new_z):
+    """
+    ShapeokoSession.goto_z() of the default session
+    """
+    return __session().goto_z(new_z)
+
 
-    :return:    True -> success, False -> failure
+def probe_toward_z(new_z, speed_mm_s, kind_str="G38.2"):
     """
-    assert isinstance(new_z, float)
-    if VERIFY_NEGATIVE_VALUES:
-        assert new_z <= ZMIN
-    global curpos
+    ShapeokoSession.probe_toward_z() of the default session
+    """
+    return __session().probe_toward_z(new_z, speed_mm_s, kind_str)
 
-    output_and_log("G00 Z{0:3.3f}".format(new_z))
 
-    responded = read_port_await_str("ok")
+def probe_z(max_depth_mm, fast_speed_mm_s=200.0, slow_speed_mm_s=10.0, backoff_mm=1.0):
+    """
+    ShapeokoSession.probe_z() of the default session
+    """
+    return __session().probe_z(max_depth_mm, fast_speed_mm_s, slow_speed_mm_s, backoff_mm)
 
-    if not responded:
-        print "goto_z() RESPONSE STRING({0}) NOT RECEIVED".format("ok")
-        time.sleep(SLEEP_BEFORE_ESTOP)
-    else:
-        curpos.z = new_z
 
-    return responded
+def query_status_report():
+    """
+    ShapeokoSession.query_status_report() of the default session
+    """
+    return __session().query_status_report()
 
 
-def jiggle_xy(iterations=1):
+def wait_until_idle(poll_status=False):
     """
-    Move tool around the current tool position in X and Y by minimal step distance
+    ShapeokoSession.wait_until_idle() of the default session
+    """
+    return __session().wait_until_idle(poll_status)
 
-    The Shapeoko/GRBL has a buffered input mechanism.  It receives the USB/Serial commands, and
-    can issue its OK response immediately, but schedules them as it chooses.  It also appears that
-    the G00 and G01 commands may sometimes be elided?!
-    Calling jiggle_xy() can help the caller maintain synchronization between the large command move
-    requests and the OK responses; this is useful when using the tool to take sensor readings at
-    commanded locations.
 
-    :return:    True
+def jiggle_xy(iterations=1):
+    """
+    ShapeokoSession.jiggle_xy() of the default session
     """
-    x1 = curpos.x
-    y1 = curpos.y
-    for i in range(iterations):
-        assert move_xy(x1 + STEP_DISTANCE_MM, y1 + STEP_DISTANCE_MM), "Failed to jiggle_xy() step 1"
-        assert move_x(x1 - STEP_DISTANCE_MM), "Failed to jiggle_xy() step 2"
-        assert move_y(y1 - STEP_DISTANCE_MM), "Failed to jiggle_xy() step 3"
-        assert move_x(x1 + STEP_DISTANCE_MM), "Failed to jiggle_xy() step 4"
-        assert move_xy(x1, y1), "Failed to jiggle_xy() step 5"
-    return True
+    return __session().jiggle_xy(iterations)
 
 
 if "__main__" == __name__:
+    enable_command_metrics()
     connect_and_synchronize()   # Initializes __shapeoko_port and curpos for subsequent commands
     assert home_system()        # This moves the tool to the back-right corner of the table
 
@@ -627,74 +1801,76 @@ if "__main__" == __name__:
 
     print "Issuing the move_xy() calls to move to the 4 corners."
     assert move_xy(XMIN, YMIN)  # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_xy(XMAX, YMIN)  # back left
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_xy(XMAX, YMAX)  # front left
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_xy(XMIN, YMAX)  # front right
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_xy(XMIN, YMIN)  # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the goto_xy() calls to move to the 4 corners."
     assert goto_xy(XMIN, YMIN)  # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_xy(XMAX, YMIN)  # back left
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_xy(XMAX, YMAX)  # front left
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_xy(XMIN, YMAX)  # front right
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_xy(XMIN, YMIN)  # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the move_x() calls to move to the X-axis extents."
     assert move_x(XMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_x(XMAX)     # back left
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_x(XMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the goto_x() calls to move to the X-axis extents."
     assert goto_x(XMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_x(XMAX)     # back left
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_x(XMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the move_y() calls to move to the Y-axis extents."
     assert move_y(YMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_y(YMAX)     # front right
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_y(YMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the goto_y() calls to move to the Y-axis extents."
     assert goto_y(YMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_y(YMAX)     # front right
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_y(YMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the move_z() calls to move along the Z-axis by 10 mm."
     assert move_z(ZMIN)     # back right (home)
-    jiggle_xy()             # when manipulating Z, still use jiggle_xy()
+    assert wait_until_idle()
     assert move_z(ZMIN - 10.0)
-    jiggle_xy()
+    assert wait_until_idle()
     assert move_z(ZMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     time.sleep(1)
     print "Issuing the goto_z() calls to move along the Z-axis by 10 mm."
     assert goto_z(ZMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_z(ZMIN - 10.0)
-    jiggle_xy()
+    assert wait_until_idle()
     assert goto_z(ZMIN)     # back right (home)
-    jiggle_xy()
+    assert wait_until_idle()
     print "Test Complete."
+    print
+    get_command_metrics().dump()
 
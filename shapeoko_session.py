@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+Drive several Shapeokos from one process.
+
+A shapeoko_commands.ShapeokoSession owns everything for one controller: its serial port, GrblTransport,
+tool position, command counter, metrics and settings.  A SessionManager runs the same job on several
+sessions at once, one thread each, so a fleet job takes as long as the slowest machine rather than the sum.
+
+    python shapeoko_session.py /dev/ttyACM0 /dev/ttyACM1 ...
+"""
+
+from planar_fit import IncrementalPlaneFit
+from planar_fit import NOISE_STD_MM
+from shapeoko_commands import ShapeokoSession
+from shapeoko_commands import XMAX, XMIN, YMAX, YMIN
+import sys
+import threading
+import time
+
+
+class SessionResult(object):
+    """
+    Outcome of running a job on one session.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.result = None
+        self.exception = None
+        self.elapsed_s = 0.0
+
+    @property
+    def succeeded(self):
+        return self.exception is None
+
+
+class SessionManager(object):
+    """
+    A set of ShapeokoSessions, and a way to run one job on all of them concurrently.
+    """
+    def __init__(self, session_list):
+        assert isinstance(session_list, list) and 1 <= len(session_list)
+        assert all([isinstance(session, ShapeokoSession) for session in session_list])
+        assert len(set([session.name_str for session in session_list])) == len(session_list)
+        self.__session_list = session_list
+
+    @property
+    def session_list(self):
+        return self.__session_list
+
+    def connect_all(self):
+        """
+        Connect every session, concurrently.
+
+        :return:    dict of session name to SessionResult
+        """
+        return self.run_all(lambda session: session.connect())
+
+    def close_all(self):
+        """
+        :return:    dict of session name to SessionResult, whose result is each session's close()
+        """
+        return self.run_all(lambda session: session.close())
+
+    def run_all(self, job, *args):
+        """
+        Run job(session, *args) on every session at once, one thread per session, and wait for all to finish.
+        An exception (e.g. a failed assert) ends only the job of the session that raised it.
+
+        :param job:     function of a ShapeokoSession (and args)
+        :param args:    further arguments for job
+
+        :return:    dict of session name to SessionResult, in session order
+        """
+        result_list = [SessionResult(session) for session in self.__session_list]
+
+        def run_one(session_result):
+            start_time = time.time()
+            try:
+                session_result.result = job(session_result.session, *args)
+            except Exception as e:
+                session_result.exception = e
+                print "{0}: JOB FAILED: {1!r}".format(session_result.session.name_str, e)
+            session_result.elapsed_s = time.time() - start_time
+
+        thread_list = [threading.Thread(target=run_one, args=(session_result,), name=session_result.session.name_str)
+                       for session_result in result_list]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+
+        return dict((session_result.session.name_str, session_result) for session_result in result_list)
+
+
+def probe_survey(session, xy_list, max_depth_mm, safe_z=0.0, plane_fit=None, slope_tolerance=1e-5,
+                 noise_std_mm=NOISE_STD_MM):
+    """
+    A calibration sweep: probe the surface at each (x, y), as planar_fit.py's depth data.
+
+    :param session:         ShapeokoSession, connected and homed
+    :param xy_list:         list of (x, y) tuples of floats
+    :param max_depth_mm:    how far below safe_z to search for the surface
+    :param safe_z:          height for traverses between points
+    :param plane_fit:       if not None, a planar_fit.IncrementalPlaneFit fed each point; the sweep
+                            stops early once its tilt is stable to within slope_tolerance
+    :param slope_tolerance: see IncrementalPlaneFit.is_stable()
+    :param noise_std_mm:    see IncrementalPlaneFit.is_stable()
+
+    :return:    list of (x, y, z) contact points
+    """
+    assert isinstance(xy_list, list)
+    assert plane_fit is None or isinstance(plane_fit, IncrementalPlaneFit)
+    sample_list = []
+    assert session.goto_z(safe_z), "{0}: probe_survey() failed to raise the tool".format(session.name_str)
+    for x, y in xy_list:
+        assert session.goto_xy(x, y), "{0}: probe_survey() failed to reach ({1}, {2})".format(session.name_str, x, y)
+        contact_position = session.probe_z(max_depth_mm)
+        assert contact_position is not None, "{0}: probe_survey() no contact at ({1}, {2})".format(
+            session.name_str, x, y)
+        sample_list.append((x, y, contact_position.z))
+        if plane_fit is not None:
+            plane_fit.add(x, y, contact_position.z)
+            if plane_fit.is_stable(slope_tolerance, noise_std_mm=noise_std_mm):
+                break
+    return sample_list
+
+
+if "__main__" == __name__:
+    if len(sys.argv) <= 1:
+        print "Usage python shapeoko_session.py <port> [<port> ...]"
+        print "Homes each Shapeoko, then probes the table at its four corners, all machines at once."
+        exit(1)
+
+    manager = SessionManager([ShapeokoSession(port_str) for port_str in sys.argv[1:]])
+    manager.connect_all()
+    manager.run_all(lambda session: session.home_system() and session.define_wcs2_to_current_mcs_in_eprom())
+
+    corner_list = [(XMIN, YMIN), (XMAX, YMIN), (XMAX, YMAX), (XMIN, YMAX)]
+    start_time = time.time()
+    result_dict = manager.run_all(probe_survey, corner_list, 100.0)
+    elapsed_s = time.time() - start_time
+
+    for name_str, session_result in sorted(result_dict.items()):
+        print
+        print "{0}: {1:.1f} s, {2} commands".format(name_str, session_result.elapsed_s,
+                                                     session_result.session.cmd_count)
+        if session_result.succeeded:
+            for x, y, z in session_result.result:
+                print "    {0:.3f},{1:.3f},{2:.3f}".format(x, y, z)
+    print
+    print "All machines: {0:.1f} s".format(elapsed_s)
+
+    manager.close_all()
@@ -0,0 +1,256 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import threading
+import time
+
+
+DEFAULT_RATE_HZ = 20.0
+
+
+class MachineStatus(object):
+    """
+    One parsed GRBL 1.1 real-time status report, e.g.
+
+        <Run|MPos:-10.000,-20.000,-5.000|Bf:12,101|FS:600,0|WCO:0.000,0.000,0.000>
+
+    Fields GRBL did not send are None.  GRBL reports either MPos or WPos (see $10), and sends WCO
+    only every so often, so StatusPoller fills in the other position from the last WCO it saw.
+    Which fields appear is set by $10: Bf (buffer state) needs $10=2 or 3.
+    """
+    __slots__ = ("__state_str", "__mpos", "__wpos", "__wco", "__feed_mm_min", "__spindle_rpm",
+                 "__planner_blocks_free", "__rx_bytes_free", "__pins_str", "__timestamp")
+
+    def __init__(self, state_str, mpos=None, wpos=None, wco=None, feed_mm_min=None, spindle_rpm=None,
+                 planner_blocks_free=None, rx_bytes_free=None, pins_str="", timestamp=0.0):
+        assert isinstance(state_str, str)
+        self.__state_str = state_str
+        self.__mpos = mpos
+        self.__wpos = wpos
+        self.__wco = wco
+        self.__feed_mm_min = feed_mm_min
+        self.__spindle_rpm = spindle_rpm
+        self.__planner_blocks_free = planner_blocks_free
+        self.__rx_bytes_free = rx_bytes_free
+        self.__pins_str = pins_str
+        self.__timestamp = timestamp
+
+    @property
+    def state_str(self):        # "Idle", "Run", "Hold:0", "Alarm", "Home", ...
+        return self.__state_str
+
+    @property
+    def mpos(self):             # (x, y, z) machine position
+        return self.__mpos
+
+    @property
+    def wpos(self):             # (x, y, z) work position, i.e. in the active coordinate system
+        return self.__wpos
+
+    @property
+    def wco(self):              # (x, y, z) work coordinate offset: mpos - wpos
+        return self.__wco
+
+    @property
+    def feed_mm_min(self):
+        return self.__feed_mm_min
+
+    @property
+    def spindle_rpm(self):
+        return self.__spindle_rpm
+
+    @property
+    def planner_blocks_free(self):
+        return self.__planner_blocks_free
+
+    @property
+    def rx_bytes_free(self):
+        return self.__rx_bytes_free
+
+    @property
+    def pins_str(self):         # input pins triggered, e.g. "P" for the probe
+        return self.__pins_str
+
+    @property
+    def timestamp(self):        # time.time() when the report was read
+        return self.__timestamp
+
+    @property
+    def is_idle(self):
+        return "Idle" == self.__state_str
+
+    def with_wco(self, wco):
+        """
+        :param wco: last known work coordinate offset, used if this report did not include one
+
+        :return:    a MachineStatus with wco, mpos and wpos all filled in, if possible
+        """
+        if self.__wco is not None or wco is None:
+            wco = self.__wco
+        mpos, wpos = self.__mpos, self.__wpos
+        if wco is not None:
+            if mpos is None and wpos is not None:
+                mpos = tuple(w + o for w, o in zip(wpos, wco))
+            elif wpos is None and mpos is not None:
+                wpos = tuple(m - o for m, o in zip(mpos, wco))
+        return MachineStatus(self.__state_str, mpos, wpos, wco, self.__feed_mm_min, self.__spindle_rpm,
+                             self.__planner_blocks_free, self.__rx_bytes_free, self.__pins_str, self.__timestamp)
+
+
+def parse_status_report(report_str, timestamp=0.0):
+    """
+    Parse a GRBL 1.1 real-time status report.
+
+    :param report_str:  the report line, "<...>"
+    :param timestamp:   time.time() when the report was read
+
+    :return:    MachineStatus, or None if report_str is not a well-formed status report
+    """
+    assert isinstance(report_str, str)
+    if not (report_str.startswith("<") and report_str.endswith(">")):
+        return None
+
+    field_list = report_str[1:-1].split("|")
+    value_dict = {}
+    try:
+        for field_str in field_list[1:]:
+            name_str, _, value_str = field_str.partition(":")
+            if name_str in ("MPos", "WPos", "WCO"):
+                value_dict[name_str] = tuple(float(v) for v in value_str.split(","))
+            elif "Bf" == name_str:
+                value_dict["Bf"] = tuple(int(v) for v in value_str.split(","))
+            elif "FS" == name_str:
+                value_dict["FS"] = tuple(float(v) for v in value_str.split(","))
+            elif "F" == name_str:
+                value_dict["FS"] = (float(value_str), None)
+            elif "Pn" == name_str:
+                value_dict["Pn"] = value_str
+    except ValueError:
+        return None
+
+    planner_blocks_free, rx_bytes_free = value_dict.get("Bf", (None, None))
+    feed_mm_min, spindle_rpm = value_dict.get("FS", (None, None))
+
+    return MachineStatus(field_list[0], value_dict.get("MPos"), value_dict.get("WPos"), value_dict.get("WCO"),
+                         feed_mm_min, spindle_rpm, planner_blocks_free, rx_bytes_free,
+                         value_dict.get("Pn", ""), timestamp)
+
+
+class StatusPoller(object):
+    """
+    Polls GRBL's real-time status at rate_hz through a GrblTransport, keeping the latest report.
+
+    "?" is a real-time command, so polling does not disturb commands in flight.  Each report
+    replaces the snapshot with a new immutable MachineStatus in a single reference assignment,
+    so readers never wait on a lock and never see a half-updated report.
+    """
+    def __init__(self, transport, rate_hz=DEFAULT_RATE_HZ):
+        assert transport is not None
+        assert isinstance(rate_hz, float) and 0.0 < rate_hz
+        self.__transport = transport
+        self.__rate_hz = rate_hz
+        self.__status = None
+        self.__wco = None
+        self.__update_count = 0
+        self.__listener_list = []
+        self.__stop_event = threading.Event()
+        self.__poll_thread = None
+
+    @property
+    def status(self):           # latest MachineStatus, or None before the first report
+        return self.__status
+
+    @property
+    def update_count(self):
+        return self.__update_count
+
+    @property
+    def rate_hz(self):
+        return self.__rate_hz
+
+    def add_listener(self, listener):
+        """
+        :param listener:    called as listener(machine_status) for every report, on the transport's reader thread
+        """
+        self.__listener_list.append(listener)
+
+    def start(self):
+        """
+        Start listening for reports, and the polling thread.
+
+        :return:    nothing
+        """
+        assert self.__poll_thread is None
+        self.__transport.add_status_listener(self.__on_status_report)
+        self.__stop_event.clear()
+        self.__poll_thread = threading.Thread(target=self.__poll_loop, name="StatusPoller")
+        self.__poll_thread.daemon = True
+        self.__poll_thread.start()
+
+    def stop(self):
+        """
+        Stop the polling thread, and listening for reports.  The last snapshot remains readable.
+
+        :return:    nothing
+        """
+        self.__stop_event.set()
+        if self.__poll_thread is not None:
+            self.__poll_thread.join()
+            self.__poll_thread = None
+            self.__transport.remove_status_listener(self.__on_status_report)
+
+    def wait_for_update(self, timeout=None):
+        """
+        Wait for a report newer than the current snapshot.
+
+        :param timeout: seconds to wait, None -> forever
+
+        :return:    the new MachineStatus, or None on timeout
+        """
+        update_count = self.__update_count
+        deadline = None if timeout is None else time.time() + timeout
+        while self.__update_count == update_count:
+            if deadline is not None and deadline <= time.time():
+                return None
+            time.sleep(0.5 / self.__rate_hz)
+        return self.__status
+
+    def __poll_loop(self):
+        period = 1.0 / self.__rate_hz
+        next_time = time.time()
+        while not self.__stop_event.is_set():
+            self.__transport.send_realtime("?")
+            next_time += period
+            self.__stop_event.wait(max(next_time - time.time(), 0.0))
+
+    def __on_status_report(self, report_str, timestamp):
+        machine_status = parse_status_report(report_str, timestamp)
+        if machine_status is None:
+            return
+        if machine_status.wco is not None:
+            self.__wco = machine_status.wco
+        machine_status = machine_status.with_wco(self.__wco)
+
+        self.__status = machine_status
+        self.__update_count += 1
+        for listener in self.__listener_list:
+            listener(machine_status)
@@ -0,0 +1,217 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2018 Bryan Webb
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+    associated documentation files (the "Software"), to deal in the Software without restriction,
+    including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense,
+    and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all copies
+        or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+        INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+        AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+        DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""
+A tool path as one (N, 3) float64 array of X, Y, Z points.
+
+A probe plan of tens of thousands of points as a list of ToolPositions is tens of thousands of
+objects, each checked one ordinate at a time by is_x_valid()/is_y_valid() as it is sent.  A ToolPath
+holds the plan as a single array and validates all of it in one vectorized pass, so an out-of-range
+point is caught before the first move rather than halfway through the plan.
+
+The limits are those of a shapeoko_commands.ShapeokoSession, by default of the session driven by the
+shapeoko_commands functions.  They are read when validating, so an override of ZMAX is honoured.
+"""
+
+from shapeoko_commands import ToolPosition
+import numpy as np
+import shapeoko_commands
+
+
+def __limits(session):
+    """
+    :return:    (x_min, x_max, y_min, y_max, z_min, z_max, step_distance_mm) of session, or of the
+                shapeoko_commands functions' session if None
+    """
+    if session is None:
+        sc = shapeoko_commands
+        return sc.XMIN, sc.XMAX, sc.YMIN, sc.YMAX, sc.ZMIN, sc.ZMAX, sc.STEP_DISTANCE_MM
+    return session.limits + (session.step_distance_mm,)
+
+
+def x_valid_mask(x, session=None):
+    """
+    :param x:       array of positions on the X axis
+    :param session: ShapeokoSession whose limits apply, default that of the shapeoko_commands functions
+
+    :return:    boolean array, True where is_x_valid() would be
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x_min, x_max, _, _, _, _, step_distance_mm = __limits(session)
+    return (x_max - step_distance_mm <= x) & (x <= x_min + step_distance_mm)
+
+
+def y_valid_mask(y, session=None):
+    """
+    :param y:       array of positions on the Y axis
+    :param session: ShapeokoSession whose limits apply, default that of the shapeoko_commands functions
+
+    :return:    boolean array, True where is_y_valid() would be
+    """
+    y = np.asarray(y, dtype=np.float64)
+    _, _, y_min, y_max, _, _, step_distance_mm = __limits(session)
+    return (y_max - step_distance_mm <= y) & (y <= y_min + step_distance_mm)
+
+
+def z_valid_mask(z, session=None):
+    """
+    Z must be at or below ZMIN, as move_z() and goto_z() assert, and, once ZMAX is set for the tool,
+    no lower than ZMAX.
+
+    :param z:       array of positions on the Z axis
+    :param session: ShapeokoSession whose limits apply, default that of the shapeoko_commands functions
+
+    :return:    boolean array, True where valid
+    """
+    z = np.asarray(z, dtype=np.float64)
+    _, _, _, _, z_min, z_max, step_distance_mm = __limits(session)
+    mask = z <= z_min
+    if z_max is not None:
+        mask &= z_max - step_distance_mm <= z
+    return mask
+
+
+class ToolPath(object):
+    """
+    A sequence of tool positions, backed by an (N, 3) float64 array.
+    """
+    def __init__(self, point_array):
+        """
+        :param point_array: (N, 3) array, or list of (x, y, z) tuples; copied
+        """
+        points = np.array(point_array, dtype=np.float64)
+        if 0 == points.size:
+            points = points.reshape(0, 3)
+        assert 2 == points.ndim and 3 == points.shape[1], "ToolPath() points are not (N, 3)"
+        self.__points = points
+        self.__points.flags.writeable = False
+
+    @classmethod
+    def from_xy(cls, xy_array, z):
+        """
+        :param xy_array:    (N, 2) array of points, e.g. a ProbeRoute's point_array
+        :param z:           Z of every point
+
+        :return:    ToolPath
+        """
+        xy = np.asarray(xy_array, dtype=np.float64)
+        assert 2 == xy.ndim and 2 == xy.shape[1]
+        assert isinstance(z, float)
+        return cls(np.column_stack((xy, np.full(len(xy), z))))
+
+    @classmethod
+    def from_positions(cls, position_list):
+        """
+        :param position_list:   list of ToolPositions
+
+        :return:    ToolPath
+        """
+        return cls([(position.x, position.y, position.z) for position in position_list])
+
+    @property
+    def points(self):           # read-only (N, 3) array
+        return self.__points
+
+    @property
+    def x(self):                # read-only view of the X column
+        return self.__points[:, 0]
+
+    @property
+    def y(self):
+        return self.__points[:, 1]
+
+    @property
+    def z(self):
+        return self.__points[:, 2]
+
+    def __len__(self):
+        return len(self.__points)
+
+    def __getitem__(self, i):
+        """
+        :param i:   index, or slice
+
+        :return:    the i'th point as a ToolPosition, or a slice as a ToolPath
+        """
+        if isinstance(i, slice):
+            return ToolPath(self.__points[i])
+        x, y, z = self.__points[i].tolist()
+        return ToolPosition(x=x, y=y, z=z)
+
+    def __iter__(self):
+        for x, y, z in self.__points.tolist():
+            yield ToolPosition(x=x, y=y, z=z)
+
+    def length_mm(self):
+        """
+        :return:    straight-line length of the path
+        """
+        return float(np.sum(np.sqrt(np.sum(np.diff(self.__points, axis=0) ** 2, axis=1))))
+
+    def invalid_indices(self, check_z=True, session=None):
+        """
+        :param check_z: if False, only X and Y are checked, e.g. for a plan of XY probe targets
+        :param session: ShapeokoSession whose limits apply, default that of the shapeoko_commands functions
+
+        :return:    array of the indices of the points outside the machine's limits
+        """
+        mask = x_valid_mask(self.x, session) & y_valid_mask(self.y, session)
+        if check_z:
+            mask &= z_valid_mask(self.z, session)
+        return np.flatnonzero(~mask)
+
+    def validate(self, check_z=True, session=None):
+        """
+        Assert that every point is within the machine's limits, naming the first few that are not.
+
+        :param check_z: if False, only X and Y are checked
+        :param session: ShapeokoSession whose limits apply, default that of the shapeoko_commands functions
+
+        :return:    nothing
+        """
+        bad_indices = self.invalid_indices(check_z, session)
+        assert 0 == len(bad_indices), "ToolPath.validate() {0} points out of range, e.g. {1}".format(
+            len(bad_indices), ", ".join(["#{0} {1}".format(i, tuple(self.__points[i])) for i in bad_indices[:5]]))
+
+
+def move_along(tool_path, speed_mm_s=1000.0, session=None):
+    """
+    Validate the whole path, then move the tool through each point in turn, as move_x() etc. would.
+    A point out of range fails before any motion.
+
+    :param tool_path:   ToolPath
+    :param speed_mm_s:  speed in mm/s, or None to traverse with G00
+    :param session:     ShapeokoSession to drive, default that of the shapeoko_commands functions
+
+    :return:    True -> success, False -> failure
+    """
+    assert isinstance(tool_path, ToolPath)
+    assert speed_mm_s is None or (isinstance(speed_mm_s, float) and 1. <= speed_mm_s <= 1000.)
+    tool_path.validate(session=session)
+
+    issue_move = shapeoko_commands.issue_move if session is None else session.issue_move
+    kind_str = "G00" if speed_mm_s is None else "G01"
+    for x, y, z in tool_path.points.tolist():
+        if not issue_move(kind_str, {"x": x, "y": y, "z": z}, speed_mm_s, "move_along()"):
+            return False
+
+    return True